@@ -0,0 +1,247 @@
+"""
+Admission control: per-client rate limits and load shedding
+
+Runs before any route code. A client over its rate gets 429, and a request
+that waited too long for a thread, or arrives while the worker is already
+busy, gets 503, both with Retry-After, so an overloaded worker answers in
+microseconds instead of queueing until connections are refused.
+
+Signed-in users are limited by user id and anonymous visitors by a random
+id in their session cookie. Requests without one (a first visit, or a
+client that drops cookies) share a bucket per IP address with a much
+higher allowance, so a campus network behind one address isn't limited as
+one client; new ids are only handed out on requests charged to that
+bucket, so minting fresh cookies doesn't get around it.
+
+All state is in process: each worker keeps its own token buckets and
+in-flight count, so rates and caps are per worker process.
+"""
+import math
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from flask import g, jsonify, request, session
+from flask_login import current_user
+from metrics import metrics
+
+
+# Endpoints that scan or score many spots, or call other services
+EXPENSIVE_ENDPOINTS = {
+    'main.get_parking_spots',
+    'main.filter_parking_spots',
+    'main.get_parking_spot_clusters',
+    'main.search_parking_spots',
+    'main.get_recommendations',
+    'main.get_recommendations_batch',
+    'main.get_route',
+    'main.import_parking_spots'
+}
+
+# Never limited: the metrics scraper, long-lived event streams and static files
+EXEMPT_ENDPOINTS = {'main.get_metrics', 'main.stream_occupancy', 'static'}
+
+# Endpoints with their own rate limit, the rest share the 'default' one
+RATE_LIMIT_BUCKETS = {
+    'main.search_parking_spots': 'search',
+    'main.get_recommendations': 'recommendations',
+    'main.get_recommendations_batch': 'recommendations'
+}
+
+# How much of the in-flight cap each priority may fill, so when the worker is
+# busy anonymous scans are shed first and signed-in users' cheap calls last
+PRIORITY_SHARE = {
+    'high': 1.0,  # signed in, cheap endpoint
+    'normal': 0.75,  # signed in and expensive, or anonymous and cheap
+    'low': 0.5  # anonymous and expensive
+}
+
+# Set by gunicorn_workers.QueueTimedWorker to when gunicorn queued the request for a thread
+QUEUED_AT_HEADER = 'X-Parkandgo-Queued-At'
+
+# Session key of an anonymous visitor's rate limit id
+CLIENT_ID_KEY = 'client_id'
+
+
+class RateLimiter:
+    """
+    Non-blocking token buckets by client key
+    Only the max_clients most recently seen clients are kept; a forgotten
+    client starts again with a full bucket
+    """
+
+    def __init__(self, rate, burst, max_clients=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def acquire(self, key):
+        """
+        Take a token for key; returns 0 if allowed, else seconds until one is available
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated_at) * self.rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class AdmissionControl:
+    """
+    Decides, before routing, whether this worker takes a request
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.max_in_flight = 4
+        self.max_queue_wait = None
+        self.retry_after = 1
+        self.limiters = {}
+        self.ip_limiters = {}
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+        self.rejected = metrics.counter(
+            'parkandgo_admission_rejected_total',
+            'Requests turned away before routing, by reason and priority',
+            labels=('reason', 'priority')
+        )
+        metrics.gauge(
+            'parkandgo_requests_in_flight',
+            'Requests being handled by this worker, not counting exempt ones',
+            lambda: {(): self.in_flight}
+        )
+
+    def init_app(self, app):
+        self.enabled = app.config['ADMISSION_ENABLED']
+        self.max_in_flight = app.config['ADMISSION_MAX_IN_FLIGHT']
+        self.max_queue_wait = app.config['ADMISSION_MAX_QUEUE_WAIT']
+        self.retry_after = app.config['ADMISSION_RETRY_AFTER']
+        max_clients = app.config['ADMISSION_MAX_CLIENTS']
+        multiplier = app.config['ADMISSION_IP_RATE_MULTIPLIER']
+        self.limiters = {
+            name: RateLimiter(rate, burst, max_clients)
+            for name, (rate, burst) in app.config['ADMISSION_RATE_LIMITS'].items()
+        }
+        self.ip_limiters = {
+            name: RateLimiter(rate * multiplier, burst * multiplier, max_clients)
+            for name, (rate, burst) in app.config['ADMISSION_RATE_LIMITS'].items()
+        }
+        if not self.enabled:
+            return
+        app.before_request(self._admit)
+        app.after_request(self._issue_client_id)
+        app.teardown_request(self._release)
+
+    def priority(self, endpoint, authenticated):
+        expensive = endpoint in EXPENSIVE_ENDPOINTS
+        if authenticated:
+            return 'normal' if expensive else 'high'
+        return 'low' if expensive else 'normal'
+
+    # ============= REQUEST HOOKS =============
+    def _admit(self):
+        endpoint = request.endpoint
+        # Unmatched URLs go on to their 404
+        if endpoint is None or endpoint in EXEMPT_ENDPOINTS:
+            return None
+
+        authenticated = current_user.is_authenticated
+        priority = self.priority(endpoint, authenticated)
+
+        # Waited so long for a thread, here or at the proxy, that the client has
+        # likely given up; lower priorities are shed after a shorter wait
+        waits = [
+            wait for wait in (
+                queue_wait(request.headers.get(QUEUED_AT_HEADER)),
+                queue_wait(request.headers.get('X-Request-Start'))
+            ) if wait is not None
+        ]
+        if (self.max_queue_wait is not None and waits
+                and max(waits) > self.max_queue_wait * PRIORITY_SHARE[priority]):
+            return self._reject(503, 'queue_timeout', priority, self.retry_after)
+
+        limiters = self.limiters
+        new_client = False
+        if authenticated:
+            client = f'user:{current_user.get_id()}'
+        elif session.get(CLIENT_ID_KEY):
+            client = f'anon:{session[CLIENT_ID_KEY]}'
+        else:
+            client = f'ip:{request.remote_addr}'
+            limiters = self.ip_limiters
+            new_client = True
+        bucket = RATE_LIMIT_BUCKETS.get(endpoint, 'default')
+        limiter = limiters.get(bucket)
+        wait = limiter.acquire(client) if limiter is not None else 0.0
+        if wait:
+            return self._reject(429, 'rate_limited', priority, math.ceil(wait))
+
+        with self._lock:
+            if self.in_flight >= self.max_in_flight * PRIORITY_SHARE[priority]:
+                overloaded = True
+            else:
+                overloaded = False
+                self.in_flight += 1
+        if overloaded:
+            return self._reject(503, 'overloaded', priority, self.retry_after)
+        g.admitted = True
+        # Only on admitted requests, so ids can't be minted faster than the IP's rate
+        g.issue_client_id = new_client
+        return None
+
+    def _issue_client_id(self, response):
+        """
+        Give an anonymous visitor without one a rate limit id, except on
+        responses shared caches may store, which must not set cookies
+        """
+        if g.pop('issue_client_id', False) and not response.cache_control.public:
+            session[CLIENT_ID_KEY] = secrets.token_urlsafe(16)
+        return response
+
+    def _release(self, exc):
+        if g.pop('admitted', False):
+            with self._lock:
+                self.in_flight -= 1
+
+    def _reject(self, status, reason, priority, retry_after):
+        self.rejected.inc(reason, priority)
+        response = jsonify({
+            'status': 'error',
+            'message': 'Too many requests, slow down' if status == 429 else 'Server busy, try again shortly'
+        })
+        response.status_code = status
+        response.headers['Retry-After'] = str(retry_after)
+        return response
+
+
+def queue_wait(header):
+    """
+    Seconds since a queued-at timestamp, from our gunicorn worker or a proxy's
+    X-Request-Start ("t=" prefix optional, in seconds, milliseconds or
+    microseconds since the epoch), None without one
+    """
+    if not header:
+        return None
+    try:
+        started = float(header.strip().removeprefix('t='))
+    except ValueError:
+        return None
+    if started > 1e14:
+        started /= 1e6
+    elif started > 1e11:
+        started /= 1e3
+    return max(time.time() - started, 0.0)
+
+
+admission = AdmissionControl()
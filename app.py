@@ -1,106 +1,218 @@
-from flask import Flask, render_template, jsonify, request, redirect, url_for
+from startup import StartupReport, IMPORTED_AT
+from flask import Flask, Blueprint, Response, current_app, render_template, jsonify, request, redirect, url_for, stream_with_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_login import LoginManager, login_required, logout_user, current_user
 from config import Config
-from models import db, ParkingSpot, User, MajorCampusMapping
-from auth import init_auth
-import requests
-from functools import lru_cache
+from models import db, ParkingSpot
+from auth import init_auth, get_google_auth, prefetch_google_discovery
+from spot_cache import spot_cache, bump_spot_data_version, SPOT_FIELDS
+from scoring import build_scoring_engine, MAX_DISTANCE
+from buildings import build_walking_matrix
+from spatial import build_spatial_index
+from search_index import build_search_index
+from tiles import build_tile_index, MAX_TILE_ZOOM
+from clusters import build_cluster_index
+from geocoding import geocode_queue
+from routing import route_service, ROUTE_PROFILES, RoutingError
+from user_cache import user_cache
+from recommendation_cache import recommendation_cache
+from spot_import import import_spots, SpotImportError
+from occupancy import occupancy_tracker
+from http_cache import conditional_json, negotiate_encoding
+from serialization import parse_fields, spot_fragments, spot_list_body, list_body, with_keys, dumps
+from metrics import metrics
+from outbound import outbound
+from admission import admission
+import io
+from math import radians, sin, cos, sqrt, atan2
 
 
-# Flask App
-app = Flask(__name__)
-app.config.from_object(Config)
+# Blueprint holding every route, registered on the app by create_app
+bp = Blueprint('main', __name__)
 
-# Initialize database
-db.init_app(app)
-
-# Initialize Flask-Login
+# Flask-Login, bound to the app in create_app
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'index'
+login_manager.login_view = 'main.index'
 
-# Initialize Google OAuth
-google_auth = init_auth(app)
+# ============= APP FACTORY =============
+def create_app(config_object=Config):
+    """
+    Build the Flask app without touching the database or the network
+    The engine connects on first use and GoogleAuth is created on first login,
+    so importing this module is cheap; schema and seed data are handled by
+    `flask --app app bootstrap`
+    """
+    startup = StartupReport('create_app')
+    startup.record('imports', startup.started - IMPORTED_AT)
 
-# Initialize database and seed data
-with app.app_context():
-    try:
-        # Create tables if they don't exist
-        db.create_all()
-        print("Database tables are ready")
-        
-        # Check if we need to seed data
-        from models import ParkingSpot
+    with startup.phase('config'):
+        app = Flask(__name__)
+        app.config.from_object(config_object)
+        if app.config['TRUSTED_PROXY_HOPS']:
+            app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_HOPS'])
+
+    # Engine only, no connection is opened until the first query
+    with startup.phase('database'):
+        db.init_app(app)
+
+    # Request, SQL and pool metrics (served at /metrics)
+    with startup.phase('metrics'):
+        metrics.init_app(app)
+
+    # Limits for calls to Nominatim, OSRM and Google, set before any client is created
+    with startup.phase('outbound'):
+        outbound.init_app(app)
+
+    with startup.phase('login'):
+        login_manager.init_app(app)
+        user_cache.init_app(app)
+        recommendation_cache.init_app(app)
+
+    # Rate limits and load shedding, checked before every route
+    with startup.phase('admission'):
+        admission.init_app(app)
+
+    # Google OAuth, created lazily on first use
+    with startup.phase('google_auth'):
+        init_auth(app)
+
+    # In-memory parking spot snapshot, the background geocoder for user-submitted spots,
+    # the OSRM route cache and live occupancy
+    with startup.phase('spot_cache'):
+        spot_cache.init_app(app)
+        geocode_queue.init_app(app)
+        route_service.init_app(app)
+        occupancy_tracker.init_app(app)
+
+    with startup.phase('routes'):
+        app.register_blueprint(bp)
+        app.cli.command('bootstrap')(bootstrap)
+
+    app.extensions['startup_report'] = startup
+    startup.report()
+    return app
+
+def bootstrap():
+    """
+    Create or upgrade the schema and seed an empty database (run once per deploy)
+    """
+    from migrations import upgrade, current_version
+    from init_db import init_database
+
+    startup = StartupReport('bootstrap')
+    with startup.phase('migrations'):
+        applied = upgrade()
+        print(f"Applied {len(applied)} migration(s), database is at migration {current_version()}")
+    with startup.phase('seed'):
         if not ParkingSpot.query.first():
             print("No data found, running seed...")
-            from init_db import init_database
-            init_database()
+            init_database(current_app._get_current_object())
         else:
             print("Database already has data")
-            
-    except Exception as e:
-        print(f"Database initialization note: {e}")
-        print("This might be normal if tables already exist")
+    startup.report()
+
+def warm_caches(app):
+    """
+    Load the spot snapshot and its derived indexes, e.g. in the gunicorn parent
+    before forking so every worker starts with them in shared memory
+    """
+    startup = StartupReport('warm_caches')
+    with app.app_context():
+        with startup.phase('spot_snapshot'):
+            snapshot = spot_cache.get()
+        for name, build in (
+            ('search_index', build_search_index),
+            ('spatial_index', build_spatial_index),
+            ('walking_matrix', build_walking_matrix),
+            ('scoring_engine', build_scoring_engine),
+            ('tile_index', build_tile_index),
+            ('cluster_index', build_cluster_index),
+        ):
+            with startup.phase(name):
+                snapshot.derived(name, build)
+        # Connections must not be shared with forked workers
+        db.engine.dispose()
+    startup.report()
+
+def prepare_worker(app):
+    """
+    Per-process setup once a worker has the app
+    Drops pooled connections inherited from a preloading parent, warms Google discovery
+    and starts pulling occupancy estimates flushed by other workers
+    """
+    with app.app_context():
+        db.engine.dispose(close=False)
+    occupancy_tracker.start()
+    if app.config.get('GOOGLE_DISCOVERY_PREFETCH'):
+        prefetch_google_discovery(app)
+
 # ============= FLASK-LOGIN USER LOADER =============
 @login_manager.user_loader
 def load_user(user_id):
     """
     Flask-Login uses this to reload the user object from the user ID stored in the session
+    Served from user_cache for most requests, so no database round trip
     """
-    return User.query.get(int(user_id))
+    return user_cache.load(int(user_id))
 # ============= GEOCODING HELPER =============
-@lru_cache(maxsize=100)
 def geocode_address(address):
     """
     Convert an address to latitude/longitude using Nominatim API
-    Cached to avoid repeated API calls for same address
+    Cached in the geocode_cache table shared by every worker; failures aren't
+    cached, so a later call tries again. Blocks on the Nominatim rate limit, so prefer geocode_queue off the request path
     """
     try:
-        url = "https://nominatim.openstreetmap.org/search"
-        params = {
-            'q': address,
-            'format': 'json',
-            'limit': 1
-        }
-        headers = {
-            'User-Agent': 'ParkAndGo-UMN-App/1.0'
-        }
-        
-        response = requests.get(url, params=params, headers=headers, timeout=5)
-        data = response.json()
-        
-        if data and len(data) > 0:
-            return {
-                'lat': float(data[0]['lat']),
-                'lon': float(data[0]['lon'])
-            }
-        return None
+        return geocode_queue.lookup(address)
     except Exception as e:
         print(f"Geocoding error: {e}")
         return None
 
+# ============= METRICS =============
+metrics.register_cache('user', lambda: (user_cache.hits, user_cache.misses))
+metrics.register_cache('geocode_db', lambda: (geocode_queue.cache_hits, geocode_queue.cache_misses))
+metrics.register_cache('route', lambda: (route_service.cache.hits, route_service.cache.misses))
+metrics.register_cache('recommendations', lambda: (recommendation_cache.hits, recommendation_cache.misses))
+
+@bp.route('/metrics')
+def get_metrics():
+    """
+    Prometheus scrape endpoint, numbers are for the worker that answers
+    """
+    token = current_app.config.get('METRICS_TOKEN')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({
+            'status': 'error',
+            'message': 'Unauthorized'
+        }), 401
+    if not metrics.enabled:
+        return jsonify({
+            'status': 'error',
+            'message': 'Metrics are disabled'
+        }), 404
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 # ============= ROUTES =============
-@app.route('/')
+@bp.route('/')
 def index():
     """Home page route"""
     return render_template('index.html')
 
 # ============= AUTHENTICATION ROUTES =============
-@app.route('/login')
+@bp.route('/login')
 def login():
     """
     Redirect user to Google's login page
     """
-    login_url = google_auth.get_login_url()
+    login_url = get_google_auth().get_login_url()
     return redirect(login_url)
 
-@app.route('/login/callback')
+@bp.route('/login/callback')
 def callback():
     """
     Handle callback from Google after user logs in
     """
     # Get user from Google
-    user = google_auth.handle_callback()
+    user = get_google_auth().handle_callback()
     
     if user:
         # Log the user in
@@ -109,22 +221,22 @@ def callback():
         
         # Redirect based on whether profile is complete
         if user.is_profile_complete():
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
-            return redirect(url_for('complete_profile'))
+            return redirect(url_for('main.complete_profile'))
     else:
         return "Login failed", 400
 
-@app.route('/logout')
+@bp.route('/logout')
 @login_required
 def logout():
     """
     Log out the current user
     """
     logout_user()
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/complete-profile')
+@bp.route('/complete-profile')
 @login_required
 def complete_profile():
     """
@@ -133,7 +245,7 @@ def complete_profile():
     return render_template('index.html')
 
 # ============= API ROUTES =============
-@app.route('/api/current-user')
+@bp.route('/api/current-user')
 def get_current_user():
     """
     Get current logged-in user info
@@ -150,7 +262,7 @@ def get_current_user():
         })
     
 # ============= UPDATE USER PROFILE =============
-@app.route('/api/update-profile', methods=['POST'])
+@bp.route('/api/update-profile', methods=['POST'])
 @login_required
 def update_profile():
     """
@@ -172,6 +284,9 @@ def update_profile():
             current_user.preferred_parking_types = data['preferred_parking_types']
         
         db.session.commit()
+        user_cache.invalidate(current_user.user_id)
+        # Cached recommendations are keyed by profile segment, so the updated
+        # profile looks up a different entry and never sees the old ranking
         
         return jsonify({
             'status': 'success',
@@ -186,51 +301,320 @@ def update_profile():
         }), 500
     
 # ============= GET ALL PARKING SPOTS =============
-@app.route('/api/parking-spots', methods=['GET'])
+@bp.route('/api/parking-spots', methods=['GET'])
 def get_parking_spots():
-    """API route to get all parking spots"""
+    """
+    API route to get all parking spots
+    Optional keyset pagination: ?limit=N, then ?limit=N&cursor=<next_cursor> for the next page
+    ?format=ndjson streams one spot per line straight from the database, for exports
+    ?fields=spot_id,latitude,longitude,cost returns only those fields of each spot
+    Supports If-None-Match; the body is only rebuilt when the spot data changes
+    """
     try:
-        spots = ParkingSpot.query.all()
-        spots_data = [spot.to_dict() for spot in spots]
+        limit = request.args.get('limit', type=int)
+        cursor = request.args.get('cursor', type=int)
+        output_format = request.args.get('format', 'json')
 
-        return jsonify({
-            'status': 'success',
-            'count': len(spots_data),
-            'data': spots_data
-        })
+        if limit is not None and limit < 1:
+            return jsonify({
+                'status': 'error',
+                'message': 'limit must be a positive integer'
+            }), 400
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        if output_format == 'ndjson':
+            return stream_parking_spots_ndjson(cursor, limit, fields)
+        if output_format != 'json':
+            return jsonify({
+                'status': 'error',
+                'message': 'format must be json or ndjson'
+            }), 400
+
+        snapshot = spot_cache.get()
+
+        def build_payload():
+            # Bodies are joined from per-spot JSON fragments cached on the snapshot
+            if limit is None and cursor is None:
+                return spot_list_body(snapshot, snapshot.records, fields)
+
+            max_limit = current_app.config['SPOT_PAGE_MAX_LIMIT']
+            page = snapshot.page(cursor, min(limit or max_limit, max_limit))
+            has_more = bool(page) and page[-1].spot_id != snapshot.spot_ids[-1]
+            return spot_list_body(snapshot, page, fields, next_cursor=page[-1].spot_id if has_more else None)
+
+        return conditional_json(snapshot.version, build_payload)
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
         }), 500
     
+def stream_parking_spots_ndjson(cursor, limit, fields=None):
+    """
+    Stream spots as newline-delimited JSON in spot_id order
+    Rows are fetched in batches through a server-side cursor, so memory use
+    stays flat no matter how many spots there are
+    """
+    query = db.select(*[getattr(ParkingSpot, field) for field in fields or SPOT_FIELDS]).order_by(ParkingSpot.spot_id)
+    if cursor is not None:
+        query = query.where(ParkingSpot.spot_id > cursor)
+    if limit is not None:
+        query = query.limit(limit)
+    query = query.execution_options(yield_per=current_app.config['SPOT_EXPORT_BATCH_SIZE'])
+
+    def generate():
+        for row in db.session.execute(query):
+            yield current_app.json.dumps(dict(row._mapping)) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 # ============= FILTER PARKING SPOTS =============
-@app.route('/api/parking-spots/filter', methods=['GET'])
+@bp.route('/api/parking-spots/filter', methods=['GET'])
 def filter_parking_spots():
-    """API route to filter parking spots based on query parameters"""
+    """
+    API route to filter parking spots based on query parameters
+    ?fields= picks the spot fields returned, as for /api/parking-spots
+    Supports If-None-Match; the body is only rebuilt when the spot data changes
+    """
     try:
-        query = ParkingSpot.query
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        snapshot = spot_cache.get()
 
         # Get query parameters
         campus_location = request.args.get('campus')
         parking_type = request.args.get('type')
         max_cost = request.args.get('max_cost', type=float)
 
-        # Apply filters
-        if campus_location:
-            query = query.filter(ParkingSpot.campus_location == campus_location)
-        if parking_type:
-            query = query.filter(ParkingSpot.parking_type == parking_type)
-        if max_cost is not None:
-            query = query.filter(ParkingSpot.cost <= max_cost)
+        def build_payload():
+            spots = snapshot.records
+
+            # Apply filters
+            if campus_location:
+                spots = [spot for spot in spots if spot.campus_location == campus_location]
+            if parking_type:
+                spots = [spot for spot in spots if spot.parking_type == parking_type]
+            if max_cost is not None:
+                spots = [spot for spot in spots if spot.cost is not None and spot.cost <= max_cost]
 
-        filtered_spots = query.all()
-        spots_data = [spot.to_dict() for spot in filtered_spots]
+            return spot_list_body(snapshot, spots, fields)
+
+        return conditional_json(snapshot.version, build_payload)
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+# ============= NEARBY PARKING SPOTS =============
+@bp.route('/api/parking-spots/nearby', methods=['GET'])
+def get_nearby_parking_spots():
+    """
+    API route to get the parking spots closest to a point
+    Query parameters: lat, lon, k (default 10, max 100), radius_mi (optional), fields (optional)
+    """
+    try:
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        lat = request.args.get('lat', type=float)
+        lon = request.args.get('lon', type=float)
+        k = request.args.get('k', default=10, type=int)
+        radius_mi = request.args.get('radius_mi', type=float)
+
+        if lat is None or lon is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'lat and lon are required'
+            }), 400
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return jsonify({
+                'status': 'error',
+                'message': 'lat and lon are out of range'
+            }), 400
+
+        k = max(1, min(k, 100))
+        snapshot = spot_cache.get()
+        spatial_index = snapshot.derived('spatial_index', build_spatial_index)
+        fragments = spot_fragments(snapshot)
+
+        spots_data = [
+            with_keys(fragments.get(spot, fields), distance_mi=round(distance, 3))
+            for distance, spot in spatial_index.nearest(lat, lon, k, radius_mi)
+        ]
+        return Response(list_body(spots_data), mimetype='application/json')
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+# ============= CLUSTERED PARKING SPOTS =============
+@bp.route('/api/parking-spots/clusters', methods=['GET'])
+def get_parking_spot_clusters():
+    """
+    API route to get clustered parking spots for a map view
+    Query parameters: bbox (west,south,east,north), zoom
+    Low zooms return clusters with point_count and cost range, high zooms individual spots
+    ?fields= picks the fields of individual spots, e.g. spot_id,latitude,longitude,cost for the map
+    """
+    try:
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
+        zoom = request.args.get('zoom', type=float)
+        try:
+            west, south, east, north = (float(value) for value in request.args.get('bbox', '').split(','))
+        except ValueError:
+            west = None
+
+        if west is None or zoom is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'bbox (west,south,east,north) and zoom are required'
+            }), 400
+        if not (-180 <= west <= east <= 180 and -90 <= south <= north <= 90):
+            return jsonify({
+                'status': 'error',
+                'message': 'bbox is out of range'
+            }), 400
+
+        snapshot = spot_cache.get()
+
+        def build_payload():
+            cluster_index = snapshot.derived('cluster_index', build_cluster_index)
+            fragments = spot_fragments(snapshot)
+            clusters_data = [
+                with_keys(fragments.get(node.record, fields), type='spot') if node.record is not None
+                else dumps(node.to_dict())
+                for node in cluster_index.query(west, south, east, north, zoom)
+            ]
+            return list_body(clusters_data)
+
+        return conditional_json(snapshot.version, build_payload)
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+# ============= MAP TILES =============
+@bp.route('/api/tiles/<int:z>/<int:x>/<int:y>', methods=['GET'])
+def get_spot_tile(z, x, y):
+    """
+    API route to get one Mapbox Vector Tile of parking spots (layer 'spots')
+    Empty tiles are 204 No Content; ETags only change when a spot lands in the tile
+    """
+    try:
+        if z > MAX_TILE_ZOOM or not (0 <= x < (1 << z) and 0 <= y < (1 << z)):
+            return jsonify({
+                'status': 'error',
+                'message': 'Tile is out of range'
+            }), 404
+
+        tile = spot_cache.get().derived('tile_index', build_tile_index).tile(z, x, y)
+        if tile is None:
+            response = Response(status=204)
+        else:
+            encoding = negotiate_encoding(request.accept_encodings, len(tile))
+            tags = {name: tile.etag if name == 'identity' else f'{tile.etag}-{name}'
+                    for name in ('identity', 'gzip', 'br')}
+            if request.if_none_match and any(request.if_none_match.contains_weak(tag) for tag in tags.values()):
+                response = Response(status=304)
+            else:
+                response = Response(tile.body(encoding), mimetype='application/vnd.mapbox-vector-tile')
+                if encoding != 'identity':
+                    response.headers['Content-Encoding'] = encoding
+            response.set_etag(tags[encoding])
+            response.vary.add('Accept-Encoding')
+
+        response.headers['Cache-Control'] = f"public, max-age={current_app.config['TILE_MAX_AGE']}"
+        return response
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+# ============= ROUTING =============
+@bp.route('/api/route', methods=['GET'])
+def get_route():
+    """
+    API route to get directions from a point to a parking spot
+    Query parameters: from (lat,lon), to (spot_id), mode (driving or walking, default driving)
+    The origin is snapped to a coarse grid and routes are served from a shared cache
+    """
+    try:
+        mode = request.args.get('mode', 'driving')
+        spot_id = request.args.get('to', type=int)
+        try:
+            lat, lon = (float(value) for value in request.args.get('from', '').split(','))
+        except ValueError:
+            lat = None
+
+        if lat is None or spot_id is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'from (lat,lon) and to (spot_id) are required'
+            }), 400
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return jsonify({
+                'status': 'error',
+                'message': 'from is out of range'
+            }), 400
+        if mode not in ROUTE_PROFILES:
+            return jsonify({
+                'status': 'error',
+                'message': f"mode must be one of: {', '.join(ROUTE_PROFILES)}"
+            }), 400
+
+        spot = spot_cache.get().by_id.get(spot_id)
+        if spot is None or not spot.has_coordinates():
+            return jsonify({
+                'status': 'error',
+                'message': 'Parking spot not found or has no coordinates yet'
+            }), 404
+
+        try:
+            route, origin, was_cached = route_service.route(lat, lon, spot, mode)
+        except RoutingError as e:
+            print(f"Routing error: {e}")
+            return jsonify({
+                'status': 'error',
+                'message': 'Routing service is unavailable, try again shortly'
+            }), 502
+
+        if route is None:
+            return jsonify({
+                'status': 'error',
+                'message': 'No route found'
+            }), 404
 
         return jsonify({
             'status': 'success',
-            'count': len(spots_data),
-            'data': spots_data
+            'data': {
+                'spot_id': spot_id,
+                'mode': mode,
+                'origin': list(origin),
+                'distance': route['distance'],
+                'duration': route['duration'],
+                'geometry': route['geometry'],
+                'cached': was_cached
+            }
         })
     except Exception as e:
         return jsonify({
@@ -238,7 +622,7 @@ def filter_parking_spots():
             'message': str(e)
         }), 500
 # ============= USER LOCATION ACCESS =============
-@app.route ('/api/user-location', methods=['POST'])
+@bp.route ('/api/user-location', methods=['POST'])
 @login_required
 def save_user_location():
     """
@@ -276,10 +660,8 @@ def save_user_location():
 def calculate_distance(lat1, lon1, lat2, lon2):
     """
     Calculate distance between two coordinates using Haversine formula
-    Returns distance in kilometers
+    Returns distance in miles
     """
-    from math import radians, sin, cos, sqrt, atan2
-    
     EARTHS_RADIUS = 3959 # earths radius in miles
     
     lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
@@ -294,10 +676,13 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     return distance
 
 # Calculate spot score function
-def calculate_spot_score(spot, user, user_lat, user_lon, selected_spot_id):
+def calculate_spot_score(spot, user, user_lat, user_lon, selected_spot_id, walking_matrix=None, occupancy=None):
     """
     Calculate a score for a parking spot based on multiple factors
     Higher score = better recommendation
+    Reference version of scoring.SpotScoringEngine.score - keep the two in step
+    walking_matrix defaults to the one for the current spot snapshot, occupancy
+    to the latest published occupancy estimates
     """
     score = 0
 
@@ -323,12 +708,38 @@ def calculate_spot_score(spot, user, user_lat, user_lon, selected_spot_id):
     # Factor 4:  verfified parking spot bounus - weight 10%
     if spot.is_verified:
         score += 10
+    # Factor 5: walk from the spot to the nearest building for the user's major - weight 20
+    if user.major:
+        if walking_matrix is None:
+            walking_matrix = spot_cache.get().derived('walking_matrix', build_walking_matrix)
+        walk_minutes = walking_matrix.walk_minutes_to_major(spot.spot_id, user.major)
+        if walk_minutes is not None:
+            # Anything further than a 15 minute walk gets no credit
+            max_walk_minutes = 15
+            score += (max_walk_minutes - min(walk_minutes, max_walk_minutes)) / max_walk_minutes * 20
+    # Factor 6: how full the spot is right now, from recent reports - weight 20
+    if occupancy is None:
+        occupancy = occupancy_tracker.snapshot()
+    spot_occupancy = occupancy.get(spot.spot_id)
+    if spot_occupancy is not None:
+        score -= spot_occupancy * 20
     # Penalty - algorithm shouldn't recommend spots the user just searched for
     if spot.spot_id == selected_spot_id:
         score -= 40
     return score
 
-@app.route('/api/recommendations', methods=['GET', 'POST'])
+def nearby_candidates(snapshot, engine, user_lat, user_lon, nearby_only):
+    """
+    Engine positions of the spots within MAX_DISTANCE of the user, to prune
+    to before scoring, or None to score every spot
+    """
+    if not nearby_only or user_lat is None or user_lon is None:
+        return None
+    spatial_index = snapshot.derived('spatial_index', build_spatial_index)
+    nearby = spatial_index.within(user_lat, user_lon, MAX_DISTANCE)
+    return engine.candidate_positions(spot for _, spot in nearby)
+
+@bp.route('/api/recommendations', methods=['GET', 'POST'])
 @login_required
 def get_recommendations():
     """
@@ -336,12 +747,15 @@ def get_recommendations():
     Accepts: {
         "selected_spot_id": int,
         "user_lat": float,
-        "user_lon": float
+        "user_lon": float,
+        "nearby_only": bool (optional, only consider spots within 2 miles of the user)
     }
     Returns top 3 spots based on:
     - Cost (lower is better)
     - Distance from user location
     - User preferences (if profile complete)
+    - Walk to the buildings for the user's major
+    - How full the spot is right now (live occupancy)
     """
     try:
         data = request.get_json(silent=True)
@@ -355,37 +769,39 @@ def get_recommendations():
             selected_spot_id = int(selected_spot_id) if selected_spot_id is not None else None
             user_lat = float(user_lat) if user_lat is not None else None
             user_lon = float(user_lon) if user_lon is not None else None
+            nearby_only = bool(data.get('nearby_only'))
         else:
             selected_spot_id = data.get('selected_spot_id', type=int)
             user_lat = data.get('user_lat', type=float)
             user_lon = data.get('user_lon', type=float)
+            nearby_only = data.get('nearby_only', '').lower() in ('1', 'true', 'yes')
 
-        #get parking spots
-        spots = ParkingSpot.query.filter(
-            ParkingSpot.latitude.isnot(None),
-            ParkingSpot.longitude.isnot(None)
-        ).all()
-        
-        #score each spot
-        scored_spots = []
-        for spot in spots:
-            score = calculate_spot_score(
-                spot,
-                current_user,
-                user_lat,
-                user_lon,
-                selected_spot_id
+        snapshot = spot_cache.get()
+        occupancy = occupancy_tracker.snapshot()
+        #score every spot with coordinates in one vectorized pass (see calculate_spot_score)
+        engine = snapshot.derived('scoring_engine', build_scoring_engine)
+
+        #users in the same profile segment and ~50m cell share one shortlist, scored from the cell's center
+        key = recommendation_cache.key(current_user, user_lat, user_lon, selected_spot_id, nearby_only)
+        user_lat, user_lon = key[2], key[3]
+
+        shortlist = recommendation_cache.lookup(snapshot.version, key)
+        if shortlist is None:
+            shortlist = engine.shortlist(
+                current_user, user_lat, user_lon, selected_spot_id, k=3,
+                candidates=nearby_candidates(snapshot, engine, user_lat, user_lon, nearby_only)
             )
-            scored_spots.append({
-                'spot': spot,
-                'score': score
-            })
+            recommendation_cache.store(snapshot.version, key, shortlist)
 
-        # Sort each spot by the corresponding score (from high to low)
-        scored_spots.sort(key=lambda x: x['score'], reverse=True)
-        
-        #get top 3 spots:
-        top_spots = [item['spot'].to_dict() for item in scored_spots[:3]]
+        #get top 3 spots with the current occupancy applied
+        top_spots = engine.rank(shortlist, k=3, occupancy=occupancy)
+        if top_spots is None:
+            top_spots = engine.top_k(
+                current_user, user_lat, user_lon, selected_spot_id, k=3,
+                candidates=nearby_candidates(snapshot, engine, user_lat, user_lon, nearby_only),
+                occupancy=occupancy
+            )
+        top_spots = [spot.to_dict() for spot in top_spots]
         return jsonify({
             'status': 'success',
             'personalized': current_user.is_profile_complete(),
@@ -398,50 +814,155 @@ def get_recommendations():
             'status': 'error',
             'message': str(e)
         }), 500
+
+@bp.route('/api/recommendations/batch', methods=['POST'])
+@login_required
+def get_recommendations_batch():
+    """
+    Recommendations for several origins/selected spots in one call
+    Accepts: {
+        "queries": [{"selected_spot_id", "user_lat", "user_lon", "nearby_only"}, ...]
+            (each as for /api/recommendations, at most RECOMMENDATION_BATCH_MAX),
+        "k": int (optional, spots per query, default 3, at most 10)
+    }
+    Returns one result per query, in order, with the same spots the single
+    endpoint would return. Spots are loaded once and every query that isn't
+    already cached is narrowed down in one matrix pass (see
+    SpotScoringEngine.shortlists), then ranked with the current occupancy
+    """
+    try:
+        data = request.get_json(silent=True)
+        queries = data.get('queries') if isinstance(data, dict) else None
+        if not isinstance(queries, list):
+            return jsonify({
+                'status': 'error',
+                'message': 'Send JSON with a "queries" list'
+            }), 400
+        max_queries = current_app.config['RECOMMENDATION_BATCH_MAX']
+        if len(queries) > max_queries:
+            return jsonify({
+                'status': 'error',
+                'message': f'At most {max_queries} queries per batch'
+            }), 413
+        try:
+            k = int(data.get('k', 3))
+        except (TypeError, ValueError):
+            k = None
+        if k is None or not 1 <= k <= 10:
+            return jsonify({
+                'status': 'error',
+                'message': 'k must be a whole number from 1 to 10'
+            }), 400
+
+        parsed = []
+        for index, query in enumerate(queries):
+            try:
+                if not isinstance(query, dict):
+                    raise ValueError('query must be an object')
+                selected_spot_id = query.get('selected_spot_id')
+                user_lat = query.get('user_lat')
+                user_lon = query.get('user_lon')
+                parsed.append((
+                    int(selected_spot_id) if selected_spot_id is not None else None,
+                    float(user_lat) if user_lat is not None else None,
+                    float(user_lon) if user_lon is not None else None,
+                    bool(query.get('nearby_only'))
+                ))
+            except (TypeError, ValueError) as e:
+                return jsonify({
+                    'status': 'error',
+                    'message': f'Query {index}: {e}'
+                }), 400
+
+        snapshot = spot_cache.get()
+        occupancy = occupancy_tracker.snapshot()
+        engine = snapshot.derived('scoring_engine', build_scoring_engine)
+
+        #the cache holds top 3 shortlists, so it is only used for the default k
+        shortlists = [None] * len(parsed)
+        keys = [None] * len(parsed)
+        misses = []
+        for index, (selected_spot_id, user_lat, user_lon, nearby_only) in enumerate(parsed):
+            keys[index] = recommendation_cache.key(current_user, user_lat, user_lon, selected_spot_id, nearby_only)
+            if k == 3:
+                shortlists[index] = recommendation_cache.lookup(snapshot.version, keys[index])
+            if shortlists[index] is None:
+                misses.append(index)
+
+        #score every missed query at once, from the quantized locations; the shortlists are
+        #exactly what the single endpoint builds, so they go in the same cache entries
+        queries = [(key[2], key[3], query[0]) for key, query in zip(keys, parsed)]
+
+        def query_candidates(index):
+            return nearby_candidates(snapshot, engine, queries[index][0], queries[index][1], parsed[index][3])
+
+        if misses:
+            scored = engine.shortlists(
+                current_user, [queries[index] for index in misses], k=k,
+                candidates=[query_candidates(index) for index in misses]
+            )
+            for index, shortlist in zip(misses, scored):
+                shortlists[index] = shortlist
+                if k == 3:
+                    recommendation_cache.store(snapshot.version, keys[index], shortlist)
+
+        results = []
+        for index, ((user_lat, user_lon, selected_spot_id), shortlist) in enumerate(zip(queries, shortlists)):
+            spots = engine.rank(shortlist, k=k, occupancy=occupancy)
+            if spots is None:
+                spots = engine.top_k(
+                    current_user, user_lat, user_lon, selected_spot_id, k=k,
+                    candidates=query_candidates(index), occupancy=occupancy
+                )
+            results.append([spot.to_dict() for spot in spots])
+        return jsonify({
+            'status': 'success',
+            'personalized': current_user.is_profile_complete(),
+            'count': len(results),
+            'results': [
+                {
+                    'selected_spot_id': query[0],
+                    'user_lat': query[1],
+                    'user_lon': query[2],
+                    'count': len(spots),
+                    'data': spots
+                }
+                for query, spots in zip(parsed, results)
+            ]
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
 # ============= SEARCH LOGIC ============= 
-@app.route('/api/search', methods=['GET'])
+@bp.route('/api/search', methods=['GET'])
 def search_parking_spots():
     """
     Search parking spots based on a query string
     ONLY returns spots with valid coordinates
+    Results are ranked by field weight and match quality (see search_index.py)
+    ?fields= picks the spot fields returned, as for /api/parking-spots
+    Supports If-None-Match; the body is only rebuilt when the spot data changes
     """
     try:
+        try:
+            fields = parse_fields(request.args.get('fields'))
+        except ValueError as e:
+            return jsonify({
+                'status': 'error',
+                'message': str(e)
+            }), 400
         search_string = request.args.get('q', '')
-        query = ParkingSpot.query
-        
-        # FILTER: Only spots with coordinates
-        query = query.filter(
-            ParkingSpot.latitude.isnot(None),
-            ParkingSpot.longitude.isnot(None)
-        )
-        
-        if search_string:
-            search_pattern = f'%{search_string}%'
-            query = query.filter(
-                db.or_(
-                    ParkingSpot.spot_name.ilike(search_pattern),
-                    ParkingSpot.address.ilike(search_pattern),
-                    ParkingSpot.campus_location.ilike(search_pattern),
-                    ParkingSpot.parking_type.ilike(search_pattern),
-                    ParkingSpot.near_buildings.ilike(search_pattern)
-                )
-            )
+        snapshot = spot_cache.get()
         
-        spots = query.limit(5).all()
-        spots_data = []
+        def build_payload():
+            # The index only holds spots with coordinates
+            search_index = snapshot.derived('search_index', build_search_index)
+            spots = search_index.search(search_string, limit=5)
+            return spot_list_body(snapshot, spots, fields, query=search_string)
         
-        for spot in spots:
-            spot_dict = spot.to_dict()
-            spot_dict['latitude'] = spot.latitude
-            spot_dict['longitude'] = spot.longitude
-            spots_data.append(spot_dict)
-        
-        return jsonify({
-            'status': 'success',
-            'count': len(spots_data),
-            'query': search_string,
-            'data': spots_data
-        })
+        return conditional_json(snapshot.version, build_payload)
     except Exception as e:
         return jsonify({
             'status': 'error',
@@ -449,7 +970,7 @@ def search_parking_spots():
         }), 500
 
 # ============= ADD PARKING SPOT =============
-@app.route('/api/add-parking-spot', methods=['POST'])
+@bp.route('/api/add-parking-spot', methods=['POST'])
 def add_parking_spot():
     """
     Add a new parking spot to the database
@@ -474,7 +995,12 @@ def add_parking_spot():
         )
         
         db.session.add(new_spot)
+        version = bump_spot_data_version()
         db.session.commit()
+        spot_cache.add_spot(new_spot, version)
+        
+        # Coordinates are filled in later by the background geocoder
+        geocode_queue.submit(new_spot.spot_id, new_spot.address)
         
         return jsonify({
             'status': 'success',
@@ -487,6 +1013,149 @@ def add_parking_spot():
             'status': 'error',
             'message': str(e)
         }), 500
+# ============= OCCUPANCY =============
+@bp.route('/api/occupancy', methods=['POST'])
+def report_occupancy():
+    """
+    Accept a batch of occupancy reports from sensors or signed-in users
+    Accepts: {"reports": [{"spot_id": int, "occupancy": 0-1} or
+              {"spot_id": int, "occupied": int, "capacity": int}, optional "observed_at": unix seconds]}
+    Reports are averaged in memory and pushed to /api/stream/occupancy within a few seconds
+    """
+    token = current_app.config.get('OCCUPANCY_TOKEN')
+    is_sensor = bool(token) and request.headers.get('Authorization') == f'Bearer {token}'
+    if not is_sensor and not current_user.is_authenticated:
+        return jsonify({
+            'status': 'error',
+            'message': 'Unauthorized'
+        }), 401
+
+    try:
+        data = request.get_json(silent=True)
+        reports = data.get('reports') if isinstance(data, dict) else None
+        if not isinstance(reports, list):
+            return jsonify({
+                'status': 'error',
+                'message': 'reports must be a list'
+            }), 400
+        if len(reports) > current_app.config['OCCUPANCY_MAX_BATCH']:
+            return jsonify({
+                'status': 'error',
+                'message': f"At most {current_app.config['OCCUPANCY_MAX_BATCH']} reports per request"
+            }), 413
+
+        accepted, errors = occupancy_tracker.ingest(reports, spot_cache.get().by_id)
+        return jsonify({
+            'status': 'success',
+            'accepted': accepted,
+            'rejected': len(errors),
+            'errors': [{'index': index, 'message': message} for index, message in errors[:20]]
+        })
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+
+@bp.route('/api/occupancy', methods=['GET'])
+def get_occupancy():
+    """
+    Current occupancy estimates, for browsers that can't hold an event stream open
+    ?since=<version> (from the last response or event) returns no spots if
+    nothing was published since; otherwise every estimate with "full": true
+    """
+    snapshot = occupancy_tracker.snapshot()
+    since = request.args.get('since', type=int)
+    unchanged = since == snapshot.version
+    return jsonify({
+        'status': 'success',
+        'version': snapshot.version,
+        'full': not unchanged,
+        'spots': {} if unchanged else snapshot.to_dict(),
+        'poll_interval': current_app.config['OCCUPANCY_POLL_INTERVAL']
+    })
+
+@bp.route('/api/stream/occupancy', methods=['GET'])
+def stream_occupancy():
+    """
+    Server-Sent Events stream of occupancy estimates
+    A 'snapshot' event with every estimate, then 'occupancy' events with the spots
+    that changed (null when a spot's reports went stale). The stream closes after
+    OCCUPANCY_STREAM_MAX_SECONDS and EventSource reconnects on its own.
+    Each stream holds a server thread, so past OCCUPANCY_MAX_SUBSCRIBERS per
+    worker this answers 503 and the browser polls GET /api/occupancy instead
+    """
+    subscriber = occupancy_tracker.subscribe()
+    if subscriber is None:
+        response = jsonify({
+            'status': 'error',
+            'message': 'Too many open streams, poll /api/occupancy instead'
+        })
+        response.status_code = 503
+        response.headers['Retry-After'] = str(current_app.config['OCCUPANCY_POLL_INTERVAL'])
+        return response
+    response = Response(
+        occupancy_tracker.stream(subscriber, current_app.config['OCCUPANCY_STREAM_MAX_SECONDS']),
+        mimetype='text/event-stream'
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx-style proxies from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Frees the slot even if the client leaves before the stream starts
+    response.call_on_close(lambda: occupancy_tracker.unsubscribe(subscriber))
+    return response
+
+# ============= BULK IMPORT =============
+@bp.route('/api/admin/import', methods=['POST'])
+def import_parking_spots():
+    """
+    Bulk import parking spots from a CSV or GeoJSON request body
+    Query parameters: source (dataset name), format (csv or geojson, default csv), id_field (default id)
+    Requires "Authorization: Bearer <ADMIN_TOKEN>"; disabled when ADMIN_TOKEN is unset
+    """
+    token = current_app.config.get('ADMIN_TOKEN')
+    if not token:
+        return jsonify({
+            'status': 'error',
+            'message': 'Admin endpoints are disabled'
+        }), 404
+    if request.headers.get('Authorization') != f'Bearer {token}':
+        return jsonify({
+            'status': 'error',
+            'message': 'Unauthorized'
+        }), 401
+
+    try:
+        # Parsed as it arrives instead of buffering the whole upload
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8-sig', newline='')
+        result = import_spots(
+            stream,
+            request.args.get('source'),
+            file_format=request.args.get('format', 'csv'),
+            id_field=request.args.get('id_field', 'id'),
+            batch_size=current_app.config['SPOT_IMPORT_BATCH_SIZE'],
+            method=current_app.config['SPOT_IMPORT_METHOD']
+        )
+        print(f"Imported {result.rows_written} spots from {result.source} "
+              f"in {result.seconds:.2f}s ({result.rows_per_second:.0f} rows/s)")
+        return jsonify({
+            'status': 'success',
+            'data': result.to_dict()
+        })
+    except (SpotImportError, UnicodeDecodeError) as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 400
+    except Exception as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e)
+        }), 500
+# Module-level app for `gunicorn app:app` and scripts that import it
+app = create_app()
+
 # Run app
 if __name__ == '__main__':
+    prepare_worker(app)
     app.run(debug=True, port=5000)
\ No newline at end of file
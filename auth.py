@@ -2,12 +2,19 @@
 Authentication utilities for Google OAuth
 """
 import json
-import os
+import re
+import threading
+import time
 import requests
-from flask import redirect, request, url_for
-from flask_login import login_user, logout_user, current_user
+from flask import current_app, request, url_for
 from oauthlib.oauth2 import WebApplicationClient
 from models import db, User
+from user_cache import user_cache
+from outbound import outbound
+
+
+# Seconds to keep serving a stale discovery document after a failed refresh
+DISCOVERY_RETRY_AFTER = 30
 
 
 class GoogleAuth:
@@ -19,16 +26,63 @@ class GoogleAuth:
         self.client_id = app.config['GOOGLE_CLIENT_ID']
         self.client_secret = app.config['GOOGLE_CLIENT_SECRET']
         self.discovery_url = app.config['GOOGLE_DISCOVERY_URL']
+        self.discovery_ttl = app.config['GOOGLE_DISCOVERY_TTL']
+        self.timeout = app.config['GOOGLE_HTTP_TIMEOUT']
+        
+        # Keep-alive connections shared by every call to Google, with a deadline
+        # and circuit breaker so a slow Google can't hold workers
+        self.http = outbound.client(
+            'google',
+            timeout=self.timeout,
+            deadline=app.config['GOOGLE_HTTP_DEADLINE'],
+            pool_size=app.config['GOOGLE_HTTP_POOL_SIZE']
+        )
         
-        # OAuth 2.0 client
-        self.client = WebApplicationClient(self.client_id)
+        # Cached discovery document and when it stops being fresh (time.monotonic)
+        self._provider_cfg = None
+        self._provider_cfg_expires = 0
+        self._provider_cfg_lock = threading.Lock()
     
     def get_google_provider_cfg(self):
         """
         Get Google's OAuth 2.0 configuration
         This tells us where to send users to login, where to get tokens, etc.
+        Cached for as long as Google's Cache-Control header allows
         """
-        return requests.get(self.discovery_url).json()
+        cfg = self._provider_cfg
+        if cfg is not None and time.monotonic() < self._provider_cfg_expires:
+            return cfg
+        
+        # Only one thread refreshes, the rest wait for it and reuse its result
+        with self._provider_cfg_lock:
+            if self._provider_cfg is not None and time.monotonic() < self._provider_cfg_expires:
+                return self._provider_cfg
+            try:
+                response = self.http.get(self.discovery_url)
+                response.raise_for_status()
+                cfg = response.json()
+            except (requests.RequestException, ValueError):
+                # Serve the stale document rather than failing every login,
+                # and give Google a little while before trying again
+                if self._provider_cfg is not None:
+                    self._provider_cfg_expires = time.monotonic() + DISCOVERY_RETRY_AFTER
+                    return self._provider_cfg
+                raise
+            self._provider_cfg = cfg
+            self._provider_cfg_expires = time.monotonic() + cache_lifetime(
+                response.headers.get('Cache-Control'),
+                self.discovery_ttl
+            )
+            return cfg
+    
+    def prefetch(self):
+        """
+        Load the discovery document ahead of the first login
+        """
+        try:
+            self.get_google_provider_cfg()
+        except Exception as e:
+            print(f"Could not prefetch Google discovery document: {e}")
     
     def get_login_url(self):
         """
@@ -39,9 +93,9 @@ class GoogleAuth:
         authorization_endpoint = google_provider_cfg["authorization_endpoint"]
         
         # Construct the login URL with proper redirect URI
-        request_uri = self.client.prepare_request_uri(
+        request_uri = WebApplicationClient(self.client_id).prepare_request_uri(
             authorization_endpoint,
-            redirect_uri=url_for('callback', _external=True),
+            redirect_uri=url_for('main.callback', _external=True),
             scope=["openid", "email", "profile"],
         )
         
@@ -62,31 +116,39 @@ class GoogleAuth:
         google_provider_cfg = self.get_google_provider_cfg()
         token_endpoint = google_provider_cfg["token_endpoint"]
         
+        # The client holds the access token it parses, so each callback gets its own;
+        # a shared one would let concurrent logins read each other's tokens
+        client = WebApplicationClient(self.client_id)
+        
         # Exchange authorization code for access token
-        token_url, headers, body = self.client.prepare_token_request(
+        token_url, headers, body = client.prepare_token_request(
             token_endpoint,
             authorization_response=request.url,
-            redirect_url=url_for('callback', _external=True),
+            redirect_url=url_for('main.callback', _external=True),
             code=code
         )
         
-        token_response = requests.post(
-            token_url,
-            headers=headers,
-            data=body,
-            auth=(self.client_id, self.client_secret),
-        )
-        
-        # Parse the tokens
-        self.client.parse_request_body_response(json.dumps(token_response.json()))
-        
-        # Get user info from Google
-        userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
-        uri, headers, body = self.client.add_token(userinfo_endpoint)
-        userinfo_response = requests.get(uri, headers=headers, data=body)
-        
-        # Extract user information
-        userinfo = userinfo_response.json()
+        try:
+            token_response = self.http.post(
+                token_url,
+                headers=headers,
+                data=body,
+                auth=(self.client_id, self.client_secret)
+            )
+            
+            # Parse the tokens
+            client.parse_request_body_response(json.dumps(token_response.json()))
+            
+            # Get user info from Google
+            userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
+            uri, headers, body = client.add_token(userinfo_endpoint)
+            userinfo_response = self.http.get(uri, headers=headers, data=body)
+            
+            # Extract user information
+            userinfo = userinfo_response.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"Google login request failed: {e}")
+            return None
         
         # Verify email is verified by Google
         if not userinfo.get("email_verified"):
@@ -120,11 +182,54 @@ class GoogleAuth:
             user.last_name = last_name
             user.profile_pic = profile_pic
             db.session.commit()
+            user_cache.invalidate(user.user_id)
         
         return user
 
+def cache_lifetime(cache_control, default):
+    """
+    Seconds a response may be cached for, from its Cache-Control header
+    """
+    if not cache_control:
+        return default
+    directives = cache_control.lower()
+    if 'no-store' in directives or 'no-cache' in directives:
+        return 0
+    match = re.search(r'max-age=(\d+)', directives)
+    if match:
+        return int(match.group(1))
+    return default
+
+
 def init_auth(app):
     """
     Initialize authentication for the Flask app
+    GoogleAuth itself is created on first use, see get_google_auth
+    """
+    app.extensions['google_auth'] = None
+
+
+_google_auth_lock = threading.Lock()
+
+
+def get_google_auth(app=None):
+    """
+    The app's GoogleAuth, created the first time it is needed
+    """
+    app = app or current_app._get_current_object()
+    google_auth = app.extensions.get('google_auth')
+    if google_auth is None:
+        with _google_auth_lock:
+            google_auth = app.extensions.get('google_auth')
+            if google_auth is None:
+                google_auth = app.extensions['google_auth'] = GoogleAuth(app)
+    return google_auth
+
+
+def prefetch_google_discovery(app):
+    """
+    Warm the discovery cache in the background so the first login doesn't wait on it
+    Call once per worker process, after forking
     """
-    return GoogleAuth(app)
\ No newline at end of file
+    google_auth = get_google_auth(app)
+    threading.Thread(target=google_auth.prefetch, name='google-discovery-prefetch', daemon=True).start()
@@ -0,0 +1,250 @@
+"""
+Walking distance and time from every parking spot to every campus building
+
+Buildings are the ones named in ParkingSpot.near_buildings and
+MajorCampusMapping.common_buildings. The matrix is built once per spot
+snapshot, so scoring looks up how far a spot is from a major's buildings
+instead of estimating it per request.
+"""
+import re
+import numpy as np
+from flask import current_app
+from models import MajorCampusMapping
+
+
+EARTHS_RADIUS = 3959  # earths radius in miles
+
+# Campus paths aren't straight lines; walking distance is estimated as the
+# great-circle distance times this factor, at an average walking pace
+WALK_DETOUR = 1.25
+WALK_SPEED_MPH = 3.0
+
+# Approximate main entrances of buildings named in the seed data
+# Buildings not listed here are placed at the centroid of the spots that name them
+BUILDING_COORDINATES = {
+    # East Bank
+    'Keller Hall': (44.9745, -93.2322),
+    'Lind Hall': (44.9750, -93.2344),
+    'EECS Building': (44.9748, -93.2335),
+    'Tate Lab': (44.9752, -93.2340),
+    'Elliott Hall': (44.9763, -93.2393),
+    'Coffman Union': (44.9730, -93.2352),
+    'Walter Library': (44.9755, -93.2360),
+    'Northrop Auditorium': (44.9765, -93.2353),
+    'Bruininks Hall': (44.9742, -93.2368),
+    'Nicholson Hall': (44.9767, -93.2375),
+    'Recreation Center': (44.9748, -93.2290),
+    # West Bank
+    'Carlson School of Management': (44.9697, -93.2437),
+    'Social Sciences Building': (44.9718, -93.2440),
+    'Rarig Center': (44.9706, -93.2446),
+    'Anderson Hall': (44.9724, -93.2447),
+    'Wilson Library': (44.9717, -93.2431),
+    'Blegen Hall': (44.9721, -93.2438),
+    'Ferguson Hall': (44.9732, -93.2447),
+}
+
+
+def normalize_building(name):
+    """
+    Lookup key for a building name: lowercased with whitespace collapsed
+    """
+    return re.sub(r'\s+', ' ', name.strip().lower())
+
+
+KNOWN_BUILDINGS = {normalize_building(name): coordinates for name, coordinates in BUILDING_COORDINATES.items()}
+
+# Buildings already reported as having no coordinates, so each rebuild doesn't repeat them
+unplaced_buildings = set()
+
+
+def split_buildings(text):
+    """
+    Building names from a comma separated free-text field
+    """
+    if not text:
+        return []
+    return [name.strip() for name in text.split(',') if name.strip()]
+
+
+def walking_miles(lat, lon, building_lat, building_lon):
+    """
+    Estimated walking miles between points and buildings, broadcasting over arrays
+    """
+    lat1 = np.radians(lat)
+    lat2 = np.radians(building_lat)
+    dlat = lat2 - lat1
+    dlon = np.radians(building_lon) - np.radians(lon)
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return EARTHS_RADIUS * c * WALK_DETOUR
+
+
+class WalkingMatrix:
+    """
+    Spots x buildings arrays of walking miles and minutes (float32)
+
+    spot_rows maps spot_id to a row and building_index maps a normalized
+    building name to a column. Per-major nearest-building minutes are
+    computed on first use and kept, so a lookup is two dict gets and an index.
+    with_record returns a copy with one more row (and a column for any new
+    building it names); the matrix being read is never mutated.
+    """
+
+    def __init__(self, spot_ids, latitude, longitude, building_names, building_latitude,
+                 building_longitude, major_buildings, miles=None):
+        self.spot_ids = spot_ids
+        self.latitude = latitude
+        self.longitude = longitude
+        self.building_names = building_names
+        self.building_latitude = building_latitude
+        self.building_longitude = building_longitude
+        self.major_buildings = major_buildings  # normalized major -> tuple of building names
+
+        self.spot_rows = {spot_id: row for row, spot_id in enumerate(spot_ids)}
+        self.building_index = {normalize_building(name): column for column, name in enumerate(building_names)}
+        if miles is None:
+            miles = walking_miles(
+                latitude[:, None], longitude[:, None], building_latitude[None, :], building_longitude[None, :]
+            ).astype(np.float32)
+        self.miles = miles
+        self.minutes = (self.miles / WALK_SPEED_MPH * 60).astype(np.float32)
+        self._major_minutes = {}
+
+    def __len__(self):
+        return len(self.spot_ids)
+
+    def walk(self, spot_id, building):
+        """
+        (miles, minutes) from a spot to a building, or None if either is unknown
+        """
+        row = self.spot_rows.get(spot_id)
+        column = self.building_index.get(normalize_building(building))
+        if row is None or column is None:
+            return None
+        return float(self.miles[row, column]), float(self.minutes[row, column])
+
+    def major_columns(self, major):
+        """
+        Columns of the buildings a major's classes are in
+        """
+        names = self.major_buildings.get(normalize_building(major or ''), ())
+        return [self.building_index[key] for key in map(normalize_building, names) if key in self.building_index]
+
+    def major_minutes(self, major):
+        """
+        Minutes from every spot (by row) to the nearest of a major's buildings, or None
+        """
+        key = normalize_building(major or '')
+        if key not in self._major_minutes:
+            columns = self.major_columns(major)
+            self._major_minutes[key] = self.minutes[:, columns].min(axis=1).astype(np.float64) if columns else None
+        return self._major_minutes[key]
+
+    def walk_minutes_to_major(self, spot_id, major):
+        """
+        Minutes from a spot to the nearest of a major's buildings, or None
+        """
+        minutes = self.major_minutes(major)
+        row = self.spot_rows.get(spot_id)
+        if minutes is None or row is None:
+            return None
+        return float(minutes[row])
+
+    def with_record(self, record):
+        """
+        Return a copy of the matrix with one more spot
+        Only the new row, and columns for buildings first named by this spot, are computed
+        """
+        if not record.has_coordinates() or record.spot_id in self.spot_rows:
+            return self
+
+        new_names = []
+        new_latitude = []
+        new_longitude = []
+        for name in split_buildings(record.near_buildings):
+            key = normalize_building(name)
+            if key in self.building_index or key in map(normalize_building, new_names):
+                continue
+            # Placed at this spot, the only one naming it, until the next full rebuild
+            lat, lon = KNOWN_BUILDINGS.get(key, (record.latitude, record.longitude))
+            new_names.append(name)
+            new_latitude.append(lat)
+            new_longitude.append(lon)
+
+        building_latitude = np.append(self.building_latitude, new_latitude)
+        building_longitude = np.append(self.building_longitude, new_longitude)
+        miles = self.miles
+        if new_names:
+            new_columns = walking_miles(
+                self.latitude[:, None], self.longitude[:, None],
+                np.array(new_latitude)[None, :], np.array(new_longitude)[None, :]
+            ).astype(np.float32)
+            miles = np.hstack([miles, new_columns])
+        new_row = walking_miles(
+            record.latitude, record.longitude, building_latitude, building_longitude
+        ).astype(np.float32)
+
+        return WalkingMatrix(
+            self.spot_ids + [record.spot_id],
+            np.append(self.latitude, record.latitude),
+            np.append(self.longitude, record.longitude),
+            self.building_names + new_names,
+            building_latitude,
+            building_longitude,
+            self.major_buildings,
+            miles=np.vstack([miles, new_row[None, :]])
+        )
+
+
+def build_walking_matrix(snapshot):
+    """
+    Build the matrix for a spot snapshot, over spots that have coordinates
+    Reads the major to building mapping, so call inside an app context
+    """
+    records = snapshot.located_records()
+    major_buildings = {
+        normalize_building(mapping.major_name): tuple(split_buildings(mapping.common_buildings))
+        for mapping in MajorCampusMapping.query.all()
+    }
+
+    # Every building named anywhere, placed from the table or at the centroid of its spots
+    names = {}
+    positions = {}
+    for record in records:
+        for name in split_buildings(record.near_buildings):
+            key = normalize_building(name)
+            names.setdefault(key, name)
+            positions.setdefault(key, []).append((record.latitude, record.longitude))
+    for buildings in major_buildings.values():
+        for name in buildings:
+            names.setdefault(normalize_building(name), name)
+
+    building_names = []
+    building_latitude = []
+    building_longitude = []
+    for key, name in names.items():
+        if key in KNOWN_BUILDINGS:
+            lat, lon = KNOWN_BUILDINGS[key]
+        elif key in positions:
+            lat = sum(position[0] for position in positions[key]) / len(positions[key])
+            lon = sum(position[1] for position in positions[key]) / len(positions[key])
+        else:
+            if key not in unplaced_buildings:
+                unplaced_buildings.add(key)
+                current_app.logger.warning(f"No coordinates for building {name!r}, leaving it out of the walking matrix")
+            continue
+        building_names.append(name)
+        building_latitude.append(lat)
+        building_longitude.append(lon)
+
+    return WalkingMatrix(
+        [record.spot_id for record in records],
+        np.array([record.latitude for record in records], dtype=np.float64),
+        np.array([record.longitude for record in records], dtype=np.float64),
+        building_names,
+        np.array(building_latitude, dtype=np.float64),
+        np.array(building_longitude, dtype=np.float64),
+        major_buildings
+    )
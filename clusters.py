@@ -0,0 +1,256 @@
+"""
+Multi-zoom point clustering for zoomed-out map views, in the style of supercluster
+Each zoom level holds clusters of the level above it, so a bounding box query
+only reads the nodes of one level.
+"""
+from collections import namedtuple
+from math import atan, sinh, pi, degrees, floor
+from tiles import tile_position
+
+
+# Cluster radius in pixels of a 512px tile, same defaults as supercluster
+CLUSTER_RADIUS = 40
+CLUSTER_EXTENT = 512
+
+# Zooms that have clusters; above MAX_CLUSTER_ZOOM every spot is returned on its own
+MIN_CLUSTER_ZOOM = 0
+MAX_CLUSTER_ZOOM = 16
+
+
+class ClusterNode(namedtuple('ClusterNode', 'node_id x_sum y_sum count cost_min cost_max record')):
+    """
+    A cluster, or a single spot when count is 1 and record is set
+    Positions are Web Mercator in [0, 1), summed so centroids merge exactly
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_record(cls, node_id, record):
+        x, y = tile_position(record.latitude, record.longitude, 0)
+        return cls(node_id, x, y, 1, record.cost, record.cost, record)
+
+    @property
+    def x(self):
+        return self.x_sum / self.count
+
+    @property
+    def y(self):
+        return self.y_sum / self.count
+
+    def merged(self, node_id, others):
+        """
+        A new cluster made of this node and others
+        """
+        nodes = [self, *others]
+        costs = [cost for node in nodes for cost in (node.cost_min, node.cost_max) if cost is not None]
+        return ClusterNode(
+            node_id,
+            sum(node.x_sum for node in nodes),
+            sum(node.y_sum for node in nodes),
+            sum(node.count for node in nodes),
+            min(costs, default=None),
+            max(costs, default=None),
+            self.record if len(nodes) == 1 else None
+        )
+
+    def to_dict(self):
+        if self.record is not None:
+            spot_dict = self.record.to_dict()
+            spot_dict['type'] = 'spot'
+            return spot_dict
+        return {
+            'type': 'cluster',
+            'cluster_id': self.node_id,
+            'latitude': degrees(atan(sinh(pi * (1 - 2 * self.y)))),
+            'longitude': self.x * 360.0 - 180.0,
+            'point_count': self.count,
+            'cost_min': self.cost_min,
+            'cost_max': self.cost_max
+        }
+
+
+def cluster_radius(zoom):
+    """
+    Clustering radius at a zoom level, in Web Mercator units
+    """
+    return CLUSTER_RADIUS / (CLUSTER_EXTENT * (1 << zoom))
+
+
+class ClusterLevel:
+    """
+    The nodes shown at one zoom level, bucketed into a grid for neighbour and bbox lookups
+    Cells are as wide as the clustering radius of the next zoom out
+    """
+
+    def __init__(self, zoom):
+        self.zoom = zoom
+        self.cell_size = cluster_radius(max(zoom - 1, 0))
+        self.nodes = {}
+        self.cells = {}
+
+    def copy(self):
+        level = ClusterLevel(self.zoom)
+        level.nodes = dict(self.nodes)
+        level.cells = dict(self.cells)
+        return level
+
+    def add(self, node):
+        self.nodes[node.node_id] = node
+        cell = self._cell(node.x, node.y)
+        self.cells[cell] = self.cells.get(cell, ()) + (node.node_id,)
+
+    def replace(self, node):
+        old = self.nodes[node.node_id]
+        cell = self._cell(old.x, old.y)
+        self.cells[cell] = tuple(node_id for node_id in self.cells[cell] if node_id != node.node_id)
+        if not self.cells[cell]:
+            del self.cells[cell]
+        self.add(node)
+
+    def near(self, x, y, radius):
+        """
+        Nodes within radius of (x, y), radius must be no larger than cell_size
+        """
+        col, row = self._cell(x, y)
+        radius_sq = radius * radius
+        for cell_col in (col - 1, col, col + 1):
+            for cell_row in (row - 1, row, row + 1):
+                for node_id in self.cells.get((cell_col, cell_row), ()):
+                    node = self.nodes[node_id]
+                    if (node.x - x) ** 2 + (node.y - y) ** 2 <= radius_sq:
+                        yield node
+
+    def within(self, x0, y0, x1, y1):
+        """
+        Nodes whose centre is inside the box
+        """
+        col0, row0 = self._cell(x0, y0)
+        col1, row1 = self._cell(x1, y1)
+        if (col1 - col0 + 1) * (row1 - row0 + 1) > len(self.nodes):
+            # Box covers more cells than there are nodes, checking each node is cheaper
+            candidates = self.nodes.values()
+        else:
+            candidates = [
+                self.nodes[node_id]
+                for cell_col in range(col0, col1 + 1)
+                for cell_row in range(row0, row1 + 1)
+                for node_id in self.cells.get((cell_col, cell_row), ())
+            ]
+        return [node for node in candidates if x0 <= node.x <= x1 and y0 <= node.y <= y1]
+
+    def _cell(self, x, y):
+        return floor(x / self.cell_size), floor(y / self.cell_size)
+
+
+class ClusterIndex:
+    """
+    Clusters for every zoom between min_zoom and max_zoom, plus the individual spots
+
+    Built greedily from the most zoomed-in level out, like supercluster: each
+    unvisited node absorbs its unvisited neighbours within the radius for the
+    next zoom out. with_record folds a new spot into the nearest cluster at
+    each level (or starts a new one) and updates that cluster's ancestors,
+    instead of rebuilding every level.
+    """
+
+    def __init__(self, records=(), min_zoom=MIN_CLUSTER_ZOOM, max_zoom=MAX_CLUSTER_ZOOM):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.levels = {}
+        self.parents = {}  # node id -> id of the node containing it one zoom out
+        self.next_id = 0
+        if records is None:
+            return
+
+        leaves = ClusterLevel(max_zoom + 1)
+        for record in records:
+            leaves.add(ClusterNode.from_record(self._new_id(), record))
+        self.levels[max_zoom + 1] = leaves
+
+        for zoom in range(max_zoom, min_zoom - 1, -1):
+            self.levels[zoom] = self._cluster(self.levels[zoom + 1], zoom)
+
+    def with_record(self, record):
+        """
+        Return a copy of the index with one more spot
+        """
+        if not record.has_coordinates():
+            return self
+        index = ClusterIndex(None, self.min_zoom, self.max_zoom)
+        index.levels = {zoom: level.copy() for zoom, level in self.levels.items()}
+        index.parents = dict(self.parents)
+        index.next_id = self.next_id
+
+        leaf = ClusterNode.from_record(index._new_id(), record)
+        index.levels[self.max_zoom + 1].add(leaf)
+        child = leaf
+        for zoom in range(self.max_zoom, self.min_zoom - 1, -1):
+            level = index.levels[zoom]
+            target = min(
+                level.near(leaf.x, leaf.y, cluster_radius(zoom)),
+                key=lambda node: (node.x - leaf.x) ** 2 + (node.y - leaf.y) ** 2,
+                default=None
+            )
+            if target is None:
+                node = leaf.merged(index._new_id(), [])
+                level.add(node)
+                index.parents[child.node_id] = node.node_id
+                child = node
+                continue
+
+            # Joined an existing cluster, which grows along with everything containing it
+            index.parents[child.node_id] = target.node_id
+            node_id = target.node_id
+            for ancestor_zoom in range(zoom, self.min_zoom - 1, -1):
+                ancestor_level = index.levels[ancestor_zoom]
+                ancestor = ancestor_level.nodes[node_id]
+                ancestor_level.replace(ancestor.merged(node_id, [leaf]))
+                node_id = index.parents.get(node_id)
+            break
+        return index
+
+    def query(self, west, south, east, north, zoom):
+        """
+        Clusters and single spots inside the bounding box at a map zoom level
+        """
+        zoom = max(self.min_zoom, min(int(floor(zoom)), self.max_zoom + 1))
+        x0, y0 = tile_position(north, west, 0)
+        x1, y1 = tile_position(south, east, 0)
+        nodes = self.levels[zoom].within(x0, y0, x1, y1)
+        nodes.sort(key=lambda node: (-node.count, node.node_id))
+        return nodes
+
+    def _cluster(self, previous, zoom):
+        """
+        Group the nodes of the level above into the clusters shown at zoom
+        """
+        radius = cluster_radius(zoom)
+        level = ClusterLevel(zoom)
+        visited = set()
+        for node in previous.nodes.values():
+            if node.node_id in visited:
+                continue
+            neighbours = [
+                other for other in previous.near(node.x, node.y, radius)
+                if other.node_id not in visited and other.node_id != node.node_id
+            ]
+            cluster = node.merged(self._new_id(), neighbours)
+            level.add(cluster)
+            for child in (node, *neighbours):
+                visited.add(child.node_id)
+                self.parents[child.node_id] = cluster.node_id
+        return level
+
+    def _new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def __len__(self):
+        return len(self.levels[self.max_zoom + 1].nodes)
+
+
+def build_cluster_index(snapshot):
+    """
+    Build the cluster index for a spot snapshot, over spots that have coordinates
+    """
+    return ClusterIndex(snapshot.located_records())
@@ -1,9 +1,48 @@
 import os
 from dotenv import load_dotenv
+from sqlalchemy.pool import NullPool
 
 # Load environment variables from .env file
 load_dotenv()
 
+
+def engine_options(database_uri, pool_size, max_overflow, pool_timeout, pool_recycle, pre_ping,
+                   pgbouncer, connect_timeout):
+    """
+    create_engine arguments for the configured pooling mode
+    """
+    if database_uri.startswith('sqlite'):
+        # Local file or memory, Flask-SQLAlchemy's SQLite defaults already fit
+        return {}
+
+    connect_args = {}
+    if database_uri.startswith('postgresql'):
+        connect_args['connect_timeout'] = connect_timeout
+
+    if pgbouncer:
+        # PgBouncer in transaction mode does the pooling and may hand each
+        # transaction a different server connection, so keep nothing open
+        # between checkouts and never create server-side prepared statements.
+        # psycopg2 doesn't prepare statements; psycopg 3 does unless told not to
+        if database_uri.startswith('postgresql+psycopg:'):
+            connect_args['prepare_threshold'] = None
+        return {
+            'poolclass': NullPool,
+            'connect_args': connect_args,
+        }
+
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': pool_timeout,
+        'pool_recycle': pool_recycle,
+        'pool_pre_ping': pre_ping,
+        # Reuse the most recently returned connection so idle extras age out via pool_recycle
+        'pool_use_lifo': True,
+        'connect_args': connect_args,
+    }
+
+
 class Config:
     # Flask Configuration
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
@@ -19,10 +58,167 @@ class Config:
     SQLALCHEMY_DATABASE_URI = DATABASE_URL or 'postgresql://localhost/parkandgo_db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection Pool Configuration
+    # Limits are per worker process: at most DB_POOL_SIZE + DB_MAX_OVERFLOW
+    # connections each, so size them against the server's max_connections.
+    # DB_PGBOUNCER=true is for running behind PgBouncer in transaction mode
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))  # seconds to wait for a free connection
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # seconds before a connection is replaced
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    DB_PGBOUNCER = os.environ.get('DB_PGBOUNCER', 'false').lower() == 'true'
+    DB_CONNECT_TIMEOUT = int(os.environ.get('DB_CONNECT_TIMEOUT', 5))
+    # Checkouts slower than this are logged as the pool running dry
+    DB_POOL_WAIT_WARNING = float(os.environ.get('DB_POOL_WAIT_WARNING', 1.0))
+    
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(
+        SQLALCHEMY_DATABASE_URI,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pre_ping=DB_POOL_PRE_PING,
+        pgbouncer=DB_PGBOUNCER,
+        connect_timeout=DB_CONNECT_TIMEOUT
+    )
+    
+    # Spot Cache Configuration
+    # How many seconds a worker trusts its in-memory spot snapshot before
+    # checking the spot_data_version row for writes made by other workers
+    SPOT_CACHE_MAX_STALENESS = float(os.environ.get('SPOT_CACHE_MAX_STALENESS', 5))
+    
+    # Seconds browsers and proxies may reuse spot listings before revalidating with their ETag
+    SPOT_RESPONSE_MAX_AGE = int(os.environ.get('SPOT_RESPONSE_MAX_AGE', 10))
+    
+    # Largest page /api/parking-spots returns when paginating with limit/cursor
+    SPOT_PAGE_MAX_LIMIT = 1000
+    # Rows fetched per round trip when streaming /api/parking-spots?format=ndjson
+    SPOT_EXPORT_BATCH_SIZE = 1000
+    
+    # Seconds browsers and proxies may reuse a map tile before revalidating with its ETag
+    TILE_MAX_AGE = int(os.environ.get('TILE_MAX_AGE', 60))
+    
+    # Admission Control Configuration
+    # Requests that waited for a worker thread longer than ADMISSION_MAX_QUEUE_WAIT
+    # get a 503; anonymous and expensive requests after a shorter wait. With
+    # gunicorn's threads all busy that wait is where overload shows up. Below
+    # it, ADMISSION_MAX_IN_FLIGHT (match it to GUNICORN_THREADS) keeps anonymous
+    # and expensive requests from holding every thread. Rates are (requests per
+    # second, burst) per client per worker process, with search and
+    # recommendations limited on their own; over the rate is a 429
+    ADMISSION_ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+    ADMISSION_MAX_IN_FLIGHT = int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', os.environ.get('GUNICORN_THREADS', 4)))
+    ADMISSION_RATE_LIMITS = {
+        'default': (float(os.environ.get('ADMISSION_RATE', 20)), 40),
+        'search': (float(os.environ.get('ADMISSION_SEARCH_RATE', 5)), 15),
+        'recommendations': (float(os.environ.get('ADMISSION_RECOMMENDATION_RATE', 2)), 5)
+    }
+    # Requests from anonymous visitors without a session cookie share one bucket
+    # per IP address, with this many times the rate and burst
+    ADMISSION_IP_RATE_MULTIPLIER = float(os.environ.get('ADMISSION_IP_RATE_MULTIPLIER', 10))
+    ADMISSION_MAX_CLIENTS = 10000  # clients tracked per rate limit before the oldest are forgotten
+    ADMISSION_RETRY_AFTER = 1  # seconds, sent with 503s
+    # Seconds, measured from when gunicorn queued the request for a thread
+    # (gunicorn_workers.QueueTimedWorker) or the proxy's X-Request-Start,
+    # whichever is earlier; 0 to never shed on queueing
+    ADMISSION_MAX_QUEUE_WAIT = float(os.environ.get('ADMISSION_MAX_QUEUE_WAIT', 0.5)) or None
+    # Proxies in front of the app (1 on Render); clients are told apart by the
+    # X-Forwarded-For address they add instead of the proxy's own
+    TRUSTED_PROXY_HOPS = int(os.environ.get('TRUSTED_PROXY_HOPS', 0))
+    
+    # Outbound Call Configuration
+    # Calls to Nominatim, OSRM and Google run on a shared pool of
+    # OUTBOUND_MAX_WORKERS threads per worker process, at most
+    # OUTBOUND_HOST_CONCURRENCY at a time per host. After
+    # OUTBOUND_FAILURE_THRESHOLD failures in a row a service is not called
+    # for OUTBOUND_RESET_TIMEOUT seconds
+    OUTBOUND_MAX_WORKERS = int(os.environ.get('OUTBOUND_MAX_WORKERS', 16))
+    OUTBOUND_HOST_CONCURRENCY = int(os.environ.get('OUTBOUND_HOST_CONCURRENCY', 8))
+    OUTBOUND_FAILURE_THRESHOLD = int(os.environ.get('OUTBOUND_FAILURE_THRESHOLD', 5))
+    OUTBOUND_RESET_TIMEOUT = float(os.environ.get('OUTBOUND_RESET_TIMEOUT', 30))
+    
+    # Geocoding Configuration
+    # Nominatim allows 1 request per second per application; the limit below is
+    # shared by every worker process through the rate_limits table
+    GEOCODER_URL = os.environ.get('GEOCODER_URL', 'https://nominatim.openstreetmap.org/search')
+    GEOCODER_USER_AGENT = 'ParkAndGo-UMN-App/1.0'
+    GEOCODER_RATE_LIMIT = float(os.environ.get('GEOCODER_RATE_LIMIT', 1.0))
+    GEOCODER_TIMEOUT = 5
+    GEOCODER_DEADLINE = 10  # seconds for a whole lookup, however slowly the response arrives
+    GEOCODE_BATCH_SIZE = 20
+    GEOCODE_MAX_ATTEMPTS = 5
+    GEOCODE_NOT_FOUND_TTL = 24 * 60 * 60  # seconds before retrying an address Nominatim didn't find
+    
+    # Routing Configuration
+    # /api/route asks this OSRM server for routes; origins are snapped to a grid
+    # of ROUTE_GRID_METERS cells so nearby users share cached routes
+    OSRM_URL = os.environ.get('OSRM_URL', 'https://router.project-osrm.org')
+    OSRM_TIMEOUT = 5
+    OSRM_DEADLINE = 8  # seconds for a whole route request, /api/route answers 502 after it
+    OSRM_POOL_SIZE = 10  # keep-alive connections to OSRM per worker process
+    ROUTE_GRID_METERS = float(os.environ.get('ROUTE_GRID_METERS', 100))
+    ROUTE_CACHE_SIZE = int(os.environ.get('ROUTE_CACHE_SIZE', 2048))
+    ROUTE_CACHE_TTL = float(os.environ.get('ROUTE_CACHE_TTL', 900))  # seconds
+    
+    # User Cache Configuration
+    # Cached users are dropped immediately when changed by this worker; the TTL
+    # bounds how long other workers can serve an out-of-date profile
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE', 1024))
+    USER_CACHE_TTL = float(os.environ.get('USER_CACHE_TTL', 30))
+    
+    # Recommendation Cache Configuration
+    # Rankings are shared by users with the same profile segment whose locations
+    # fall in the same grid cell; everything is dropped when spot data changes
+    RECOMMENDATION_CACHE_SIZE = int(os.environ.get('RECOMMENDATION_CACHE_SIZE', 4096))
+    RECOMMENDATION_GRID_METERS = float(os.environ.get('RECOMMENDATION_GRID_METERS', 50))
+    # Most queries one POST /api/recommendations/batch may carry
+    RECOMMENDATION_BATCH_MAX = int(os.environ.get('RECOMMENDATION_BATCH_MAX', 100))
+    
+    # Bulk Import Configuration
+    # POST /api/admin/import needs "Authorization: Bearer <ADMIN_TOKEN>" and is
+    # disabled when ADMIN_TOKEN is unset; spot_import.py works without it
+    ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+    SPOT_IMPORT_BATCH_SIZE = 1000  # rows per COPY or executemany batch
+    # executemany, or copy (PostgreSQL with psycopg2 only) once
+    # tests/test_spot_import.py has passed against your database
+    SPOT_IMPORT_METHOD = os.environ.get('SPOT_IMPORT_METHOD', 'executemany')
+    
+    # Occupancy Configuration
+    # Reports are averaged per spot with older ones fading by half every
+    # OCCUPANCY_HALF_LIFE seconds; spots without a report for OCCUPANCY_MAX_AGE
+    # seconds go back to unknown. Sensors post with "Authorization: Bearer
+    # <OCCUPANCY_TOKEN>", signed-in users can post crowd reports without it
+    OCCUPANCY_TOKEN = os.environ.get('OCCUPANCY_TOKEN')
+    OCCUPANCY_HALF_LIFE = float(os.environ.get('OCCUPANCY_HALF_LIFE', 300))
+    OCCUPANCY_MAX_AGE = float(os.environ.get('OCCUPANCY_MAX_AGE', 1800))
+    OCCUPANCY_PUBLISH_INTERVAL = 2.0  # seconds between pushes to scoring and event streams
+    OCCUPANCY_FLUSH_INTERVAL = 10.0  # seconds between batched writes to spot_occupancy
+    OCCUPANCY_MAX_BATCH = 5000  # reports per request
+    OCCUPANCY_STREAM_MAX_SECONDS = 300  # streams close after this and the browser reconnects
+    # Open event streams per worker process; each holds one of its
+    # GUNICORN_THREADS threads, so by default half of them can stream and past
+    # that browsers poll GET /api/occupancy (no streams with a single thread)
+    OCCUPANCY_MAX_SUBSCRIBERS = int(os.environ.get(
+        'OCCUPANCY_MAX_SUBSCRIBERS', int(os.environ.get('GUNICORN_THREADS', 4)) // 2
+    ))
+    OCCUPANCY_POLL_INTERVAL = 15  # seconds, suggested to browsers polling instead of streaming
+    
+    # Metrics Configuration
+    # /metrics serves Prometheus text format; set METRICS_TOKEN to require
+    # "Authorization: Bearer <token>" from the scraper
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
     # Google OAuth Configuration
     GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
     GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
     GOOGLE_DISCOVERY_URL = "https://accounts.google.com/.well-known/openid-configuration"
+    GOOGLE_DISCOVERY_TTL = 3600  # seconds, used when Google sends no Cache-Control max-age
+    GOOGLE_DISCOVERY_PREFETCH = os.environ.get('GOOGLE_DISCOVERY_PREFETCH', 'true').lower() == 'true'
+    GOOGLE_HTTP_TIMEOUT = (3.05, 10)  # (connect, read) seconds
+    GOOGLE_HTTP_DEADLINE = 12  # seconds for a whole call to Google
+    GOOGLE_HTTP_POOL_SIZE = 10
     
     # Session Configuration
     SESSION_COOKIE_SECURE = True  # Set to True for production
@@ -0,0 +1,371 @@
+"""
+Geocoding for user-submitted parking spots
+Addresses are resolved on a background thread, rate limited for Nominatim
+across every worker, and cached in the geocode_cache table so every worker
+shares the results.
+
+Backfill spots that are still missing coordinates with:
+    python geocoding.py
+"""
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+import requests
+from sqlalchemy import text
+from models import db, ParkingSpot, GeocodeCache, RateLimit
+from spot_cache import spot_cache, bump_spot_data_version
+from outbound import outbound
+
+
+class GeocodingError(Exception):
+    """
+    A lookup failed for a reason worth retrying (network error, rate limited, 5xx)
+    """
+
+
+def normalize_address(address):
+    """
+    Cache key for an address: lowercased with whitespace collapsed
+    """
+    return re.sub(r'\s+', ' ', address.strip().lower())[:255]
+
+
+class SharedRateLimiter:
+    """
+    Blocking rate limiter shared by every process using the database
+
+    Each call reserves the next free slot with one UPDATE of the limiter's
+    row in rate_limits and sleeps until its slot, so all workers together
+    stay under rate. Slots are unix times, so hosts sharing a limiter need
+    synchronized clocks. Call inside an app context.
+    """
+
+    def __init__(self, name, rate):
+        self.name = name
+        self.interval = 1.0 / rate
+
+    def acquire(self):
+        """
+        Wait for a slot
+        """
+        time.sleep(max(self.reserve() - time.time(), 0.0))
+
+    def reserve(self):
+        """
+        Take the next free slot and return when it starts (unix seconds)
+        Runs in its own transaction so the row is only locked for the UPDATE
+        """
+        while True:
+            now = time.time()
+            with db.engine.begin() as connection:
+                next_at = connection.execute(text(
+                    'UPDATE rate_limits '
+                    'SET next_at = CASE WHEN next_at > :now THEN next_at ELSE :now END + :interval '
+                    'WHERE name = :name RETURNING next_at'
+                ), {'name': self.name, 'now': now, 'interval': self.interval}).scalar()
+                if next_at is not None:
+                    return next_at - self.interval
+                # First use of this limiter; if another worker creates the row first, take a slot from it
+                if connection.dialect.name == 'postgresql':
+                    from sqlalchemy.dialects.postgresql import insert
+                else:
+                    from sqlalchemy.dialects.sqlite import insert
+                created = connection.execute(
+                    insert(RateLimit.__table__)
+                    .values(name=self.name, next_at=now + self.interval)
+                    .on_conflict_do_nothing(index_elements=['name'])
+                ).rowcount
+                if created:
+                    return now
+
+
+class NominatimGeocoder:
+    """
+    Looks addresses up against a Nominatim-compatible search endpoint
+    Point GEOCODER_URL at a local stand-in to run without the public service
+    """
+
+    def __init__(self, url, user_agent, timeout=5, deadline=None):
+        self.url = url
+        self.http = outbound.client(
+            'nominatim', timeout=timeout, deadline=deadline, pool_size=2, headers={'User-Agent': user_agent}
+        )
+
+    def geocode(self, address):
+        """
+        Returns {'lat': float, 'lon': float}, or None if the address wasn't found
+        Raises GeocodingError if the lookup should be retried
+        """
+        params = {
+            'q': address,
+            'format': 'json',
+            'limit': 1
+        }
+        try:
+            response = self.http.get(self.url, params=params)
+        except requests.RequestException as e:
+            raise GeocodingError(str(e)) from e
+
+        if response.status_code == 429 or response.status_code >= 500:
+            raise GeocodingError(f'Geocoder returned {response.status_code}')
+        if response.status_code != 200:
+            return None
+
+        # A 200 with an HTML error page or a cut-off body is worth retrying too
+        try:
+            data = response.json()
+            if data and len(data) > 0:
+                return {
+                    'lat': float(data[0]['lat']),
+                    'lon': float(data[0]['lon'])
+                }
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            raise GeocodingError(f'Geocoder returned an unreadable response: {e}') from e
+        return None
+
+
+class PendingAddress:
+    """
+    One address waiting to be geocoded, and the spots that need it
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.spot_ids = set()
+        self.attempts = 0
+        self.not_before = 0.0
+
+
+class GeocodeQueue:
+    """
+    Resolves spot addresses off the request path
+
+    Submissions for the same address are merged. A daemon thread works through
+    the queue in batches: it reads geocode_cache first, calls the geocoder for
+    misses through the shared rate limiter, retries failures with exponential backoff,
+    then writes coordinates for every waiting spot and bumps the spot data
+    version once per batch.
+    """
+
+    def __init__(self):
+        self.app = None
+        self.geocoder = None
+        self.limiter = None
+        self.batch_size = 20
+        self.max_attempts = 5
+        self.backoff = 2.0
+        self.not_found_ttl = timedelta(days=1)
+        self.pending = {}
+        self.in_flight = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def init_app(self, app, geocoder=None):
+        self.app = app
+        self.geocoder = geocoder or NominatimGeocoder(
+            app.config['GEOCODER_URL'],
+            app.config['GEOCODER_USER_AGENT'],
+            timeout=app.config['GEOCODER_TIMEOUT'],
+            deadline=app.config['GEOCODER_DEADLINE']
+        )
+        self.limiter = SharedRateLimiter('geocoder', app.config['GEOCODER_RATE_LIMIT'])
+        self.batch_size = app.config['GEOCODE_BATCH_SIZE']
+        self.max_attempts = app.config['GEOCODE_MAX_ATTEMPTS']
+        self.not_found_ttl = timedelta(seconds=app.config['GEOCODE_NOT_FOUND_TTL'])
+
+    def submit(self, spot_id, address):
+        """
+        Queue a spot's address for geocoding
+        """
+        if not address:
+            return
+        key = normalize_address(address)
+        with self._condition:
+            item = self.pending.get(key)
+            if item is None:
+                item = self.pending[key] = PendingAddress(address)
+            item.spot_ids.add(spot_id)
+            self._condition.notify()
+        self._ensure_worker()
+
+    def submit_missing(self, limit=1000):
+        """
+        Queue every spot that has an address but no coordinates
+        Returns how many spots were queued
+        """
+        spots = db.session.query(ParkingSpot.spot_id, ParkingSpot.address).filter(
+            ParkingSpot.latitude.is_(None),
+            ParkingSpot.address.isnot(None)
+        ).order_by(ParkingSpot.spot_id).limit(limit).all()
+        for spot_id, address in spots:
+            self.submit(spot_id, address)
+        return len(spots)
+
+    def lookup(self, address):
+        """
+        Geocode one address synchronously, using and filling the shared cache
+        Returns {'lat': float, 'lon': float} or None
+        """
+        key = normalize_address(address)
+        cached = self._cached([key]).get(key)
+        if cached is not None:
+            return cached.to_dict()
+        try:
+            self.limiter.acquire()
+            result = self.geocoder.geocode(address)
+        except GeocodingError as e:
+            print(f"Geocoding error: {e}")
+            return None
+        self._store(key, address, result)
+        db.session.commit()
+        return result
+
+    def wait_until_idle(self, timeout=None):
+        """
+        Block until the queue is empty, mostly useful for scripts
+        Returns False if the timeout ran out first
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while self.pending or self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+        return True
+
+    # ============= WORKER =============
+    def _ensure_worker(self):
+        # Started lazily so gunicorn workers forked after import each get their own thread
+        with self._condition:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='geocode-queue', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                with self.app.app_context():
+                    failed = self._process(batch)
+            except Exception as e:
+                print(f"Geocode batch failed: {e}")
+                failed = batch
+            # Once per item per batch, so a batch that fails after some lookups
+            # did doesn't count those items twice
+            for key, item in failed:
+                self._retry(key, item)
+            with self._condition:
+                self.in_flight -= len(batch)
+                self._condition.notify_all()
+
+    def _next_batch(self):
+        """
+        Wait for addresses that are due and take up to batch_size of them off the queue
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                ready = [key for key, item in self.pending.items() if item.not_before <= now]
+                if ready:
+                    batch = [(key, self.pending.pop(key)) for key in ready[:self.batch_size]]
+                    self.in_flight += len(batch)
+                    return batch
+                next_due = min((item.not_before for item in self.pending.values()), default=None)
+                self._condition.wait(None if next_due is None else next_due - now)
+
+    def _process(self, batch):
+        """
+        Geocode a batch and write the coordinates; returns the items to retry
+        """
+        cached = self._cached([key for key, _ in batch])
+        resolved = {}
+        failed = []
+        for key, item in batch:
+            if key in cached:
+                resolved[key] = cached[key].to_dict()
+                continue
+            self.limiter.acquire()
+            try:
+                result = self.geocoder.geocode(item.address)
+            except GeocodingError as e:
+                print(f"Geocoding error for {item.address!r}: {e}")
+                failed.append((key, item))
+                continue
+            self._store(key, item.address, result)
+            resolved[key] = result
+
+        updated = 0
+        for key, item in batch:
+            result = resolved.get(key)
+            if result is None:
+                continue
+            updated += ParkingSpot.query.filter(
+                ParkingSpot.spot_id.in_(sorted(item.spot_ids)),
+                ParkingSpot.latitude.is_(None)
+            ).update({
+                'latitude': result['lat'],
+                'longitude': result['lon']
+            }, synchronize_session=False)
+
+        if updated:
+            bump_spot_data_version()
+        db.session.commit()
+        if updated:
+            spot_cache.refresh()
+        return failed
+
+    def _retry(self, key, item):
+        item.attempts += 1
+        if item.attempts >= self.max_attempts:
+            print(f"Giving up geocoding {item.address!r} after {item.attempts} attempts")
+            return
+        item.not_before = time.monotonic() + self.backoff ** item.attempts
+        with self._condition:
+            existing = self.pending.get(key)
+            if existing is not None:
+                # Resubmitted while we were working on it, keep both sets of spots
+                existing.spot_ids |= item.spot_ids
+            else:
+                self.pending[key] = item
+            self._condition.notify()
+
+    def _cached(self, keys):
+        """
+        Fresh geocode_cache rows for the given keys, by key
+        """
+        rows = GeocodeCache.query.filter(GeocodeCache.address_key.in_(keys)).all()
+        expired = datetime.utcnow() - self.not_found_ttl
+        cached = {
+            row.address_key: row for row in rows
+            if row.found or (row.updated_at and row.updated_at > expired)
+        }
+        self.cache_hits += len(cached)
+        self.cache_misses += len(set(keys)) - len(cached)
+        return cached
+
+    def _store(self, key, address, result):
+        db.session.merge(GeocodeCache(
+            address_key=key,
+            address=address[:255],
+            latitude=result['lat'] if result else None,
+            longitude=result['lon'] if result else None,
+            found=result is not None,
+            updated_at=datetime.utcnow()
+        ))
+
+
+geocode_queue = GeocodeQueue()
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        queued = geocode_queue.submit_missing()
+    print(f"Queued {queued} spot(s) for geocoding")
+    geocode_queue.wait_until_idle()
+    print("Geocoding finished")
@@ -0,0 +1,48 @@
+"""
+Gunicorn settings, read automatically from the working directory
+Run `flask --app app bootstrap` once per deploy before starting the server;
+importing the app never touches the schema.
+
+With preload_app the parent imports the app and loads the spot snapshot and
+its indexes once, then every worker forks from that warm parent.
+"""
+import os
+
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Workers default to WEB_CONCURRENCY, which gunicorn reads itself
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+# Threads per worker, so open occupancy event streams don't tie up a whole
+# worker each
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# gthread, plus the time each request waited for a thread so admission
+# control can shed requests that queued too long
+worker_class = 'gunicorn_workers.QueueTimedWorker'
+keepalive = 5
+
+
+def when_ready(server):
+    """
+    Parent process, after the app is loaded and before any worker is forked
+    """
+    if not preload_app:
+        return
+    from app import app, warm_caches
+    try:
+        warm_caches(app)
+    except Exception as e:
+        # Workers load the snapshot themselves on first request
+        server.log.warning(f"Could not warm caches before forking: {e}")
+
+
+def post_worker_init(worker):
+    """
+    Each worker, once it has the app
+    """
+    from app import app, prepare_worker
+    prepare_worker(app)
+    report = app.extensions.get('startup_report')
+    if report is not None:
+        worker.log.info(f"Worker {worker.pid} ready, create_app took {report.total * 1000:.1f}ms")
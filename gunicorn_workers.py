@@ -0,0 +1,33 @@
+"""
+Gunicorn worker that tells the app how long each request waited for a thread
+
+With the gthread worker a request is read and queued as soon as it arrives,
+then waits for one of GUNICORN_THREADS threads. Admission control only runs
+once a thread picks it up, so it can't see that wait on its own; this worker
+stamps each request when it is queued and passes the time on in a header.
+"""
+import time
+from gunicorn.workers.gthread import ThreadWorker
+from admission import QUEUED_AT_HEADER
+
+
+HEADER_NAME = QUEUED_AT_HEADER.upper()
+
+
+class QueueTimedWorker(ThreadWorker):
+    """
+    gthread worker that adds X-Parkandgo-Queued-At (seconds since the epoch)
+    to every request, replacing any copy the client sent
+    """
+
+    def enqueue_req(self, conn):
+        # Called when a new or kept-alive connection has a request to read
+        conn.queued_at = time.time()
+        super().enqueue_req(conn)
+
+    def handle_request(self, req, conn):
+        queued_at = getattr(conn, 'queued_at', None)
+        req.headers = [(name, value) for name, value in req.headers if name != HEADER_NAME]
+        if queued_at is not None:
+            req.headers.append((HEADER_NAME, f'{queued_at:.6f}'))
+        return super().handle_request(req, conn)
@@ -0,0 +1,152 @@
+"""
+Conditional GET and precompressed JSON responses for spot listing endpoints
+Bodies depend only on the spot data version and the request's query string,
+so both the ETag and the encoded bytes can be reused until the data changes.
+"""
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Response, current_app, request
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+# Bump when the JSON shape of these responses changes so old ETags stop matching
+RESPONSE_FORMAT = 2
+
+# Bodies smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 512
+
+
+def encode(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        # mtime=0 keeps the output identical for identical input
+        return gzip.compress(body, compresslevel=6, mtime=0)
+    return body
+
+
+def negotiate_encoding(accept_encoding, size):
+    """
+    Pick the content encoding for a body of `size` bytes
+    """
+    if size < MIN_COMPRESS_SIZE:
+        return 'identity'
+    if brotli is not None and accept_encoding['br']:
+        return 'br'
+    if accept_encoding['gzip']:
+        return 'gzip'
+    return 'identity'
+
+
+class EncodedResponseCache:
+    """
+    Serialized and compressed bodies for the current data version
+    Everything is dropped as soon as a request arrives with a newer version
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.version = None
+        self._bodies = OrderedDict()  # request key -> {encoding: bytes}
+        self._lock = threading.Lock()
+
+    def get(self, version, key, encoding, build_body):
+        """
+        Bytes for `key` in `encoding`, serializing and compressing only on a miss
+        """
+        with self._lock:
+            if version != self.version:
+                self._bodies.clear()
+                self.version = version
+            variants = self._bodies.get(key)
+            if variants is not None:
+                self._bodies.move_to_end(key)
+                if encoding in variants:
+                    return variants[encoding]
+
+        if variants is None or 'identity' not in variants:
+            variants = {'identity': build_body()}
+        body = variants.get(encoding)
+        if body is None:
+            body = encode(variants['identity'], encoding)
+
+        with self._lock:
+            if version == self.version:
+                stored = self._bodies.setdefault(key, {})
+                stored.update(variants)
+                stored[encoding] = body
+                self._bodies.move_to_end(key)
+                while len(self._bodies) > self.maxsize:
+                    self._bodies.popitem(last=False)
+        return body
+
+    def identity_size(self, version, key, build_body):
+        return len(self.get(version, key, 'identity', build_body))
+
+
+response_cache = EncodedResponseCache()
+
+
+def request_key():
+    """
+    What a spot listing response depends on besides the data version
+    """
+    return (request.path, tuple(sorted(request.args.items(multi=True))))
+
+
+def make_etag(version, key, encoding):
+    digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()[:16]
+    suffix = '' if encoding == 'identity' else f'-{encoding}'
+    return f'{RESPONSE_FORMAT}-{version}-{digest}{suffix}'
+
+
+def conditional_json(version, build_payload, max_age=None):
+    """
+    Respond with the JSON from build_payload(), or 304 if the client already has it
+
+    build_payload is only called when no encoded body is cached for this
+    version and query string, and not at all for a matching If-None-Match.
+    It may return already encoded JSON bytes (see serialization.py).
+    """
+    if max_age is None:
+        max_age = current_app.config.get('SPOT_RESPONSE_MAX_AGE', 0)
+    key = request_key()
+
+    # If-None-Match uses weak comparison, so any encoding of this version matches
+    matched = None
+    if request.if_none_match:
+        for name in ('identity', 'gzip', 'br'):
+            tag = make_etag(version, key, name)
+            if request.if_none_match.contains_weak(tag):
+                matched = tag
+                break
+
+    if matched is not None:
+        response = Response(status=304)
+        response.set_etag(matched)
+    else:
+        def build_body():
+            payload = build_payload()
+            if isinstance(payload, bytes):
+                return payload
+            return current_app.json.dumps(payload).encode('utf-8')
+
+        size = response_cache.identity_size(version, key, build_body)
+        encoding = negotiate_encoding(request.accept_encodings, size)
+        response = Response(
+            response_cache.get(version, key, encoding, build_body),
+            mimetype='application/json'
+        )
+        if encoding != 'identity':
+            response.headers['Content-Encoding'] = encoding
+        response.set_etag(make_etag(version, key, encoding))
+
+    response.headers['Cache-Control'] = f'public, max-age={max_age}, must-revalidate'
+    response.vary.add('Accept-Encoding')
+    return response
@@ -1,8 +1,8 @@
-from app import app, db
-from models import ParkingSpot, MajorCampusMapping
+from models import db, ParkingSpot, MajorCampusMapping
+from spot_cache import bump_spot_data_version
 import os
 
-def init_database():
+def init_database(app):
     """Initialize database with tables and seed data"""
     with app.app_context():
         try:
@@ -139,6 +139,8 @@ def init_database():
             for mapping in major_mappings:
                 db.session.add(mapping)
             
+            # Same transaction as the seed rows, so workers that already cached the empty table reload
+            bump_spot_data_version()
             db.session.commit()
             print("Database seeded successfully")
             
@@ -152,4 +154,5 @@ if __name__ == '__main__':
     if not os.getenv('DATABASE_URL'):
         print("DATABASE_URL not set. Using default configuration.")
     
-    init_database()
+    from app import create_app
+    init_database(create_app())
@@ -0,0 +1,351 @@
+"""
+Request, SQL, connection pool and outbound HTTP metrics in Prometheus text format
+Each worker process keeps its own counters; scrape every worker (or sum
+across them) to see the whole deployment.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from models import db
+
+
+# Upper bounds in seconds, roughly doubling from 1ms to 10s
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(
+        f'{name}="{escape_label(value)}"' for name, value in zip(names, values)
+    )
+    return '{' + pairs + '}'
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for label_values, value in items:
+            lines.append(f'{self.name}{format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    """
+    Fixed-bucket histogram, observe() is a bisect and an increment under a lock
+    """
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            series[position] += 1
+            series[-1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        for label_values, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                labels = format_labels(self.labels + ('le',), label_values + (bound,))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {series[-1]}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Gauge:
+    """
+    Values read from a callback at scrape time, so nothing is tracked between scrapes
+    collect() returns {label values tuple: number}; metric_type='counter' exports
+    totals that something else already keeps, like cache hit counts
+    """
+
+    def __init__(self, name, help_text, collect, labels=(), metric_type='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.collect = collect
+        self.metric_type = metric_type
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} {self.metric_type}']
+        try:
+            values = self.collect()
+        except Exception as e:
+            print(f"Metrics collector {self.name} failed: {e}")
+            return lines
+        for label_values, value in sorted(values.items()):
+            lines.append(f'{self.name}{format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Metrics:
+    """
+    Registry of every metric the app exports, plus the hooks that fill them
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self._metrics = []
+        self._engines = set()
+        self._caches = {}  # cache name -> callable returning (hits, misses)
+        self.pool_wait_warning = 1.0
+        self._pool_warned_at = 0.0
+        self._pool_warnings_suppressed = 0
+
+        self.request_duration = self.histogram(
+            'parkandgo_http_request_duration_seconds',
+            'Time spent handling requests, by route',
+            labels=('method', 'route', 'status')
+        )
+        self.sql_duration = self.histogram(
+            'parkandgo_sql_statement_duration_seconds',
+            'Time spent executing SQL statements',
+            buckets=SQL_BUCKETS
+        )
+        self.sql_statements = self.counter(
+            'parkandgo_sql_statements_total',
+            'SQL statements executed, by route (or "background" outside requests)',
+            labels=('route',)
+        )
+        self.sql_per_request = self.histogram(
+            'parkandgo_sql_statements_per_request',
+            'SQL statements executed per request, by route',
+            labels=('route',),
+            buckets=COUNT_BUCKETS
+        )
+        self.pool_wait = self.histogram(
+            'parkandgo_db_pool_checkout_wait_seconds',
+            'Time spent waiting for a database connection from the pool',
+            buckets=SQL_BUCKETS + (2.5, 5.0, 10.0, 30.0)
+        )
+        self.pool_exhausted = self.counter(
+            'parkandgo_db_pool_exhausted_total',
+            'Checkouts that gave up waiting for a free connection (timeout) or waited too long (slow)',
+            labels=('kind',)
+        )
+        self.outbound_duration = self.histogram(
+            'parkandgo_outbound_request_duration_seconds',
+            'Latency of calls to external services',
+            labels=('service', 'outcome')
+        )
+        self.gauge(
+            'parkandgo_cache_lookups_total',
+            'Cache lookups by cache and result',
+            self._cache_lookups,
+            labels=('cache', 'result'),
+            metric_type='counter'
+        )
+        self.gauge(
+            'parkandgo_db_pool_connections',
+            'Database pool connections by state',
+            self._pool_status,
+            labels=('state',)
+        )
+
+    def counter(self, name, help_text, labels=()):
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help_text, collect, labels=(), metric_type='gauge'):
+        metric = Gauge(name, help_text, collect, labels, metric_type)
+        self._metrics.append(metric)
+        return metric
+
+    def register_cache(self, name, counts):
+        """
+        Export a cache's hit and miss totals, counts() returns (hits, misses)
+        """
+        self._caches[name] = counts
+
+    def init_app(self, app):
+        self.enabled = app.config.get('METRICS_ENABLED', True)
+        self.pool_wait_warning = app.config.get('DB_POOL_WAIT_WARNING', self.pool_wait_warning)
+        if not self.enabled:
+            return
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        with app.app_context():
+            self.instrument_engine(db.engine)
+
+    def render(self):
+        """
+        Every metric in Prometheus text exposition format
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    @contextmanager
+    def outbound(self, service):
+        """
+        Time a call to an external service, recording whether it raised
+        """
+        started = time.perf_counter()
+        outcome = 'error'
+        try:
+            yield
+            outcome = 'ok'
+        finally:
+            if self.enabled:
+                self.outbound_duration.observe(time.perf_counter() - started, service, outcome)
+
+    def _cache_lookups(self):
+        values = {}
+        for name, counts in self._caches.items():
+            hits, misses = counts()
+            values[(name, 'hit')] = hits
+            values[(name, 'miss')] = misses
+        return values
+
+    # ============= REQUEST HOOKS =============
+    def _start_request(self):
+        g.metrics_started = time.perf_counter()
+        g.metrics_sql_statements = 0
+
+    def _finish_request(self, response):
+        started = g.get('metrics_started')
+        if started is not None:
+            route = request_route()
+            self.request_duration.observe(
+                time.perf_counter() - started,
+                request.method, route, response.status_code
+            )
+            self.sql_per_request.observe(g.get('metrics_sql_statements', 0), route)
+        return response
+
+    # ============= SQLALCHEMY HOOKS =============
+    def instrument_engine(self, engine):
+        """
+        Count and time every statement, and time pool checkouts, on an engine
+        """
+        if engine in self._engines:
+            return
+        self._engines.add(engine)
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            started = conn.info['metrics_started'].pop()
+            self.sql_duration.observe(time.perf_counter() - started)
+            if has_request_context():
+                g.metrics_sql_statements = g.get('metrics_sql_statements', 0) + 1
+                self.sql_statements.inc(request_route())
+            else:
+                self.sql_statements.inc('background')
+
+        @event.listens_for(engine, 'handle_error')
+        def handle_error(context):
+            stack = context.connection.info.get('metrics_started') if context.connection is not None else None
+            if stack:
+                stack.pop()
+
+        # The pool has no before-checkout event, so time the engine's checkout call;
+        # wrapping the engine rather than the pool survives engine.dispose()
+        raw_connection = engine.raw_connection
+
+        def timed_raw_connection():
+            started = time.perf_counter()
+            try:
+                connection = raw_connection()
+            except PoolTimeoutError:
+                waited = time.perf_counter() - started
+                self.pool_wait.observe(waited)
+                self.pool_exhausted.inc('timeout')
+                self._warn_pool(engine, f"gave up after {waited:.2f}s waiting for a connection")
+                raise
+            waited = time.perf_counter() - started
+            self.pool_wait.observe(waited)
+            if waited >= self.pool_wait_warning:
+                self.pool_exhausted.inc('slow')
+                self._warn_pool(engine, f"waited {waited:.2f}s for a connection")
+            return connection
+        engine.raw_connection = timed_raw_connection
+
+    def _warn_pool(self, engine, message):
+        """
+        Log pool exhaustion, at most once every 10 seconds so a connection storm doesn't flood the log
+        """
+        now = time.monotonic()
+        if now - self._pool_warned_at < 10:
+            self._pool_warnings_suppressed += 1
+            return
+        suppressed = self._pool_warnings_suppressed
+        self._pool_warned_at = now
+        self._pool_warnings_suppressed = 0
+        status = engine.pool.status() if hasattr(engine.pool, 'status') else ''
+        extra = f" ({suppressed} similar since last warning)" if suppressed else ''
+        print(f"Database pool exhausted: {message}; {status}{extra}")
+
+    def _pool_status(self):
+        status = {}
+        for engine in self._engines:
+            pool = engine.pool
+            counts = {
+                'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+                'size': pool.size() if hasattr(pool, 'size') else None,
+                'overflow': max(pool.overflow(), 0) if hasattr(pool, 'overflow') else None,
+            }
+            for state, count in counts.items():
+                if count is not None:
+                    status[(state,)] = status.get((state,), 0) + count
+        return status
+
+
+def request_route():
+    """
+    The URL rule that matched, so /api/tiles/1/2/3 and /api/tiles/4/5/6 share a series
+    """
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+metrics = Metrics()
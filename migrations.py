@@ -0,0 +1,310 @@
+"""
+Versioned schema migrations
+Each migration runs once per database and is recorded in schema_migrations
+"""
+from datetime import datetime
+from sqlalchemy import Boolean, Column, DateTime, Float, ForeignKey, Integer, MetaData, String, Table, Text, inspect, text
+from models import db
+
+
+# Arbitrary key for the Postgres advisory lock that serializes migrations
+# when several workers start at once
+MIGRATION_LOCK_ID = 72171
+
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """
+    Register a migration function, called with an open SQLAlchemy connection
+    """
+    def register(func):
+        MIGRATIONS.append((version, name, func))
+        MIGRATIONS.sort(key=lambda item: item[0])
+        return func
+    return register
+
+
+# ============= FROZEN SCHEMAS =============
+# Tables as each migration created them. Migrations never build from the
+# current models, which already have what later migrations add, so
+# replaying them on an empty database always gives the same schema
+FROZEN = MetaData()
+
+baseline_users = Table(
+    'users', FROZEN,
+    Column('user_id', Integer, primary_key=True),
+    Column('google_id', String(255), unique=True, nullable=True),
+    Column('email', String(255), unique=True, nullable=False),
+    Column('profile_pic', String(500), nullable=True),
+    Column('first_name', String(100), nullable=False),
+    Column('last_name', String(100), nullable=False),
+    Column('preferred_parking_types', String(250)),
+    Column('major', String(100), nullable=True),
+    Column('major_category', String(100)),
+    Column('grade_level', String(100)),
+    Column('graduation_year', Integer),
+    Column('housing_type', String(50)),
+    Column('created_at', DateTime)
+)
+
+baseline_parking_spots = Table(
+    'parking_spots', FROZEN,
+    Column('spot_id', Integer, primary_key=True),
+    Column('spot_name', String(100), nullable=False),
+    Column('campus_location', String(100)),
+    Column('parking_type', String(100)),
+    Column('cost', Float),
+    Column('walk_time', String(100)),
+    Column('near_buildings', Text),
+    Column('address', String(255)),
+    Column('latitude', Float),
+    Column('longitude', Float),
+    Column('is_verified', Boolean),
+    Column('created_at', DateTime)
+)
+
+baseline_major_campus_mapping = Table(
+    'major_campus_mapping', FROZEN,
+    Column('mapping_id', Integer, primary_key=True),
+    Column('major_name', String(100), nullable=False),
+    Column('major_category', String(50)),
+    Column('primary_campus', String(20)),
+    Column('common_buildings', Text)
+)
+
+baseline_spot_data_version = Table(
+    'spot_data_version', FROZEN,
+    Column('version_id', Integer, primary_key=True),
+    Column('version', Integer, nullable=False),
+    Column('updated_at', DateTime)
+)
+
+geocode_cache_v4 = Table(
+    'geocode_cache', FROZEN,
+    Column('address_key', String(255), primary_key=True),
+    Column('address', String(255), nullable=False),
+    Column('latitude', Float),
+    Column('longitude', Float),
+    Column('found', Boolean, nullable=False),
+    Column('updated_at', DateTime)
+)
+
+spot_occupancy_v6 = Table(
+    'spot_occupancy', FROZEN,
+    Column('spot_id', Integer, ForeignKey('parking_spots.spot_id', ondelete='CASCADE'), primary_key=True),
+    Column('occupancy', Float, nullable=False),
+    Column('weight', Float, nullable=False),
+    Column('updated_at', DateTime, nullable=False, index=True)
+)
+
+rate_limits_v8 = Table(
+    'rate_limits', FROZEN,
+    Column('name', String(50), primary_key=True),
+    Column('next_at', Float, nullable=False)
+)
+
+
+# ============= MIGRATIONS =============
+@migration(1, 'initial_schema')
+def initial_schema(connection):
+    """
+    Tables as they were created by db.create_all() before migrations existed
+    """
+    for table in (baseline_users, baseline_parking_spots, baseline_major_campus_mapping, baseline_spot_data_version):
+        table.create(bind=connection, checkfirst=True)
+
+
+@migration(2, 'parking_spot_filter_indexes')
+def parking_spot_filter_indexes(connection):
+    """
+    Indexes for filtering by campus, parking type and cost, and for
+    the spots-with-coordinates scans used by search and recommendations
+    """
+    statements = [
+        'CREATE INDEX IF NOT EXISTS ix_parking_spots_campus_type_cost '
+        'ON parking_spots (campus_location, parking_type, cost)',
+        'CREATE INDEX IF NOT EXISTS ix_parking_spots_type_cost '
+        'ON parking_spots (parking_type, cost)',
+        'CREATE INDEX IF NOT EXISTS ix_parking_spots_cost '
+        'ON parking_spots (cost)',
+        'CREATE INDEX IF NOT EXISTS ix_parking_spots_located '
+        'ON parking_spots (spot_id) '
+        'WHERE latitude IS NOT NULL AND longitude IS NOT NULL',
+    ]
+    for statement in statements:
+        connection.execute(text(statement))
+
+
+@migration(3, 'parking_spot_trigram_indexes')
+def parking_spot_trigram_indexes(connection):
+    """
+    Trigram indexes so ILIKE '%q%' searches can use an index (Postgres only)
+    """
+    if connection.dialect.name != 'postgresql':
+        print("Skipping trigram indexes: only supported on PostgreSQL")
+        return
+
+    # pg_trgm may not be installable on every host, don't fail the whole migration run
+    savepoint = connection.begin_nested()
+    try:
+        connection.execute(text('CREATE EXTENSION IF NOT EXISTS pg_trgm'))
+        savepoint.commit()
+    except Exception as e:
+        savepoint.rollback()
+        print(f"Skipping trigram indexes: pg_trgm is not available ({e})")
+        return
+
+    for column in ('spot_name', 'address', 'campus_location', 'parking_type', 'near_buildings'):
+        connection.execute(text(
+            f'CREATE INDEX IF NOT EXISTS ix_parking_spots_{column}_trgm '
+            f'ON parking_spots USING gin ({column} gin_trgm_ops)'
+        ))
+
+
+@migration(4, 'geocode_cache')
+def geocode_cache(connection):
+    """
+    Shared geocode cache, and an index for finding spots still waiting on coordinates
+    """
+    geocode_cache_v4.create(bind=connection, checkfirst=True)
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_parking_spots_ungeocoded '
+        'ON parking_spots (spot_id) '
+        'WHERE latitude IS NULL AND address IS NOT NULL'
+    ))
+
+
+@migration(5, 'parking_spot_source_key')
+def parking_spot_source_key(connection):
+    """
+    Natural key for bulk imports: the dataset a spot came from and its id there
+    """
+    columns = {column['name'] for column in inspect(connection).get_columns('parking_spots')}
+    for column, column_type in (('source', 'VARCHAR(50)'), ('source_id', 'VARCHAR(100)')):
+        if column not in columns:
+            connection.execute(text(f'ALTER TABLE parking_spots ADD COLUMN {column} {column_type}'))
+    # Hand-added spots leave both NULL, which never conflicts
+    connection.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS ix_parking_spots_source_key '
+        'ON parking_spots (source, source_id)'
+    ))
+
+
+@migration(6, 'spot_occupancy')
+def spot_occupancy(connection):
+    """
+    Rolling occupancy estimates flushed from worker memory
+    """
+    spot_occupancy_v6.create(bind=connection, checkfirst=True)
+
+
+@migration(7, 'spot_occupancy_written_at')
+def spot_occupancy_written_at(connection):
+    """
+    Write time of each occupancy estimate, which workers page on when pulling
+    """
+    columns = {column['name'] for column in inspect(connection).get_columns('spot_occupancy')}
+    if 'written_at' not in columns:
+        # SQLite can't add a column with a CURRENT_TIMESTAMP default, flush() sets it explicitly
+        connection.execute(text('ALTER TABLE spot_occupancy ADD COLUMN written_at TIMESTAMP'))
+        connection.execute(text('UPDATE spot_occupancy SET written_at = updated_at'))
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text('ALTER TABLE spot_occupancy ALTER COLUMN written_at SET DEFAULT now()'))
+            connection.execute(text('ALTER TABLE spot_occupancy ALTER COLUMN written_at SET NOT NULL'))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_spot_occupancy_written_at ON spot_occupancy (written_at)'
+    ))
+
+
+@migration(8, 'rate_limits')
+def rate_limits(connection):
+    """
+    Rate limits shared by every worker, for Nominatim's one request per second
+    """
+    rate_limits_v8.create(bind=connection, checkfirst=True)
+
+
+@migration(9, 'drop_unused_parking_spot_indexes')
+def drop_unused_parking_spot_indexes(connection):
+    """
+    Filters, search and located-spot reads are served from the in-memory
+    snapshot, so the indexes from migrations 2 and 3 only slowed writes,
+    bulk imports most of all
+    """
+    names = [
+        'ix_parking_spots_campus_type_cost',
+        'ix_parking_spots_type_cost',
+        'ix_parking_spots_cost',
+        'ix_parking_spots_located',
+    ] + [
+        f'ix_parking_spots_{column}_trgm'
+        for column in ('spot_name', 'address', 'campus_location', 'parking_type', 'near_buildings')
+    ]
+    for name in names:
+        connection.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+
+# ============= RUNNER =============
+def applied_versions(connection):
+    """
+    Versions already recorded in schema_migrations
+    """
+    rows = connection.execute(text('SELECT version FROM schema_migrations'))
+    return {row[0] for row in rows}
+
+
+def upgrade(engine=None):
+    """
+    Apply every pending migration in order
+    Returns the list of (version, name) that were applied
+    """
+    engine = engine or db.engine
+    applied = []
+    with engine.begin() as connection:
+        if connection.dialect.name == 'postgresql':
+            connection.execute(text('SELECT pg_advisory_xact_lock(:lock_id)'), {'lock_id': MIGRATION_LOCK_ID})
+
+        connection.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version INTEGER PRIMARY KEY, '
+            'name VARCHAR(100) NOT NULL, '
+            'applied_at TIMESTAMP NOT NULL)'
+        ))
+        done = applied_versions(connection)
+
+        for version, name, func in MIGRATIONS:
+            if version in done:
+                continue
+            print(f"Applying migration {version:04d}_{name}")
+            func(connection)
+            connection.execute(
+                text('INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)'),
+                {'version': version, 'name': name, 'applied_at': datetime.utcnow()}
+            )
+            applied.append((version, name))
+    return applied
+
+
+def current_version(engine=None):
+    """
+    Highest applied migration version, or 0 for an unmigrated database
+    """
+    engine = engine or db.engine
+    with engine.connect() as connection:
+        try:
+            versions = applied_versions(connection)
+        except Exception:
+            return 0
+    return max(versions, default=0)
+
+
+if __name__ == '__main__':
+    from app import app
+
+    with app.app_context():
+        applied = upgrade()
+        if applied:
+            print(f"Applied {len(applied)} migration(s)")
+        print(f"Database is at migration {current_version()}")
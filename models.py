@@ -95,6 +95,15 @@ class ParkingSpot(db.Model):
     is_verified = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Where bulk-imported spots came from (e.g. 'minneapolis_meters') and their id
+    # there; re-importing a dataset updates its spots instead of duplicating them
+    source = db.Column(db.String(50))
+    source_id = db.Column(db.String(100))
+    
+    __table_args__ = (
+        db.Index('ix_parking_spots_source_key', 'source', 'source_id', unique=True),
+    )
+    
     def to_dict(self):
         """
         Convert parking spot object to dictionary
@@ -140,3 +149,77 @@ class MajorCampusMapping(db.Model):
     
     def __repr__(self):
         return f'<MajorCampusMapping {self.major_name}>'
+
+
+class SpotDataVersion(db.Model):
+    """
+    Single-row table holding the version of the parking spot data
+    Every write to parking_spots bumps this so cached copies know to reload
+    """
+    __tablename__ = 'spot_data_version'
+    
+    version_id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<SpotDataVersion {self.version}>'
+
+
+class GeocodeCache(db.Model):
+    """
+    Geocoding results shared by every worker, keyed by normalized address
+    Addresses that Nominatim couldn't find are stored too, with no coordinates
+    """
+    __tablename__ = 'geocode_cache'
+    
+    address_key = db.Column(db.String(255), primary_key=True)
+    address = db.Column(db.String(255), nullable=False)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    found = db.Column(db.Boolean, nullable=False, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    def to_dict(self):
+        if not self.found:
+            return None
+        return {
+            'lat': self.latitude,
+            'lon': self.longitude
+        }
+    
+    def __repr__(self):
+        return f'<GeocodeCache {self.address_key}>'
+
+
+class SpotOccupancy(db.Model):
+    """
+    Latest rolling occupancy estimate for each spot, written in batches by the
+    workers that receive reports so the others can pick them up
+    """
+    __tablename__ = 'spot_occupancy'
+    
+    spot_id = db.Column(db.Integer, db.ForeignKey('parking_spots.spot_id', ondelete='CASCADE'), primary_key=True)
+    occupancy = db.Column(db.Float, nullable=False)  # 0 empty to 1 full
+    weight = db.Column(db.Float, nullable=False)  # effective number of recent reports behind the estimate
+    updated_at = db.Column(db.DateTime, nullable=False, index=True)  # newest report behind the estimate
+    # When the row was last written, by the database's clock; workers pull on this
+    # since a late-arriving older report can be written after a newer one
+    written_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), index=True)
+    
+    def __repr__(self):
+        return f'<SpotOccupancy {self.spot_id} {self.occupancy:.2f}>'
+
+
+class RateLimit(db.Model):
+    """
+    Next free slot of a rate limit shared by every worker process
+    (see geocoding.SharedRateLimiter)
+    """
+    __tablename__ = 'rate_limits'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    next_at = db.Column(db.Float, nullable=False)  # unix seconds
+    
+    def __repr__(self):
+        return f'<RateLimit {self.name} {self.next_at}>'
@@ -0,0 +1,378 @@
+"""
+Live parking occupancy from sensor and crowd reports
+
+Reports are folded into a per-spot rolling estimate in memory. A background
+thread publishes the changed estimates every few seconds (to scoring and to
+Server-Sent Events subscribers) and periodically flushes them to the
+spot_occupancy table in one batch, picking up estimates flushed by other
+workers at the same time.
+"""
+import json
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, func
+from models import db, SpotOccupancy
+from metrics import metrics
+
+
+EPOCH = datetime(1970, 1, 1)
+
+# Each pull re-reads rows written this long before the newest one already seen,
+# so a row whose write committed after a later-stamped one isn't skipped.
+# Re-reading is harmless: estimates only replace older ones.
+PULL_OVERLAP = timedelta(seconds=30)
+
+
+class OccupancyEstimate:
+    """
+    Time-decayed average of the reports for one spot
+
+    Every report has weight 1 when it arrives and loses half of it every
+    half_life seconds, so the estimate follows the recent reports and a
+    burst of reports from one moment doesn't outweigh the trend.
+    """
+    __slots__ = ('occupancy', 'weight', 'updated_at')
+
+    def __init__(self, occupancy, weight, updated_at):
+        self.occupancy = occupancy
+        self.weight = weight
+        self.updated_at = updated_at
+
+    def add(self, occupancy, observed_at, half_life):
+        if observed_at >= self.updated_at:
+            self.weight *= 0.5 ** ((observed_at - self.updated_at) / half_life)
+            report_weight = 1.0
+            self.updated_at = observed_at
+        else:
+            # Arrived out of order, it counts for what it would be worth by now
+            report_weight = 0.5 ** ((self.updated_at - observed_at) / half_life)
+        total = self.weight + report_weight
+        self.occupancy = (self.occupancy * self.weight + occupancy * report_weight) / total
+        self.weight = total
+
+
+class OccupancySnapshot:
+    """
+    Published estimates at one version, never modified once published
+    estimates maps spot_id to (occupancy, weight, updated_at unix seconds)
+    """
+
+    def __init__(self, version, estimates):
+        self.version = version
+        self.estimates = estimates
+
+    def get(self, spot_id):
+        """
+        Occupancy of a spot from 0 (empty) to 1 (full), or None without recent reports
+        """
+        estimate = self.estimates.get(spot_id)
+        return estimate[0] if estimate is not None else None
+
+    def to_dict(self, spot_ids=None):
+        spot_ids = self.estimates.keys() if spot_ids is None else spot_ids
+        return {
+            str(spot_id): {
+                'occupancy': round(self.estimates[spot_id][0], 3),
+                'reports': round(self.estimates[spot_id][1], 1),
+                'updated_at': round(self.estimates[spot_id][2], 1)
+            } if spot_id in self.estimates else None
+            for spot_id in spot_ids
+        }
+
+
+def parse_report(report, now, max_age):
+    """
+    (spot_id, occupancy, observed_at) from one report, raising ValueError if it's invalid
+    Reports give occupancy (0 to 1) or occupied and capacity, and optionally
+    observed_at in unix seconds
+    """
+    if not isinstance(report, dict):
+        raise ValueError('report must be an object')
+    try:
+        spot_id = int(report['spot_id'])
+        if 'occupancy' in report:
+            occupancy = float(report['occupancy'])
+        else:
+            capacity = float(report['capacity'])
+            if capacity <= 0:
+                raise ValueError('capacity must be positive')
+            occupancy = float(report['occupied']) / capacity
+        observed_at = float(report.get('observed_at', now))
+    except (KeyError, TypeError) as e:
+        raise ValueError('spot_id and occupancy (or occupied and capacity) are required') from e
+    if not 0 <= occupancy <= 1:
+        raise ValueError('occupancy must be between 0 and 1')
+    if observed_at > now + 60 or observed_at < now - max_age:
+        raise ValueError('observed_at is too far from the current time')
+    return spot_id, occupancy, min(observed_at, now)
+
+
+class OccupancyTracker:
+    """
+    In-memory occupancy estimates for one worker process
+    """
+
+    def __init__(self):
+        self.app = None
+        self.half_life = 300.0
+        self.max_age = 1800.0
+        self.publish_interval = 2.0
+        self.flush_interval = 10.0
+        self.max_batch = 5000
+        self.max_subscribers = 2
+        self.estimates = {}  # spot_id -> OccupancyEstimate
+        self.changed = set()  # not yet published
+        self.dirty = set()  # not yet flushed
+        self.published = OccupancySnapshot(0, {})
+        self.pulled_until = None  # newest written_at read from spot_occupancy
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self.reports = metrics.counter(
+            'parkandgo_occupancy_reports_total',
+            'Occupancy reports received, by result',
+            labels=('result',)
+        )
+        self.streams_rejected = metrics.counter(
+            'parkandgo_occupancy_streams_rejected_total',
+            'Event streams turned away because the worker had max_subscribers open'
+        )
+        metrics.gauge(
+            'parkandgo_occupancy_subscribers',
+            'Open occupancy event streams',
+            lambda: {(): len(self._subscribers)}
+        )
+
+    def init_app(self, app):
+        self.app = app
+        self.half_life = app.config['OCCUPANCY_HALF_LIFE']
+        self.max_age = app.config['OCCUPANCY_MAX_AGE']
+        self.publish_interval = app.config['OCCUPANCY_PUBLISH_INTERVAL']
+        self.flush_interval = app.config['OCCUPANCY_FLUSH_INTERVAL']
+        self.max_batch = app.config['OCCUPANCY_MAX_BATCH']
+        self.max_subscribers = app.config['OCCUPANCY_MAX_SUBSCRIBERS']
+
+    def snapshot(self):
+        """
+        The published estimates, what scoring and new subscribers see
+        """
+        return self.published
+
+    # ============= INGESTION =============
+    def ingest(self, reports, known_spot_ids):
+        """
+        Fold a batch of reports into the estimates
+        Returns (accepted count, [(index, message)] for rejected reports)
+        """
+        now = time.time()
+        parsed = []
+        errors = []
+        for index, report in enumerate(reports):
+            try:
+                spot_id, occupancy, observed_at = parse_report(report, now, self.max_age)
+            except ValueError as e:
+                errors.append((index, str(e)))
+                continue
+            if spot_id not in known_spot_ids:
+                errors.append((index, f'unknown spot_id {spot_id}'))
+                continue
+            parsed.append((spot_id, occupancy, observed_at))
+
+        with self._lock:
+            for spot_id, occupancy, observed_at in parsed:
+                estimate = self.estimates.get(spot_id)
+                if estimate is None:
+                    self.estimates[spot_id] = OccupancyEstimate(occupancy, 1.0, observed_at)
+                else:
+                    estimate.add(occupancy, observed_at, self.half_life)
+                self.changed.add(spot_id)
+                self.dirty.add(spot_id)
+
+        self.reports.inc('accepted', amount=len(parsed))
+        if errors:
+            self.reports.inc('rejected', amount=len(errors))
+        self.start()
+        return len(parsed), errors
+
+    # ============= PUBLISHING =============
+    def subscribe(self):
+        """
+        Queue that receives every published change, call unsubscribe() when done
+        None when max_subscribers streams are already open: each one holds a
+        server thread while it lasts, so past the cap clients should poll instead
+        """
+        self.start()
+        subscriber = queue.Queue(maxsize=50)
+        with self._lock:
+            if len(self._subscribers) >= self.max_subscribers:
+                subscriber = None
+            else:
+                self._subscribers.add(subscriber)
+        if subscriber is None:
+            self.streams_rejected.inc()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def publish(self):
+        """
+        Publish estimates that changed or went stale since the last call
+        """
+        cutoff = time.time() - self.max_age
+        with self._lock:
+            stale = {spot_id for spot_id, estimate in self.estimates.items() if estimate.updated_at < cutoff}
+            if not self.changed and not stale:
+                return None
+            estimates = dict(self.published.estimates)
+            for spot_id in stale:
+                estimates.pop(spot_id, None)
+                del self.estimates[spot_id]
+            changed = self.changed - stale
+            for spot_id in changed:
+                estimate = self.estimates[spot_id]
+                estimates[spot_id] = (estimate.occupancy, estimate.weight, estimate.updated_at)
+            self.changed = set()
+            self.published = OccupancySnapshot(self.published.version + 1, estimates)
+            subscribers = list(self._subscribers)
+
+        event = format_event(self.published, sorted(changed | stale))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # Too slow to keep up; closing makes its EventSource reconnect and resync
+                subscriber.closed = True
+                self.unsubscribe(subscriber)
+        return self.published
+
+    def stream(self, subscriber, max_seconds, keepalive=15.0):
+        """
+        Server-Sent Events for a subscriber from subscribe(): every current
+        estimate, then changes as they are published
+        """
+        try:
+            yield 'retry: 3000\n\n'
+            snapshot = self.published
+            yield format_event(snapshot, sorted(snapshot.estimates), event='snapshot')
+            deadline = time.monotonic() + max_seconds
+            while time.monotonic() < deadline and not getattr(subscriber, 'closed', False):
+                try:
+                    yield subscriber.get(timeout=min(keepalive, max(deadline - time.monotonic(), 0.01)))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            self.unsubscribe(subscriber)
+
+    # ============= DATABASE =============
+    def flush(self):
+        """
+        Write changed estimates in one batch, then merge estimates other workers flushed
+        (every row written since the last pull, by write time rather than report time)
+        Call inside an app context
+        """
+        with self._lock:
+            rows = [
+                {
+                    'spot_id': spot_id,
+                    'occupancy': self.estimates[spot_id].occupancy,
+                    'weight': self.estimates[spot_id].weight,
+                    'updated_at': datetime.utcfromtimestamp(self.estimates[spot_id].updated_at)
+                }
+                for spot_id in self.dirty if spot_id in self.estimates
+            ]
+            self.dirty = set()
+
+        try:
+            if rows:
+                connection = db.session.connection()
+                if connection.dialect.name == 'postgresql':
+                    from sqlalchemy.dialects.postgresql import insert
+                else:
+                    from sqlalchemy.dialects.sqlite import insert
+                table = SpotOccupancy.__table__
+                statement = insert(table).values(dict(
+                    {name: bindparam(name) for name in ('spot_id', 'occupancy', 'weight', 'updated_at')},
+                    written_at=func.now()
+                ))
+                statement = statement.on_conflict_do_update(
+                    index_elements=['spot_id'],
+                    set_=dict(
+                        {name: statement.excluded[name] for name in ('occupancy', 'weight', 'updated_at')},
+                        written_at=func.now()
+                    ),
+                    # Another worker may have flushed a newer estimate
+                    where=table.c.updated_at < statement.excluded.updated_at
+                )
+                connection.execute(statement, rows)
+
+            # Plain rows rather than models, which the commit would expire and reload one by one
+            query = db.session.query(
+                SpotOccupancy.spot_id,
+                SpotOccupancy.occupancy,
+                SpotOccupancy.weight,
+                SpotOccupancy.updated_at,
+                SpotOccupancy.written_at
+            )
+            if self.pulled_until is not None:
+                query = query.filter(SpotOccupancy.written_at > self.pulled_until - PULL_OVERLAP)
+            else:
+                query = query.filter(SpotOccupancy.updated_at > datetime.utcfromtimestamp(time.time() - self.max_age))
+            remote = query.all()
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            with self._lock:
+                self.dirty |= {row['spot_id'] for row in rows}
+            raise
+
+        with self._lock:
+            for row in remote:
+                updated_at = (row.updated_at - EPOCH).total_seconds()
+                estimate = self.estimates.get(row.spot_id)
+                if estimate is None or estimate.updated_at < updated_at:
+                    self.estimates[row.spot_id] = OccupancyEstimate(row.occupancy, row.weight, updated_at)
+                    self.changed.add(row.spot_id)
+                if self.pulled_until is None or row.written_at > self.pulled_until:
+                    self.pulled_until = row.written_at
+        return len(rows)
+
+    # ============= WORKER =============
+    def start(self):
+        """
+        Start the publish/flush thread for this process if it isn't running
+        Started per process so gunicorn workers forked after import get their own
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='occupancy', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        next_flush = 0.0
+        while True:
+            try:
+                if time.monotonic() >= next_flush:
+                    with self.app.app_context():
+                        self.flush()
+                    next_flush = time.monotonic() + self.flush_interval
+                self.publish()
+            except Exception as e:
+                print(f"Occupancy update failed: {e}")
+            time.sleep(self.publish_interval)
+
+
+def format_event(snapshot, spot_ids, event='occupancy'):
+    """
+    One SSE message with the estimates of the given spots (null for ones that went stale)
+    """
+    data = json.dumps({'version': snapshot.version, 'spots': snapshot.to_dict(spot_ids)}, separators=(',', ':'))
+    return f'event: {event}\nid: {snapshot.version}\ndata: {data}\n\n'
+
+
+occupancy_tracker = OccupancyTracker()
@@ -0,0 +1,256 @@
+"""
+Calls to external services (Nominatim, OSRM, Google) with hard limits
+
+Every call runs on a small shared thread pool while the calling thread waits
+at most until its deadline, so a response that trickles in slowly can't hold
+a gunicorn worker past it (requests' own timeout only bounds each socket
+read). Each host gets a fixed number of concurrent calls, and a circuit
+breaker per service fails calls immediately while the service keeps failing.
+
+Errors are requests.RequestException subclasses, so callers handle them the
+same way as a connection error.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import metrics
+
+
+class OutboundError(requests.RequestException):
+    """
+    The call was not made or abandoned, see the subclasses
+    """
+
+
+class CircuitOpenError(OutboundError):
+    """
+    The service failed too often recently; try again after the reset timeout
+    """
+
+
+class HostBusyError(OutboundError):
+    """
+    Every slot for the host stayed taken until the call's deadline
+    """
+
+
+class DeadlineExceeded(OutboundError):
+    """
+    No complete response before the call's deadline
+    """
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for
+    reset_timeout seconds. After that one call is let through as a probe
+    (again every reset_timeout seconds until one succeeds); a success closes it.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None  # time.monotonic() of the last open or probe
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """
+        Whether a call may go ahead now
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at >= self.reset_timeout:
+                # Let this call probe, the next one waits for another reset_timeout
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    print(f"Circuit for {self.name} opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+
+class OutboundClient:
+    """
+    HTTP client for one external service
+
+    timeout is passed to requests for each socket operation; deadline bounds
+    the whole call, including waiting for a host slot and reading the body.
+    Responses with a 429 or 5xx status count as failures for the breaker but
+    are still returned, so callers keep deciding what a status means.
+    """
+
+    def __init__(self, pool, service, timeout=5, deadline=None, pool_size=10, headers=None):
+        self.pool = pool
+        self.service = service
+        self.timeout = timeout
+        self.deadline = deadline if deadline is not None else max_timeout(timeout)
+        self.breaker = CircuitBreaker(service, pool.failure_threshold, pool.reset_timeout)
+        self.in_flight = 0
+        self._host_slots = {}
+        self._lock = threading.Lock()
+
+        # Keep-alive connections, shared by the pool threads
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def request(self, method, url, deadline=None, **kwargs):
+        """
+        Send a request and return the response, or raise a requests.RequestException
+        deadline overrides the client's for this call (seconds)
+        """
+        deadline = self.deadline if deadline is None else deadline
+        expires = time.monotonic() + deadline
+        if not self.breaker.allow():
+            self.pool.rejected.inc(self.service, 'circuit_open')
+            raise CircuitOpenError(f'{self.service} is failing, not calling it for now')
+
+        slots = self._slots(urlsplit(url).netloc)
+        if not slots.acquire(timeout=deadline):
+            self.pool.rejected.inc(self.service, 'host_busy')
+            raise HostBusyError(f'Too many calls to {self.service} in progress')
+
+        # Nothing the pool thread does should outlive the deadline by much
+        kwargs['timeout'] = clamp_timeout(kwargs.get('timeout', self.timeout), deadline)
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self.pool.submit(self.session.request, method, url, **kwargs)
+        except Exception:
+            self._release(slots)
+            raise
+        # The slot is held until the call really ends, even if we stop waiting for it
+        future.add_done_callback(lambda _: self._release(slots))
+
+        with metrics.outbound(self.service):
+            try:
+                response = future.result(timeout=max(expires - time.monotonic(), 0))
+            except FutureTimeout:
+                future.cancel()
+                self.breaker.record_failure()
+                self.pool.rejected.inc(self.service, 'deadline')
+                raise DeadlineExceeded(f'{self.service} did not answer within {deadline}s') from None
+            except requests.RequestException:
+                self.breaker.record_failure()
+                raise
+
+        if response.status_code == 429 or response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    def _slots(self, host):
+        with self._lock:
+            slots = self._host_slots.get(host)
+            if slots is None:
+                slots = self._host_slots[host] = threading.BoundedSemaphore(self.pool.host_limit)
+            return slots
+
+    def _release(self, slots):
+        slots.release()
+        with self._lock:
+            self.in_flight -= 1
+
+
+class OutboundPool:
+    """
+    The thread pool shared by every OutboundClient in a worker process
+    """
+
+    def __init__(self):
+        self.max_workers = 16
+        self.host_limit = 8
+        self.failure_threshold = 5
+        self.reset_timeout = 30.0
+        self.clients = {}  # service -> the most recently created OutboundClient
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+        self.rejected = metrics.counter(
+            'parkandgo_outbound_rejected_total',
+            'Outbound calls failed without a response, by service and reason',
+            labels=('service', 'reason')
+        )
+        metrics.gauge(
+            'parkandgo_outbound_circuit_open',
+            'Whether calls to a service are being rejected (1) or allowed (0)',
+            lambda: {(service,): int(client.breaker.is_open) for service, client in self.clients.items()},
+            labels=('service',)
+        )
+        metrics.gauge(
+            'parkandgo_outbound_in_flight',
+            'Outbound calls running, including ones whose callers stopped waiting',
+            lambda: {(service,): client.in_flight for service, client in self.clients.items()},
+            labels=('service',)
+        )
+
+    def init_app(self, app):
+        self.max_workers = app.config['OUTBOUND_MAX_WORKERS']
+        self.host_limit = app.config['OUTBOUND_HOST_CONCURRENCY']
+        self.failure_threshold = app.config['OUTBOUND_FAILURE_THRESHOLD']
+        self.reset_timeout = app.config['OUTBOUND_RESET_TIMEOUT']
+
+    def client(self, service, timeout=5, deadline=None, pool_size=10, headers=None):
+        """
+        New client for a service, using the pool's limits
+        """
+        client = OutboundClient(self, service, timeout, deadline, pool_size, headers)
+        self.clients[service] = client
+        return client
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            # Threads don't survive a fork, so each gunicorn worker starts its own pool
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='outbound')
+                self._pid = os.getpid()
+            return self._executor.submit(fn, *args, **kwargs)
+
+
+def max_timeout(timeout):
+    """
+    Longest single wait in a requests timeout, a number or (connect, read)
+    """
+    return max(timeout) if isinstance(timeout, tuple) else timeout
+
+
+def clamp_timeout(timeout, limit):
+    if isinstance(timeout, tuple):
+        return tuple(min(value, limit) for value in timeout)
+    return min(timeout, limit)
+
+
+outbound = OutboundPool()
@@ -0,0 +1,129 @@
+"""
+Connection pool benchmark
+Runs the same short query from many threads at once through each pooling
+mode and reports throughput, latency percentiles, checkout timeouts and
+connection errors, so pool settings can be compared under a connection storm.
+
+Usage: python pool_benchmark.py [--threads 200] [--seconds 10] [--output pool.json]
+Point DATABASE_URL at a local Postgres. The pgbouncer mode connects to
+--pgbouncer-url if given (PgBouncer in transaction mode), else DATABASE_URL.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import create_engine, text
+from config import Config, engine_options
+
+
+QUERY = text('SELECT spot_id, spot_name, cost FROM parking_spots WHERE campus_location = :campus LIMIT 20')
+
+
+def benchmark_modes(database_uri, pgbouncer_uri):
+    """
+    (mode name, database uri, create_engine options) for every mode compared
+    """
+    tuned = dict(
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        pool_timeout=Config.DB_POOL_TIMEOUT,
+        pool_recycle=Config.DB_POOL_RECYCLE,
+        pre_ping=Config.DB_POOL_PRE_PING,
+        connect_timeout=Config.DB_CONNECT_TIMEOUT
+    )
+    return [
+        # What the app ran with before pool settings were configurable
+        ('sqlalchemy_default', database_uri, {}),
+        ('tuned', database_uri, engine_options(database_uri, pgbouncer=False, **tuned)),
+        ('pgbouncer', pgbouncer_uri, engine_options(pgbouncer_uri, pgbouncer=True, **tuned)),
+    ]
+
+
+def run_mode(uri, options, threads, seconds):
+    """
+    Hammer one engine from `threads` threads for `seconds`
+    Returns throughput, latency percentiles in ms and error counts
+    """
+    engine = create_engine(uri, **options)
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    start_barrier = threading.Barrier(threads + 1)
+    deadline = [0.0]
+
+    def worker(index):
+        campus = 'East Bank' if index % 2 else 'West Bank'
+        local_latencies = []
+        local_errors = {}
+        start_barrier.wait()
+        while time.perf_counter() < deadline[0]:
+            started = time.perf_counter()
+            try:
+                with engine.connect() as connection:
+                    connection.execute(QUERY, {'campus': campus}).fetchall()
+                local_latencies.append(time.perf_counter() - started)
+            except Exception as e:
+                name = type(e).__name__
+                local_errors[name] = local_errors.get(name, 0) + 1
+        with lock:
+            latencies.extend(local_latencies)
+            for name, count in local_errors.items():
+                errors[name] = errors.get(name, 0) + count
+
+    pool = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    deadline[0] = time.perf_counter() + seconds
+    start_barrier.wait()
+    for thread in pool:
+        thread.join()
+    engine.dispose()
+
+    latencies.sort()
+
+    def percentile(fraction):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * fraction))] * 1000, 2)
+
+    return {
+        'queries': len(latencies),
+        'qps': round(len(latencies) / seconds, 1),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2) if latencies else None,
+        'p50_ms': percentile(0.5),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'errors': errors,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare connection pool modes under heavy concurrency')
+    parser.add_argument('--threads', type=int, default=200, help='concurrent clients')
+    parser.add_argument('--seconds', type=float, default=10, help='duration of each mode')
+    parser.add_argument('--pgbouncer-url', help='PgBouncer connection URL for the pgbouncer mode')
+    parser.add_argument('--mode', action='append', help='only run these modes (repeatable)')
+    parser.add_argument('--output', help='write results as JSON to this path')
+    args = parser.parse_args()
+
+    database_uri = Config.SQLALCHEMY_DATABASE_URI
+    results = {}
+    for name, uri, options in benchmark_modes(database_uri, args.pgbouncer_url or database_uri):
+        if args.mode and name not in args.mode:
+            continue
+        print(f"Running {name} with {args.threads} threads for {args.seconds}s...")
+        results[name] = run_mode(uri, options, args.threads, args.seconds)
+        result = results[name]
+        print(f"  {result['qps']} queries/s, p50 {result['p50_ms']}ms, p99 {result['p99_ms']}ms, errors {result['errors']}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'finished_at': datetime.utcnow().isoformat() + 'Z',
+                'threads': args.threads,
+                'seconds': args.seconds,
+                'modes': results
+            }, f, indent=2)
+        print(f"Wrote results to {args.output}")
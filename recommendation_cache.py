@@ -0,0 +1,117 @@
+"""
+Bounded LRU cache of recommendation shortlists
+
+Recommendations depend on the user only through their profile segment
+(profile completeness, preferred parking types and major), so users in the
+same segment, leaving the same ~50m cell for the same selected spot, share
+one cached shortlist. Shortlists are scored without occupancy and ranked
+with the current estimates on every request (see scoring.Shortlist), so
+new occupancy reports don't empty the cache.
+"""
+import threading
+from collections import OrderedDict
+from buildings import normalize_building
+from routing import snap_origin
+
+
+def profile_segment(user):
+    """
+    The parts of a user's profile that scoring reads
+    A profile update moves the user to a new segment, so their next request
+    is a cache miss without flushing anyone else's results
+    """
+    complete = user.is_profile_complete()
+    return (
+        complete,
+        # calculate_spot_score only looks at preferences once the profile is complete
+        user.preferred_parking_types if complete else None,
+        normalize_building(user.major or '')
+    )
+
+
+class RecommendationCache:
+    """
+    Shortlists by (data version, profile segment, selected spot, location cell, nearby_only)
+
+    Entries are scoring.Shortlist objects; callers must not modify them.
+    Everything is dropped when the data version (the spot snapshot's) changes.
+    """
+
+    def __init__(self, maxsize=4096, grid_meters=50.0):
+        self.maxsize = maxsize
+        self.grid_meters = grid_meters
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.maxsize = app.config.get('RECOMMENDATION_CACHE_SIZE', self.maxsize)
+        self.grid_meters = app.config.get('RECOMMENDATION_GRID_METERS', self.grid_meters)
+
+    def quantize(self, user_lat, user_lon):
+        """
+        Center of the grid cell the user is in, or (None, None) without a location
+        Recommendations are scored from this point so every user in the cell gets the same answer
+        """
+        if user_lat is None or user_lon is None:
+            return None, None
+        return snap_origin(user_lat, user_lon, self.grid_meters)
+
+    def key(self, user, user_lat, user_lon, selected_spot_id, nearby_only):
+        """
+        Cache key of a request; it holds the quantized location at [2] and [3]
+        """
+        user_lat, user_lon = self.quantize(user_lat, user_lon)
+        return (profile_segment(user), selected_spot_id, user_lat, user_lon, nearby_only)
+
+    def lookup(self, version, key):
+        """
+        Cached result for a key built from the quantized location, or None (a miss)
+        """
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+            self.misses += 1
+            return None
+
+    def store(self, version, key, result):
+        with self._lock:
+            # Skip storing if the data changed while we were scoring
+            if version == self.version:
+                self._entries[key] = result
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Hit/miss counters for monitoring
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'version': self.version,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+recommendation_cache = RecommendationCache()
@@ -0,0 +1,210 @@
+"""
+Driving and walking routes to parking spots, computed by OSRM and cached
+
+Origins are snapped to a coarse grid so students leaving the same building
+for the same spot share one cached route. Point OSRM_URL at a local OSRM
+(or any stand-in that answers /route/v1/{profile}/{lon,lat;lon,lat}) to run
+without the public demo server.
+"""
+import threading
+import time
+from collections import OrderedDict
+from math import cos, radians
+import requests
+from outbound import outbound
+
+
+# Travel modes the frontend offers, and the OSRM profile that serves each
+ROUTE_PROFILES = {
+    'driving': 'car',
+    'walking': 'foot'
+}
+
+METERS_PER_DEGREE = 111320.0
+
+
+class RoutingError(Exception):
+    """
+    OSRM could not be reached or answered with an error worth retrying later
+    """
+
+
+def snap_origin(lat, lon, grid_meters):
+    """
+    Center of the grid cell containing (lat, lon), cells are about grid_meters on a side
+    """
+    lat_step = grid_meters / METERS_PER_DEGREE
+    snapped_lat = (lat // lat_step + 0.5) * lat_step
+    # Longitude cells narrow toward the poles, size them at the snapped row's latitude
+    lon_step = grid_meters / (METERS_PER_DEGREE * max(cos(radians(snapped_lat)), 0.01))
+    snapped_lon = (lon // lon_step + 0.5) * lon_step
+    return round(snapped_lat, 6), round(snapped_lon, 6)
+
+
+class OSRMClient:
+    """
+    Calls the OSRM route service through the shared outbound pool
+    """
+
+    def __init__(self, base_url, timeout=5, deadline=None, pool_size=10):
+        self.base_url = base_url.rstrip('/')
+        self.http = outbound.client('osrm', timeout=timeout, deadline=deadline, pool_size=pool_size)
+
+    def route(self, profile, origin, destination):
+        """
+        Fastest route between two (lat, lon) points
+        Returns {'distance': meters, 'duration': seconds, 'geometry': GeoJSON LineString},
+        or None if OSRM found no route. Raises RoutingError if the call should be retried
+        """
+        coordinates = f'{origin[1]},{origin[0]};{destination[1]},{destination[0]}'
+        url = f'{self.base_url}/route/v1/{profile}/{coordinates}'
+        params = {
+            'overview': 'full',
+            'geometries': 'geojson'
+        }
+        try:
+            response = self.http.get(url, params=params)
+        except requests.RequestException as e:
+            raise RoutingError(str(e)) from e
+
+        if response.status_code == 429 or response.status_code >= 500:
+            raise RoutingError(f'OSRM returned {response.status_code}')
+
+        try:
+            data = response.json()
+        except ValueError as e:
+            raise RoutingError('OSRM returned invalid JSON') from e
+
+        # OSRM answers 400 with a code such as NoRoute or InvalidQuery for bad points
+        if data.get('code') != 'Ok' or not data.get('routes'):
+            return None
+        route = data['routes'][0]
+        return {
+            'distance': route['distance'],
+            'duration': route['duration'],
+            'geometry': route['geometry']
+        }
+
+
+class RouteCache:
+    """
+    Bounded, TTL-evicting route cache keyed by (snapped origin, spot_id, mode)
+
+    Entries remember the destination they were computed for, so a spot whose
+    coordinates change is routed again. Concurrent misses for the same key
+    wait for the first caller's OSRM request instead of sending their own.
+    """
+
+    def __init__(self, maxsize=2048, ttl=900.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (expires_at, destination, route)
+        self._pending = {}  # key -> threading.Event for routes being computed
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, destination, compute):
+        """
+        Cached route for key, or compute() it once and cache the result
+        Returns (route, was_cached); routes that don't exist (None) are cached too
+        """
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now and entry[1] == destination:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[2], True
+                if entry is not None:
+                    del self._entries[key]
+                    self.evictions += 1
+                waiting = self._pending.get(key)
+                if waiting is None:
+                    done = self._pending[key] = threading.Event()
+                    self.misses += 1
+                    break
+            # Another request is already asking OSRM for this route
+            waiting.wait()
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None or entry[1] != destination:
+                    # It failed, or was for older coordinates: try again ourselves
+                    continue
+                self.hits += 1
+                return entry[2], True
+
+        try:
+            route = compute()
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, destination, route)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self.evictions += 1
+            return route, False
+        finally:
+            with self._lock:
+                del self._pending[key]
+            done.set()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Hit/miss counters for monitoring
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+class RouteService:
+    """
+    Routes from a user's position to a parking spot, through the route cache
+    """
+
+    def __init__(self):
+        self.client = None
+        self.cache = RouteCache()
+        self.grid_meters = 100.0
+
+    def init_app(self, app, client=None):
+        self.client = client or OSRMClient(
+            app.config['OSRM_URL'],
+            timeout=app.config['OSRM_TIMEOUT'],
+            deadline=app.config['OSRM_DEADLINE'],
+            pool_size=app.config['OSRM_POOL_SIZE']
+        )
+        self.cache.maxsize = app.config['ROUTE_CACHE_SIZE']
+        self.cache.ttl = app.config['ROUTE_CACHE_TTL']
+        self.grid_meters = app.config['ROUTE_GRID_METERS']
+
+    def route(self, lat, lon, spot, mode):
+        """
+        Route from (lat, lon) to a spot record for a travel mode in ROUTE_PROFILES
+        Returns (route or None, snapped origin, was_cached); raises RoutingError
+        """
+        origin = snap_origin(lat, lon, self.grid_meters)
+        destination = (spot.latitude, spot.longitude)
+        profile = ROUTE_PROFILES[mode]
+        route, was_cached = self.cache.get_or_compute(
+            (origin, spot.spot_id, mode),
+            destination,
+            lambda: self.client.route(profile, origin, destination)
+        )
+        return route, origin, was_cached
+
+
+route_service = RouteService()
@@ -0,0 +1,435 @@
+"""
+Vectorized parking spot scoring for recommendations
+Mirrors calculate_spot_score in app.py but scores every spot in one NumPy pass
+"""
+import numpy as np
+from buildings import build_walking_matrix
+
+
+EARTHS_RADIUS = 3959  # earths radius in miles
+
+# Scoring weights, kept in step with calculate_spot_score
+MAX_COST = 5
+COST_WEIGHT = 30
+MAX_DISTANCE = 2
+DISTANCE_WEIGHT = 40
+PREFERENCE_BONUS = 20
+VERIFIED_BONUS = 10
+MAX_WALK_MINUTES = 15
+MAJOR_BUILDING_WEIGHT = 20
+OCCUPANCY_WEIGHT = 20
+SELECTED_SPOT_PENALTY = 40
+
+# Most spots a Shortlist keeps
+SHORTLIST_SIZE = 64
+
+# Most a score_matrix score can differ from score() for the same spot: the
+# unit vector distances lose precision for spots a few feet from the origin
+SCORE_TOLERANCE = 0.01
+
+
+class Shortlist:
+    """
+    The spots that can still make a top k once occupancy is applied, with
+    their scores without it
+
+    Occupancy only ever takes up to OCCUPANCY_WEIGHT off a score, so a spot
+    more than that below the k-th best can't overtake it. A shortlist can
+    therefore be cached while occupancy changes every few seconds, and
+    SpotScoringEngine.rank applies the current estimates to it. At most
+    SHORTLIST_SIZE spots are kept; floor is the best score left out (-inf if
+    none), and rank gives None when the ranking would reach down to it.
+    """
+    __slots__ = ('positions', 'scores', 'floor')
+
+    def __init__(self, positions, scores, floor=-np.inf):
+        self.positions = positions  # sorted engine positions
+        self.scores = scores
+        self.floor = floor
+
+
+class SpotScoringEngine:
+    """
+    Holds the scoring inputs of a set of spots as contiguous arrays
+    Build one per spot snapshot and reuse it for every request
+    """
+
+    def __init__(self, records, walking_matrix=None):
+        self.records = tuple(records)
+        count = len(self.records)
+        self.walking_matrix = walking_matrix
+
+        self.spot_ids = np.fromiter((r.spot_id for r in self.records), dtype=np.int64, count=count)
+        self.positions = {record.spot_id: i for i, record in enumerate(self.records)}
+        self.cost = np.fromiter(
+            (np.nan if r.cost is None else r.cost for r in self.records), dtype=np.float64, count=count
+        )
+        self.has_cost = ~np.isnan(self.cost)
+        self.latitude = np.fromiter(
+            (r.latitude or 0.0 for r in self.records), dtype=np.float64, count=count
+        )
+        self.longitude = np.fromiter(
+            (r.longitude or 0.0 for r in self.records), dtype=np.float64, count=count
+        )
+        # calculate_spot_score skips distance when either coordinate is falsy
+        self.has_coordinates = (self.latitude != 0) & (self.longitude != 0)
+        self.lat_radians = np.radians(self.latitude)
+        self.lon_radians = np.radians(self.longitude)
+        self.cos_lat = np.cos(self.lat_radians)
+        # Points on the unit sphere, for scoring many origins at once (distance_matrix)
+        self.unit_vectors = np.array((
+            self.cos_lat * np.cos(self.lon_radians),
+            self.cos_lat * np.sin(self.lon_radians),
+            np.sin(self.lat_radians)
+        ))  # 3 x spots
+        self.is_verified = np.fromiter((bool(r.is_verified) for r in self.records), dtype=bool, count=count)
+
+        # Parking types as small integer codes, -1 for spots with no type
+        self.parking_types = []
+        type_codes = {}
+        codes = []
+        for record in self.records:
+            if record.parking_type:
+                if record.parking_type not in type_codes:
+                    type_codes[record.parking_type] = len(self.parking_types)
+                    self.parking_types.append(record.parking_type)
+                codes.append(type_codes[record.parking_type])
+            else:
+                codes.append(-1)
+        self.type_codes = np.array(codes, dtype=np.int64)
+
+        # Row of each spot in the walking matrix, -1 for spots it doesn't cover
+        walking_rows = walking_matrix.spot_rows if walking_matrix is not None else {}
+        self.walking_rows = np.fromiter(
+            (walking_rows.get(r.spot_id, -1) for r in self.records), dtype=np.int64, count=count
+        )
+
+        # Occupancy by engine position for one published occupancy version
+        self._occupancy = (None, None)
+
+        # Score terms that don't depend on the request
+        self.cost_score = np.where(self.has_cost, (MAX_COST - self.cost) / MAX_COST * COST_WEIGHT, 0.0)
+
+    def __len__(self):
+        return len(self.records)
+
+    def candidate_positions(self, records):
+        """
+        Engine positions of the given records, in engine order
+        """
+        return np.sort(np.fromiter(
+            (self.positions[record.spot_id] for record in records if record.spot_id in self.positions),
+            dtype=np.int64
+        ))
+
+    def distances(self, user_lat, user_lon, candidates=slice(None)):
+        """
+        Haversine distance in miles from one point to every spot (or just the candidates)
+        """
+        lat1 = np.radians(user_lat)
+        lon1 = np.radians(user_lon)
+
+        dlat = self.lat_radians[candidates] - lat1
+        dlon = self.lon_radians[candidates] - lon1
+
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * self.cos_lat[candidates] * np.sin(dlon / 2) ** 2
+        c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+        return EARTHS_RADIUS * c
+
+    def preference_matches(self, user, candidates=slice(None)):
+        """
+        Boolean mask of spots whose parking type is in the user's preferences
+        """
+        type_codes = self.type_codes[candidates]
+        if not self.records or not user.is_profile_complete() or not user.preferred_parking_types:
+            return np.zeros(len(type_codes), dtype=bool)
+
+        preferred = user.preferred_parking_types
+        code_matches = np.array(
+            [parking_type in preferred for parking_type in self.parking_types] + [False],
+            dtype=bool
+        )
+        # -1 indexes the trailing False
+        return code_matches[type_codes]
+
+    def major_walk_minutes(self, user, candidates=slice(None)):
+        """
+        Minutes from each spot to the nearest building for the user's major,
+        NaN where unknown, or None if the major has no buildings
+        """
+        if self.walking_matrix is None or not user.major:
+            return None
+        minutes = self.walking_matrix.major_minutes(user.major)
+        if minutes is None:
+            return None
+        rows = self.walking_rows[candidates]
+        return np.where(rows >= 0, minutes[rows], np.nan)
+
+    def occupancy_vector(self, occupancy, candidates=slice(None)):
+        """
+        Occupancy of each spot from an OccupancySnapshot, NaN where unknown
+        """
+        version, vector = self._occupancy
+        if version != occupancy.version:
+            vector = np.fromiter(
+                (np.nan if value is None else value for value in map(occupancy.get, self.spot_ids.tolist())),
+                dtype=np.float64, count=len(self.records)
+            )
+            self._occupancy = (occupancy.version, vector)
+        return vector[candidates]
+
+    def score(self, user, user_lat, user_lon, selected_spot_id, candidates=slice(None), occupancy=None):
+        """
+        Score every spot (or just the candidate positions), term for term the
+        same as calculate_spot_score
+        """
+        # Terms are added in the same order as the scalar version so the
+        # floating point results match exactly
+        score = self.cost_score[candidates].copy()
+
+        if user_lat is not None and user_lon is not None:
+            distance_mi = np.minimum(self.distances(user_lat, user_lon, candidates), MAX_DISTANCE)
+            distance_score = (MAX_DISTANCE - distance_mi) / MAX_DISTANCE * DISTANCE_WEIGHT
+            score = np.where(self.has_coordinates[candidates], score + distance_score, score)
+
+        score = self.add_spot_terms(score, user, candidates, occupancy)
+
+        if selected_spot_id is not None:
+            score = np.where(self.spot_ids[candidates] == selected_spot_id, score - SELECTED_SPOT_PENALTY, score)
+        return score
+
+    def add_spot_terms(self, score, user, candidates=slice(None), occupancy=None):
+        """
+        Add the terms that don't depend on the user's location: preferences,
+        verification, walk to the major's buildings and occupancy
+        score is one row per spot or one row per origin (broadcast over rows)
+        """
+        score = np.where(self.preference_matches(user, candidates), score + PREFERENCE_BONUS, score)
+        score = np.where(self.is_verified[candidates], score + VERIFIED_BONUS, score)
+
+        minutes = self.major_walk_minutes(user, candidates)
+        if minutes is not None:
+            major_score = (MAX_WALK_MINUTES - np.minimum(minutes, MAX_WALK_MINUTES)) / MAX_WALK_MINUTES * MAJOR_BUILDING_WEIGHT
+            score = np.where(np.isnan(minutes), score, score + major_score)
+
+        if occupancy is not None and occupancy.estimates:
+            spot_occupancy = self.occupancy_vector(occupancy, candidates)
+            score = np.where(np.isnan(spot_occupancy), score, score - spot_occupancy * OCCUPANCY_WEIGHT)
+        return score
+
+    def score_matrix(self, user, queries, occupancy=None):
+        """
+        Scores of every spot for several queries at once, one row per query
+        queries are (user_lat, user_lon, selected_spot_id, nearby_only) tuples; the
+        location may be None. With nearby_only, spots beyond MAX_DISTANCE score -inf.
+
+        The terms that don't depend on location are summed once for the batch
+        and distances come from one matrix product, so rows match score() to
+        within SCORE_TOLERANCE rather than exactly
+        """
+        base = self.add_spot_terms(self.cost_score, user, occupancy=occupancy)
+
+        located = [row for row, query in enumerate(queries) if query[0] is not None and query[1] is not None]
+        if located:
+            distance = self.distance_matrix(
+                [queries[row][0] for row in located],
+                [queries[row][1] for row in located]
+            )
+            too_far = {
+                row: distance[i] > MAX_DISTANCE for i, row in enumerate(located) if queries[row][3]
+            }
+            # (MAX_DISTANCE - min(d, MAX_DISTANCE)) / MAX_DISTANCE * DISTANCE_WEIGHT, in place
+            distance_score = distance
+            distance_score *= -DISTANCE_WEIGHT / MAX_DISTANCE
+            distance_score += DISTANCE_WEIGHT
+            np.maximum(distance_score, 0.0, out=distance_score)
+            if not self.has_coordinates.all():
+                distance_score *= self.has_coordinates
+            if len(located) == len(queries):
+                score = distance_score
+                score += base
+            else:
+                score = np.repeat(base[None, :], len(queries), axis=0)
+                score[located] += distance_score
+            for row, mask in too_far.items():
+                score[row, mask] = -np.inf
+        else:
+            score = np.repeat(base[None, :], len(queries), axis=0)
+
+        for row, query in enumerate(queries):
+            position = self.positions.get(query[2])
+            if position is not None:
+                score[row, position] -= SELECTED_SPOT_PENALTY
+        return score
+
+    def distance_matrix(self, user_lats, user_lons):
+        """
+        Great-circle miles from each origin (rows) to every spot (columns)
+        Uses the dot product of unit vectors, so all origins are one matrix product
+        """
+        lat = np.radians(np.asarray(user_lats, dtype=np.float64))
+        lon = np.radians(np.asarray(user_lons, dtype=np.float64))
+        origins = np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+        # sin^2 of half the central angle is (1 - cos) / 2; done in place on the product
+        values = origins @ self.unit_vectors
+        np.subtract(1.0, values, out=values)
+        values *= 0.5
+        np.clip(values, 0.0, 1.0, out=values)
+        np.sqrt(values, out=values)
+        np.arcsin(values, out=values)
+        values *= 2 * EARTHS_RADIUS
+        return values
+
+    def top_k(self, user, user_lat, user_lon, selected_spot_id, k=3, candidates=None, occupancy=None):
+        """
+        Return the k best records, highest score first
+        Ties keep input order, same as a stable sort of the full list
+        candidates optionally restricts scoring to a sorted array of engine positions
+        occupancy is an OccupancySnapshot, None to leave occupancy out
+        """
+        if k <= 0 or not self.records:
+            return []
+        if candidates is None:
+            candidates = np.arange(len(self.records))
+        scores = self.score(user, user_lat, user_lon, selected_spot_id, candidates, occupancy)
+        return [self.records[candidates[i]] for i in top_k_indices(scores, k)]
+
+    def top_k_many(self, user, queries, k=3, occupancy=None, chunk_size=None):
+        """
+        The k best records for each query in queries (see score_matrix), highest first
+        Queries are scored chunk_size at a time to bound memory; by default
+        chunks hold about a million scores
+        """
+        if k <= 0 or not self.records:
+            return [[] for _ in queries]
+        return [
+            [self.records[i] for i in top_k_indices(row, k) if row[i] != -np.inf]
+            for row in self.score_rows(user, queries, occupancy, chunk_size)
+        ]
+
+    def shortlist(self, user, user_lat, user_lon, selected_spot_id, k=3, candidates=None):
+        """
+        Shortlist for a top k, scored without occupancy; see rank
+        candidates optionally restricts it to a sorted array of engine positions
+        """
+        if candidates is None:
+            candidates = np.arange(len(self.records))
+        scores = self.score(user, user_lat, user_lon, selected_spot_id, candidates)
+        return make_shortlist(scores, candidates, k)
+
+    def shortlists(self, user, queries, k=3, candidates=None, chunk_size=None):
+        """
+        shortlist() for each (user_lat, user_lon, selected_spot_id) in queries,
+        the same as calling it once per query
+        candidates optionally gives each query's sorted engine positions, as for
+        shortlist(); None (or a None entry) for every spot
+
+        One matrix pass (see score_matrix) narrows each query down to the spots
+        that could make its shortlist; only those are scored again with
+        score(), so near ties come out exactly as shortlist() has them
+        """
+        if not self.records:
+            return [make_shortlist(np.empty(0), None, k) for _ in queries]
+        if candidates is None:
+            candidates = [None] * len(queries)
+        rows = self.score_rows(user, [(lat, lon, selected, False) for lat, lon, selected in queries], None, chunk_size)
+        results = []
+        for (user_lat, user_lon, selected_spot_id), positions, row in zip(queries, candidates, rows):
+            if positions is not None:
+                row = row[positions]
+            picks = shortlist_candidates(row, k)
+            positions = picks if positions is None else positions[picks]
+            results.append(self.shortlist(user, user_lat, user_lon, selected_spot_id, k, positions))
+        return results
+
+    def rank(self, shortlist, k=3, occupancy=None):
+        """
+        The k best records of a shortlist with occupancy applied, highest first,
+        or None if the shortlist can't tell (score from scratch with top_k then)
+        """
+        scores = shortlist.scores
+        if occupancy is not None and occupancy.estimates and len(scores):
+            spot_occupancy = self.occupancy_vector(occupancy, shortlist.positions)
+            scores = np.where(np.isnan(spot_occupancy), scores, scores - spot_occupancy * OCCUPANCY_WEIGHT)
+        best = top_k_indices(scores, k) if k > 0 else []
+        if len(best) and scores[best[-1]] <= shortlist.floor:
+            return None
+        return [self.records[shortlist.positions[i]] for i in best]
+
+    def score_rows(self, user, queries, occupancy=None, chunk_size=None):
+        """
+        score_matrix rows for queries, chunk_size queries at a time
+        """
+        if not queries or not self.records:
+            return
+        chunk_size = chunk_size or max(1, 1_000_000 // len(self.records))
+        for start in range(0, len(queries), chunk_size):
+            yield from self.score_matrix(user, queries[start:start + chunk_size], occupancy)
+
+
+def top_k_indices(scores, k):
+    """
+    Indices of the k highest scores, highest first, ties broken by lower index
+    """
+    count = len(scores)
+    if k < count:
+        # argpartition finds the k-th best score in linear time; keep every
+        # spot that ties it so the stable tie-break below sees all of them
+        threshold = scores[np.argpartition(-scores, k - 1)[k - 1]]
+        candidates = np.flatnonzero(scores >= threshold)
+    else:
+        candidates = np.arange(count)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+
+def make_shortlist(scores, positions, k):
+    """
+    Shortlist of the spots scoring within OCCUPANCY_WEIGHT of the k-th best
+    positions are the engine positions of scores, None when scores cover every spot
+    -inf scores (spots ruled out by nearby_only) are never kept
+    """
+    keep = np.flatnonzero(scores != -np.inf)
+    if k <= 0 or not len(keep):
+        return Shortlist(np.empty(0, dtype=np.int64), np.empty(0))
+    kept_scores = scores[keep]
+    if k < len(keep):
+        kth = kept_scores[np.argpartition(-kept_scores, k - 1)[k - 1]]
+        keep = keep[kept_scores >= kth - OCCUPANCY_WEIGHT]
+
+    floor = -np.inf
+    limit = max(SHORTLIST_SIZE, k)
+    if len(keep) > limit:
+        order = keep[np.argsort(-scores[keep], kind='stable')]
+        floor = scores[order[limit]]
+        keep = np.sort(order[:limit])
+    return Shortlist(keep if positions is None else positions[keep], scores[keep], floor)
+
+
+def shortlist_candidates(scores, k):
+    """
+    Indices of the scores that can make a shortlist for a top k even if each
+    is off by SCORE_TOLERANCE: within OCCUPANCY_WEIGHT of the k-th best and
+    no lower than the best SHORTLIST_SIZE + 1 (which sets the floor)
+    """
+    count = len(scores)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k >= count:
+        return np.arange(count)
+    cut = -np.partition(-scores, k - 1)[k - 1] - OCCUPANCY_WEIGHT
+    limit = max(SHORTLIST_SIZE, k)
+    if limit < count:
+        cut = max(cut, -np.partition(-scores, limit)[limit])
+    # Both the scores and the cut can be off by SCORE_TOLERANCE
+    return np.flatnonzero(scores >= cut - 2 * SCORE_TOLERANCE)
+
+
+def build_scoring_engine(snapshot):
+    """
+    Build the engine for a spot snapshot, over spots that have coordinates
+    """
+    return SpotScoringEngine(
+        snapshot.located_records(),
+        snapshot.derived('walking_matrix', build_walking_matrix)
+    )
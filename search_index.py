@@ -0,0 +1,275 @@
+"""
+In-process inverted index for parking spot search
+Ranks spots by field weight and match quality, with prefix, infix and typo matching
+"""
+import bisect
+import re
+import numpy as np
+
+
+# How much a match in each column counts towards a spot's score
+FIELD_WEIGHTS = {
+    'spot_name': 5.0,
+    'near_buildings': 3.0,
+    'campus_location': 2.0,
+    'parking_type': 2.0,
+    'address': 1.0,
+}
+
+# How much each kind of token match counts, relative to an exact token match
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.8
+INFIX_MATCH = 0.5
+FUZZY_MATCH = 0.4
+
+# Extra credit when the spot name itself starts with the whole query
+NAME_PREFIX_BONUS = 2.0
+
+MAX_PREFIX_LENGTH = 20
+RESULT_CACHE_SIZE = 2048
+
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text):
+    """
+    Lowercase alphanumeric tokens of a string
+    """
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def trigrams(token):
+    """
+    Character trigrams of a token, padded so short tokens still get some
+    """
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """
+    Damerau-Levenshtein distance between a and b, or limit + 1 once it is exceeded
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if (i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]):
+                current[j] = min(current[j], previous_previous[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous_previous, previous = previous, current
+    return previous[-1]
+
+
+def max_typos(token):
+    """
+    How many typos to tolerate in a query token of this length
+    """
+    if len(token) < 4:
+        return 0
+    if len(token) < 8:
+        return 1
+    return 2
+
+
+class SpotSearchIndex:
+    """
+    Token, prefix and trigram indexes over the searchable spot columns
+
+    Spots are numbered by position and each token's postings are NumPy arrays,
+    so a query scores every candidate in a handful of vector operations.
+    with_record returns an updated copy and leaves the original untouched, so
+    requests still reading the old index are never affected.
+    """
+
+    def __init__(self, records=()):
+        self.records = []
+        self.spot_ids = np.zeros(0, dtype=np.int64)
+        self.postings = {}    # token -> (positions, weights)
+        self.prefixes = {}    # prefix -> frozenset of tokens starting with it
+        self.trigrams = {}    # trigram -> frozenset of tokens containing it
+        self.names = []       # sorted (lowercased spot name, position) for name-prefix lookups
+        self._results = {}
+
+        postings = {}
+        for record in records:
+            position = len(self.records)
+            self.records.append(record)
+            self.names.append((' '.join(tokenize(record.spot_name)), position))
+            for token, weight in record_tokens(record).items():
+                postings.setdefault(token, ([], []))
+                postings[token][0].append(position)
+                postings[token][1].append(weight)
+                if len(postings[token][0]) == 1:
+                    self._add_token(token, copy=False)
+
+        self.spot_ids = np.array([record.spot_id for record in self.records], dtype=np.int64)
+        self.postings = {
+            token: (np.array(positions, dtype=np.int64), np.array(weights, dtype=np.float64))
+            for token, (positions, weights) in postings.items()
+        }
+        self.prefixes = {prefix: frozenset(tokens) for prefix, tokens in self.prefixes.items()}
+        self.trigrams = {gram: frozenset(tokens) for gram, tokens in self.trigrams.items()}
+        self.names.sort()
+
+    def __len__(self):
+        return len(self.records)
+
+    def with_record(self, record):
+        """
+        Return a copy of the index that also contains record
+        """
+        if not record.has_coordinates():
+            return self
+        index = SpotSearchIndex()
+        position = len(self.records)
+        index.records = self.records + [record]
+        index.spot_ids = np.append(self.spot_ids, record.spot_id)
+        index.postings = dict(self.postings)
+        index.prefixes = dict(self.prefixes)
+        index.trigrams = dict(self.trigrams)
+        index.names = list(self.names)
+        bisect.insort(index.names, (' '.join(tokenize(record.spot_name)), position))
+
+        for token, weight in record_tokens(record).items():
+            if token in index.postings:
+                positions, weights = index.postings[token]
+                index.postings[token] = (np.append(positions, position), np.append(weights, weight))
+            else:
+                index.postings[token] = (np.array([position], dtype=np.int64), np.array([weight]))
+                index._add_token(token, copy=True)
+        return index
+
+    def search(self, query, limit=5):
+        """
+        Best matching records for a free-text query, best first
+        Every query token must match some field; ties go to the lower spot_id
+        """
+        key = (query, limit)
+        results = self._results.get(key)
+        if results is None:
+            results = self._search(query, limit)
+            if len(self._results) >= RESULT_CACHE_SIZE:
+                self._results.clear()
+            self._results[key] = results
+        return results
+
+    def _search(self, query, limit):
+        query_tokens = tokenize(query)
+        if not query_tokens:
+            order = np.argsort(self.spot_ids, kind='stable')[:limit]
+            return [self.records[position] for position in order]
+
+        scores = np.zeros(len(self.records))
+        matched = np.ones(len(self.records), dtype=bool)
+        for query_token in dict.fromkeys(query_tokens):
+            token_scores = self._match_token(query_token)
+            matched &= token_scores > 0
+            if not matched.any():
+                return []
+            scores += token_scores
+
+        # Names are sorted, so every name starting with the phrase is one contiguous slice
+        phrase = ' '.join(query_tokens)
+        start = bisect.bisect_left(self.names, (phrase,))
+        end = bisect.bisect_left(self.names, (phrase + '\uffff',))
+        if start < end:
+            scores[[position for _, position in self.names[start:end]]] += NAME_PREFIX_BONUS
+
+        candidates = np.flatnonzero(matched)
+        if len(candidates) > limit:
+            # Keep everything tied with the limit-th best so the spot_id tie-break is exact
+            threshold = np.partition(scores[candidates], len(candidates) - limit)[len(candidates) - limit]
+            candidates = candidates[scores[candidates] >= threshold]
+        order = np.lexsort((self.spot_ids[candidates], -scores[candidates]))[:limit]
+        return [self.records[position] for position in candidates[order]]
+
+    def _match_token(self, query_token):
+        """
+        Score of every spot for one query token, 0 where it doesn't match
+        """
+        matches = {}
+        if query_token in self.postings:
+            matches[query_token] = EXACT_MATCH
+        for token in self.prefixes.get(query_token[:MAX_PREFIX_LENGTH], ()):
+            if token.startswith(query_token):
+                matches.setdefault(token, PREFIX_MATCH)
+        if len(query_token) >= 3:
+            grams = {query_token[i:i + 3] for i in range(len(query_token) - 2)}
+            for token in self._trigram_candidates(grams, required=len(grams)):
+                if query_token in token:
+                    matches.setdefault(token, INFIX_MATCH)
+        if not matches:
+            matches = self._fuzzy_matches(query_token)
+
+        scores = np.zeros(len(self.records))
+        for token, quality in matches.items():
+            positions, weights = self.postings[token]
+            # Positions are unique within one token, so plain fancy indexing is safe
+            scores[positions] = np.maximum(scores[positions], quality * weights)
+        return scores
+
+    def _fuzzy_matches(self, query_token):
+        limit = max_typos(query_token)
+        if not limit:
+            return {}
+        # A substitution breaks three trigrams and a transposition four
+        grams = trigrams(query_token)
+        required = max(1, len(grams) - 4 * limit)
+        matches = {}
+        for token in self._trigram_candidates(grams, required=required):
+            if edit_distance(query_token, token, limit) <= limit:
+                matches[token] = FUZZY_MATCH
+        return matches
+
+    def _trigram_candidates(self, grams, required):
+        """
+        Tokens containing at least `required` of the given trigrams
+        """
+        counts = {}
+        for gram in grams:
+            for token in self.trigrams.get(gram, ()):
+                counts[token] = counts.get(token, 0) + 1
+        return [token for token, count in counts.items() if count >= required]
+
+    def _add_token(self, token, copy):
+        """
+        Register a new vocabulary token; with copy=True entries are replaced rather than mutated
+        """
+        # Padded trigrams include every inner trigram, so they serve both infix and typo lookups
+        keys = [
+            (self.prefixes, token[:length])
+            for length in range(1, min(len(token), MAX_PREFIX_LENGTH) + 1)
+        ] + [(self.trigrams, gram) for gram in trigrams(token)]
+        for table, key in keys:
+            if copy:
+                table[key] = table.get(key, frozenset()) | {token}
+            else:
+                table.setdefault(key, set()).add(token)
+
+
+def record_tokens(record):
+    """
+    Every token in a record's searchable columns, with its best field weight
+    """
+    tokens = {}
+    for field, weight in FIELD_WEIGHTS.items():
+        for token in tokenize(getattr(record, field)):
+            if weight > tokens.get(token, 0):
+                tokens[token] = weight
+    return tokens
+
+
+def build_search_index(snapshot):
+    """
+    Build the search index for a spot snapshot, over spots that have coordinates
+    """
+    return SpotSearchIndex(snapshot.located_records())
@@ -0,0 +1,100 @@
+"""
+Spot list responses assembled from cached per-spot JSON fragments
+
+Each spot is encoded once per snapshot (and per ?fields= projection) and list
+bodies are built by joining the encoded bytes, so a response costs a dict
+lookup per spot instead of a to_dict() and a pass through the JSON encoder.
+Uses orjson when it's installed.
+"""
+import json
+from spot_cache import SPOT_FIELDS
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder is used without it
+    orjson = None
+
+
+def dumps(value):
+    """
+    Compact JSON bytes with sorted keys, like Flask's encoder without the spaces
+    """
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS)
+    return json.dumps(value, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def parse_fields(value):
+    """
+    Field names from a ?fields=a,b,c parameter in SPOT_FIELDS order, or None for every field
+    Raises ValueError for unknown names
+    """
+    if value is None:
+        return None
+    names = {name.strip() for name in value.split(',') if name.strip()}
+    unknown = names.difference(SPOT_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}; choose from {', '.join(SPOT_FIELDS)}")
+    if not names:
+        raise ValueError('fields must name at least one field')
+    return tuple(name for name in SPOT_FIELDS if name in names)
+
+
+def with_keys(fragment, **extra):
+    """
+    An encoded JSON object with more keys added at the end
+    """
+    return fragment[:-1] + b',' + dumps(extra)[1:]
+
+
+class SpotFragments:
+    """
+    Encoded JSON object of each spot, by field projection, for one snapshot
+    Fragments are encoded on first use; with_record carries them over to the
+    next snapshot since adding a spot doesn't change the others.
+    """
+
+    def __init__(self, fragments=None):
+        self._fragments = fragments if fragments is not None else {}  # fields -> {spot_id: bytes}
+
+    def get(self, record, fields=None):
+        cache = self._fragments.get(fields)
+        if cache is None:
+            cache = self._fragments.setdefault(fields, {})
+        fragment = cache.get(record.spot_id)
+        if fragment is None:
+            values = record._asdict() if fields is None else {name: getattr(record, name) for name in fields}
+            fragment = cache[record.spot_id] = dumps(values)
+        return fragment
+
+    def many(self, records, fields=None):
+        return [self.get(record, fields) for record in records]
+
+    def with_record(self, record):
+        return SpotFragments({fields: dict(cache) for fields, cache in self._fragments.items()})
+
+
+def build_spot_fragments(snapshot):
+    return SpotFragments()
+
+
+def spot_fragments(snapshot):
+    """
+    The fragment cache of a spot snapshot
+    """
+    return snapshot.derived('spot_fragments', build_spot_fragments)
+
+
+def list_body(items, **extra):
+    """
+    {"status":"success","count":N,...extra,"data":[items]} from encoded items
+    """
+    head = dumps({'status': 'success', 'count': len(items), **extra})
+    return b''.join((head[:-1], b',"data":[', b','.join(items), b']}'))
+
+
+def spot_list_body(snapshot, records, fields=None, **extra):
+    """
+    A spot list response body for records of a snapshot
+    """
+    return list_body(spot_fragments(snapshot).many(records, fields), **extra)
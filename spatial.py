@@ -0,0 +1,177 @@
+"""
+Grid-based spatial index over parking spot coordinates
+Answers k-nearest and radius queries without scanning every spot
+"""
+import heapq
+from math import radians, sin, cos, sqrt, atan2, floor
+
+
+EARTHS_RADIUS = 3959  # earths radius in miles
+MILES_PER_DEGREE = EARTHS_RADIUS * radians(1)
+
+# Roughly 0.7 miles of latitude per cell, a few blocks of campus
+DEFAULT_CELL_SIZE = 0.01
+
+
+def haversine_miles(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in miles, same formula as calculate_distance in app.py
+    """
+    lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
+
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
+    c = 2 * atan2(sqrt(a), sqrt(1-a))
+    return EARTHS_RADIUS * c
+
+
+class SpatialGrid:
+    """
+    Buckets spots into fixed-size latitude/longitude cells
+
+    Cells hold tuples and with_record copies the cell map, so an index that is
+    being read is never mutated.
+    """
+
+    def __init__(self, records=(), cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}
+        self.count = 0
+        self.bounds = None  # (min_row, max_row, min_col, max_col)
+        for record in records:
+            self._insert(record)
+
+    def __len__(self):
+        return self.count
+
+    def with_record(self, record):
+        """
+        Return a copy of the index with one more spot
+        """
+        if not record.has_coordinates():
+            return self
+        grid = SpatialGrid(cell_size=self.cell_size)
+        grid.cells = dict(self.cells)
+        grid.count = self.count
+        grid.bounds = self.bounds
+        grid._insert(record)
+        return grid
+
+    def nearest(self, lat, lon, k, radius_mi=None):
+        """
+        Up to k spots closest to (lat, lon), optionally within radius_mi
+        Returns a list of (distance_mi, record), closest first
+        """
+        if k <= 0 or not self.count:
+            return []
+        if radius_mi is not None:
+            return self.within(lat, lon, radius_mi)[:k]
+
+        row, col = self._cell(lat, lon)
+        min_row, max_row, min_col, max_col = self.bounds
+        # Rings closer than the occupied bounds are empty, start at the first one that isn't
+        first_ring = max(min_row - row, row - max_row, min_col - col, col - max_col, 0)
+        last_ring = max(row - min_row, max_row - row, col - min_col, max_col - col, 0)
+
+        # Max-heap of the best k seen so far, keyed on (-distance, -spot_id)
+        best = []
+        for ring in range(first_ring, last_ring + 1):
+            for record in self._ring(row, col, ring):
+                distance = haversine_miles(lat, lon, record.latitude, record.longitude)
+                item = (-distance, -record.spot_id, record)
+                if len(best) < k:
+                    heapq.heappush(best, item)
+                elif item > best[0]:
+                    heapq.heapreplace(best, item)
+            # Anything outside the rings searched so far is at least this far away
+            if len(best) == k and -best[0][0] <= self._ring_clearance(lat, lon, row, col, ring):
+                break
+
+        return [(-distance, record) for distance, _, record in sorted(best, reverse=True)]
+
+    def within(self, lat, lon, radius_mi):
+        """
+        Every spot within radius_mi of (lat, lon)
+        Returns a list of (distance_mi, record), closest first
+        """
+        if radius_mi < 0 or not self.count:
+            return []
+
+        lat_span = radius_mi / MILES_PER_DEGREE
+        lon_span = radius_mi / (MILES_PER_DEGREE * self._min_cos(lat, lat_span))
+        min_row, max_row, min_col, max_col = self.bounds
+        row_lo = max(self._index(lat - lat_span), min_row)
+        row_hi = min(self._index(lat + lat_span), max_row)
+        col_lo = max(self._index(lon - lon_span), min_col)
+        col_hi = min(self._index(lon + lon_span), max_col)
+
+        matches = []
+        for cell_row in range(row_lo, row_hi + 1):
+            for cell_col in range(col_lo, col_hi + 1):
+                for record in self.cells.get((cell_row, cell_col), ()):
+                    distance = haversine_miles(lat, lon, record.latitude, record.longitude)
+                    if distance <= radius_mi:
+                        matches.append((distance, record))
+        matches.sort(key=lambda match: (match[0], match[1].spot_id))
+        return matches
+
+    def _insert(self, record):
+        row, col = self._cell(record.latitude, record.longitude)
+        self.cells[(row, col)] = self.cells.get((row, col), ()) + (record,)
+        self.count += 1
+        if self.bounds is None:
+            self.bounds = (row, row, col, col)
+        else:
+            min_row, max_row, min_col, max_col = self.bounds
+            self.bounds = (min(min_row, row), max(max_row, row), min(min_col, col), max(max_col, col))
+
+    def _index(self, degrees):
+        return floor(degrees / self.cell_size)
+
+    def _cell(self, lat, lon):
+        return self._index(lat), self._index(lon)
+
+    def _ring(self, row, col, ring):
+        """
+        Spots in the square ring of cells exactly `ring` cells from (row, col)
+        """
+        if ring == 0:
+            yield from self.cells.get((row, col), ())
+            return
+        # Only walk the part of the ring that overlaps occupied cells
+        min_row, max_row, min_col, max_col = self.bounds
+        for cell_row in (row - ring, row + ring):
+            if min_row <= cell_row <= max_row:
+                for cell_col in range(max(col - ring, min_col), min(col + ring, max_col) + 1):
+                    yield from self.cells.get((cell_row, cell_col), ())
+        for cell_col in (col - ring, col + ring):
+            if min_col <= cell_col <= max_col:
+                for cell_row in range(max(row - ring + 1, min_row), min(row + ring - 1, max_row) + 1):
+                    yield from self.cells.get((cell_row, cell_col), ())
+
+    def _ring_clearance(self, lat, lon, row, col, ring):
+        """
+        Lower bound on the distance from (lat, lon) to any cell outside the searched rings
+        """
+        lat_gap = min(lat - (row - ring) * self.cell_size, (row + ring + 1) * self.cell_size - lat)
+        lon_gap = min(lon - (col - ring) * self.cell_size, (col + ring + 1) * self.cell_size - lon)
+        lat_miles = lat_gap * MILES_PER_DEGREE
+        lon_miles = lon_gap * MILES_PER_DEGREE * self._min_cos(lat, (ring + 1) * self.cell_size)
+        # Shave a little off so rounding never prunes a true neighbour
+        return min(lat_miles, lon_miles) * 0.999
+
+    @staticmethod
+    def _min_cos(lat, lat_span):
+        """
+        Smallest cos(latitude) over lat +/- lat_span, used to size longitude spans
+        """
+        return max(cos(radians(min(abs(lat) + lat_span, 89.9))), 1e-6)
+
+
+def build_spatial_index(snapshot):
+    """
+    Build the spatial index for a spot snapshot, over spots that have coordinates
+    """
+    return SpatialGrid(snapshot.located_records())
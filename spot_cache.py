@@ -0,0 +1,217 @@
+"""
+In-memory snapshot of the parking spot table shared by the read endpoints
+"""
+import bisect
+import threading
+import time
+from collections import namedtuple
+from models import db, ParkingSpot, SpotDataVersion
+
+
+SPOT_FIELDS = (
+    'spot_id',
+    'spot_name',
+    'campus_location',
+    'parking_type',
+    'cost',
+    'walk_time',
+    'near_buildings',
+    'address',
+    'latitude',
+    'longitude',
+    'is_verified',
+)
+
+
+class SpotRecord(namedtuple('SpotRecord', SPOT_FIELDS)):
+    """
+    Read-only copy of one ParkingSpot row
+    Has the same attributes as the model so scoring code works on either
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_model(cls, spot):
+        return cls(**spot.to_dict())
+
+    def to_dict(self):
+        return self._asdict()
+
+    def has_coordinates(self):
+        return self.latitude is not None and self.longitude is not None
+
+
+class SpotSnapshot:
+    """
+    Immutable view of every parking spot at one data version
+    Records are kept in spot_id order
+    """
+
+    def __init__(self, version, records):
+        self.version = version
+        self.records = tuple(records)
+        self.spot_ids = [record.spot_id for record in self.records]
+        self.by_id = {record.spot_id: record for record in self.records}
+        self.loaded_at = time.monotonic()
+        self.checked_at = self.loaded_at
+        self._derived = {}
+
+    def derived(self, name, build):
+        """
+        Get a structure computed from this snapshot, building it on first use
+        build is called with the snapshot and its result lives as long as the snapshot
+        """
+        value = self._derived.get(name)
+        if value is None:
+            value = build(self)
+            self._derived[name] = value
+        return value
+
+    def located_records(self):
+        """
+        Records that have both latitude and longitude
+        """
+        return self.derived(
+            'located_records',
+            lambda snapshot: tuple(record for record in snapshot.records if record.has_coordinates())
+        )
+
+    def with_record(self, version, record):
+        """
+        Return a new snapshot with one extra record, without going back to the database
+        Derived structures that have a with_record method are updated incrementally,
+        everything else is rebuilt lazily on next use
+        """
+        if not self.spot_ids or record.spot_id > self.spot_ids[-1]:
+            records = self.records + (record,)
+        else:
+            position = bisect.bisect_left(self.spot_ids, record.spot_id)
+            records = self.records[:position] + (record,) + self.records[position:]
+        snapshot = SpotSnapshot(version, records)
+        for name, value in list(self._derived.items()):
+            if hasattr(value, 'with_record'):
+                snapshot._derived[name] = value.with_record(record)
+        return snapshot
+
+    def page(self, after=None, limit=None):
+        """
+        Records with spot_id greater than `after`, at most `limit` of them
+        """
+        start = 0 if after is None else bisect.bisect_right(self.spot_ids, after)
+        end = None if limit is None else start + limit
+        return self.records[start:end]
+
+    def __len__(self):
+        return len(self.records)
+
+
+class SpotCache:
+    """
+    Process-local cache of the parking spot table
+
+    Readers get the current snapshot without touching the database. Once the
+    snapshot is older than max_staleness seconds the next reader checks the
+    spot_data_version row and reloads only if another worker wrote since.
+    """
+
+    def __init__(self, max_staleness=5.0):
+        self.max_staleness = max_staleness
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.max_staleness = app.config.get('SPOT_CACHE_MAX_STALENESS', self.max_staleness)
+
+    def get(self):
+        """
+        Return the current snapshot, reloading it if it is stale and out of date
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and not self._is_stale(snapshot):
+            return snapshot
+
+        # Another thread is already revalidating, serve what we have instead of waiting
+        if not self._lock.acquire(blocking=snapshot is None):
+            return snapshot
+        try:
+            snapshot = self._snapshot
+            if snapshot is not None and not self._is_stale(snapshot):
+                return snapshot
+
+            # Read the version before the rows so a concurrent write can only
+            # make the snapshot newer than its label, never older
+            version = read_spot_data_version()
+            if snapshot is not None and snapshot.version == version:
+                snapshot.checked_at = time.monotonic()
+                return snapshot
+
+            self._snapshot = self._load(version)
+            return self._snapshot
+        finally:
+            self._lock.release()
+
+    def refresh(self):
+        """
+        Reload the snapshot from the database unconditionally
+        """
+        with self._lock:
+            self._snapshot = self._load(read_spot_data_version())
+            return self._snapshot
+
+    def add_spot(self, spot, version):
+        """
+        Fold a freshly committed spot into the snapshot
+        Falls back to a full reload if some other write happened in between
+        """
+        record = SpotRecord.from_model(spot)
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version - 1:
+                self._snapshot = self._load(read_spot_data_version())
+            else:
+                self._snapshot = snapshot.with_record(version, record)
+            return self._snapshot
+
+    def invalidate(self):
+        """
+        Drop the snapshot so the next reader reloads it
+        """
+        with self._lock:
+            self._snapshot = None
+
+    @property
+    def version(self):
+        snapshot = self._snapshot
+        return snapshot.version if snapshot is not None else None
+
+    def _is_stale(self, snapshot):
+        return time.monotonic() - snapshot.checked_at >= self.max_staleness
+
+    def _load(self, version):
+        spots = ParkingSpot.query.order_by(ParkingSpot.spot_id).all()
+        return SpotSnapshot(version, [SpotRecord.from_model(spot) for spot in spots])
+
+
+def read_spot_data_version():
+    """
+    Get the current spot data version (0 if nothing has bumped it yet)
+    """
+    version = db.session.query(SpotDataVersion.version).filter_by(version_id=1).scalar()
+    return version or 0
+
+
+def bump_spot_data_version():
+    """
+    Increment the spot data version inside the caller's transaction
+    Call this before committing any write to parking_spots
+    Returns the new version
+    """
+    row = db.session.get(SpotDataVersion, 1, with_for_update=True)
+    if row is None:
+        row = SpotDataVersion(version_id=1, version=0)
+        db.session.add(row)
+    row.version += 1
+    return row.version
+
+
+spot_cache = SpotCache()
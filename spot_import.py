@@ -0,0 +1,481 @@
+"""
+Bulk parking spot import from CSV or GeoJSON
+Files are parsed as a stream and written in batches: executemany upserts,
+or with method='copy' COPY into a staging table (PostgreSQL with psycopg2
+only). Rows are upserted on (source, source_id), so re-importing a dataset
+updates it in place, and the spot data version is bumped once when the
+import commits. Spots with an address but no coordinates are then queued
+for geocoding.
+
+Usage: python spot_import.py meters.csv --source minneapolis_meters [--id-field meter_id]
+       python spot_import.py ramps.geojson --source umn_ramps [--method copy]
+"""
+import argparse
+import csv
+import io
+import json
+import math
+import time
+from datetime import datetime
+from sqlalchemy import text
+from geocoding import geocode_queue
+from models import db, ParkingSpot
+from spot_cache import spot_cache, bump_spot_data_version
+
+
+# Columns an import may set, in the order they are written
+IMPORT_FIELDS = (
+    'spot_name', 'campus_location', 'parking_type', 'cost', 'walk_time',
+    'near_buildings', 'address', 'latitude', 'longitude', 'is_verified'
+)
+WRITE_COLUMNS = IMPORT_FIELDS + ('source', 'source_id', 'created_at')
+
+# Other names datasets commonly use for our columns
+FIELD_ALIASES = {
+    'name': 'spot_name',
+    'campus': 'campus_location',
+    'type': 'parking_type',
+    'rate': 'cost',
+    'lat': 'latitude',
+    'lon': 'longitude',
+    'lng': 'longitude',
+    'verified': 'is_verified',
+}
+
+TRUE_VALUES = {'1', 'true', 't', 'yes', 'y'}
+FALSE_VALUES = {'0', 'false', 'f', 'no', 'n', ''}
+
+# How many rejected rows are reported back individually
+MAX_REPORTED_ERRORS = 20
+
+
+class SpotImportError(ValueError):
+    """
+    The file can't be imported at all (unreadable, wrong format, unsupported database)
+    """
+
+
+# ============= PARSING =============
+def read_csv(stream):
+    """
+    Rows of a CSV file with a header line, as dicts
+    """
+    reader = csv.DictReader(stream)
+    if reader.fieldnames is None:
+        raise SpotImportError('CSV file is empty')
+    for row in reader:
+        yield row
+
+
+def read_geojson(stream):
+    """
+    Point features of a GeoJSON FeatureCollection as flat dicts: the feature's
+    properties plus latitude/longitude from its geometry and its id as 'id'
+    """
+    for feature in iter_features(stream):
+        row = dict(feature.get('properties') or {})
+        geometry = feature.get('geometry') or {}
+        if geometry.get('type') == 'Point':
+            coordinates = geometry.get('coordinates') or []
+            if len(coordinates) >= 2:
+                row['longitude'], row['latitude'] = coordinates[0], coordinates[1]
+        elif geometry:
+            row['_error'] = f"geometry must be a Point, not {geometry.get('type')}"
+        if 'id' in feature and 'id' not in row:
+            row['id'] = feature['id']
+        yield row
+
+
+class JSONStream:
+    """
+    Reads JSON values one at a time from a text stream without loading the whole document
+    """
+
+    def __init__(self, stream, chunk_size=1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what has been consumed so the buffer stays about one value long
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Next non-whitespace character, or '' at the end of the stream
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, characters):
+        char = self.peek()
+        if char == '' or char not in characters:
+            raise SpotImportError(f"Invalid GeoJSON: expected {' or '.join(characters)}, found {char or 'end of file'!r}")
+        self.pos += 1
+        return char
+
+    def value(self):
+        """
+        Decode the next complete JSON value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    raise SpotImportError(f'Invalid GeoJSON: {e}') from e
+            self._fill()
+
+
+def iter_features(stream):
+    """
+    Features of a FeatureCollection, one at a time
+    """
+    reader = JSONStream(stream)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key != 'features':
+            reader.value()
+        else:
+            reader.expect('[')
+            if reader.peek() == ']':
+                reader.pos += 1
+            else:
+                while True:
+                    feature = reader.value()
+                    if not isinstance(feature, dict):
+                        raise SpotImportError('Invalid GeoJSON: features must be objects')
+                    yield feature
+                    if reader.expect(',]') == ']':
+                        break
+        if reader.expect(',}') == '}':
+            return
+
+
+READERS = {
+    'csv': read_csv,
+    'geojson': read_geojson,
+}
+
+
+# ============= VALIDATION =============
+def column_lengths():
+    return {
+        column.name: column.type.length
+        for column in ParkingSpot.__table__.columns
+        if getattr(column.type, 'length', None)
+    }
+
+
+def parse_float(value, name):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} is not a number: {value!r}')
+    if not math.isfinite(number):
+        raise ValueError(f'{name} is not a finite number: {value!r}')
+    return number
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text_value = str(value if value is not None else '').strip().lower()
+    if text_value in TRUE_VALUES:
+        return True
+    if text_value in FALSE_VALUES:
+        return False
+    raise ValueError(f'is_verified is not true or false: {value!r}')
+
+
+def clean_row(raw, source, id_field, lengths):
+    """
+    Turn one parsed row into column values for parking_spots
+    Raises ValueError with a message saying what is wrong with the row
+    """
+    if raw.get('_error'):
+        raise ValueError(raw['_error'])
+
+    row = {}
+    for name, value in raw.items():
+        if name is None:
+            continue
+        key = name.strip().lower()
+        key = FIELD_ALIASES.get(key, key)
+        if key in IMPORT_FIELDS and key not in row:
+            row[key] = value.strip() if isinstance(value, str) else value
+
+    source_id = raw.get(id_field)
+    if source_id is None or not str(source_id).strip():
+        raise ValueError(f'missing {id_field}')
+
+    latitude = parse_float(row.get('latitude'), 'latitude')
+    longitude = parse_float(row.get('longitude'), 'longitude')
+    if (latitude is None) != (longitude is None):
+        raise ValueError('latitude and longitude must both be given or both be empty')
+    if latitude is not None and not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise ValueError(f'coordinates out of range: {latitude}, {longitude}')
+
+    cost = parse_float(row.get('cost'), 'cost')
+    if cost is not None and cost < 0:
+        raise ValueError(f'cost is negative: {cost}')
+
+    values = {field: (str(row[field]) if row.get(field) not in (None, '') else None) for field in IMPORT_FIELDS}
+    values.update({
+        'cost': cost,
+        'latitude': latitude,
+        'longitude': longitude,
+        'is_verified': parse_bool(row.get('is_verified')),
+        'source': source,
+        'source_id': str(source_id).strip(),
+    })
+    if not values['address'] and latitude is None:
+        raise ValueError('needs coordinates or an address')
+    values['spot_name'] = values['spot_name'] or values['address'] or f'{source} {values["source_id"]}'
+
+    for field, length in lengths.items():
+        if isinstance(values.get(field), str) and len(values[field]) > length:
+            raise ValueError(f'{field} is longer than {length} characters')
+    return values
+
+
+# ============= WRITING =============
+def write_batch_copy(connection, rows):
+    """
+    COPY the batch into a temporary staging table, then upsert it in one statement
+    """
+    table = ParkingSpot.__table__
+    column_types = ', '.join(
+        f'{name} {table.c[name].type.compile(dialect=connection.dialect)}' for name in WRITE_COLUMNS
+    )
+    # Lives until the import commits
+    connection.execute(text(f'CREATE TEMPORARY TABLE IF NOT EXISTS spot_import_staging ({column_types}) ON COMMIT DROP'))
+
+    # Every value is quoted, so only an unquoted empty field reads as NULL and
+    # an empty string or one that looks like a NULL marker stays as it is
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write(','.join(copy_field(row[name]) for name in WRITE_COLUMNS))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    columns = ', '.join(WRITE_COLUMNS)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY spot_import_staging ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+    finally:
+        cursor.close()
+
+    updates = ', '.join(f'{name} = EXCLUDED.{name}' for name in IMPORT_FIELDS)
+    connection.execute(text(
+        f'INSERT INTO parking_spots ({columns}) SELECT {columns} FROM spot_import_staging '
+        f'ON CONFLICT (source, source_id) DO UPDATE SET {updates}'
+    ))
+    connection.execute(text('TRUNCATE spot_import_staging'))
+
+
+def copy_field(value):
+    if value is None:
+        return ''
+    return '"' + str(value).replace('"', '""') + '"'
+
+
+def write_batch_executemany(connection, rows):
+    """
+    Upsert the batch with one INSERT ... ON CONFLICT executed for many rows
+    """
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif connection.dialect.name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise SpotImportError(f'Bulk import is not supported on {connection.dialect.name}')
+
+    statement = insert(ParkingSpot.__table__)
+    statement = statement.on_conflict_do_update(
+        index_elements=['source', 'source_id'],
+        set_={name: statement.excluded[name] for name in IMPORT_FIELDS}
+    )
+    connection.execute(statement, rows)
+
+
+WRITERS = {
+    'copy': write_batch_copy,
+    'executemany': write_batch_executemany,
+}
+
+
+class ImportResult:
+    """
+    Counts and timing for one import
+    """
+
+    def __init__(self, source, file_format, method):
+        self.source = source
+        self.format = file_format
+        self.method = method
+        self.rows_read = 0
+        self.rows_written = 0
+        self.rows_rejected = 0
+        self.errors = []  # (row number, message) for the first few rejected rows
+        self.version = None
+        self.geocode_queued = 0  # spots with an address but no coordinates
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows_written / self.seconds if self.seconds else 0.0
+
+    def reject(self, row_number, message):
+        self.rows_rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append((row_number, message))
+
+    def to_dict(self):
+        return {
+            'source': self.source,
+            'format': self.format,
+            'method': self.method,
+            'rows_read': self.rows_read,
+            'rows_written': self.rows_written,
+            'rows_rejected': self.rows_rejected,
+            'errors': [{'row': row, 'message': message} for row, message in self.errors],
+            'version': self.version,
+            'geocode_queued': self.geocode_queued,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 1)
+        }
+
+
+def import_spots(stream, source, file_format='csv', id_field='id', batch_size=1000, method='executemany'):
+    """
+    Import spots from a text stream in one transaction
+    Invalid rows are skipped and reported; returns an ImportResult
+    Spots imported with an address but no coordinates are queued for geocoding
+    Call inside an app context
+    """
+    if file_format not in READERS:
+        raise SpotImportError(f"format must be one of: {', '.join(READERS)}")
+    if not source or len(source) > ParkingSpot.__table__.c.source.type.length:
+        raise SpotImportError('source is required (at most 50 characters)')
+
+    started = time.perf_counter()
+    connection = db.session.connection()
+    method = method or 'executemany'
+    if method not in WRITERS:
+        raise SpotImportError(f"method must be one of: {', '.join(WRITERS)}")
+    if method == 'copy' and (connection.dialect.name != 'postgresql' or connection.dialect.driver != 'psycopg2'):
+        raise SpotImportError('copy needs PostgreSQL with psycopg2')
+    write_batch = WRITERS[method]
+    result = ImportResult(source, file_format, method)
+    lengths = column_lengths()
+    created_at = datetime.utcnow()
+
+    # Keyed by source_id so a key repeated within a batch is written once (last row wins)
+    batch = {}
+    try:
+        for row_number, raw in enumerate(READERS[file_format](stream), start=1):
+            result.rows_read += 1
+            try:
+                values = clean_row(raw, source, id_field, lengths)
+            except ValueError as e:
+                result.reject(row_number, str(e))
+                continue
+            values['created_at'] = created_at
+            batch[values['source_id']] = values
+            if len(batch) >= batch_size:
+                write_batch(connection, list(batch.values()))
+                result.rows_written += len(batch)
+                batch = {}
+        if batch:
+            write_batch(connection, list(batch.values()))
+            result.rows_written += len(batch)
+
+        if result.rows_written:
+            result.version = bump_spot_data_version()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    result.seconds = time.perf_counter() - started
+    if result.rows_written:
+        spot_cache.refresh()
+        # Queued after the commit so the geocoder finds the rows it updates
+        result.geocode_queued = queue_geocoding(source)
+    return result
+
+
+def queue_geocoding(source):
+    """
+    Queue the source's spots that have an address but no coordinates
+    Returns how many spots were queued
+    """
+    spots = db.session.query(ParkingSpot.spot_id, ParkingSpot.address).filter(
+        ParkingSpot.source == source,
+        ParkingSpot.latitude.is_(None),
+        ParkingSpot.address.isnot(None)
+    ).order_by(ParkingSpot.spot_id).all()
+    for spot_id, address in spots:
+        geocode_queue.submit(spot_id, address)
+    return len(spots)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Bulk import parking spots from CSV or GeoJSON')
+    parser.add_argument('path', help='CSV (with a header line) or GeoJSON FeatureCollection')
+    parser.add_argument('--source', required=True, help='dataset name, part of the upsert key')
+    parser.add_argument('--id-field', default='id', help="column or property holding each spot's id in the dataset")
+    parser.add_argument('--format', choices=sorted(READERS), help='defaults to the file extension')
+    parser.add_argument('--batch-size', type=int, default=1000, help='rows per COPY or executemany batch')
+    parser.add_argument('--method', choices=sorted(WRITERS), default='executemany',
+                        help='copy is faster on PostgreSQL with psycopg2')
+    args = parser.parse_args()
+
+    file_format = args.format or ('geojson' if args.path.lower().endswith(('.geojson', '.json')) else 'csv')
+
+    from app import app
+
+    with app.app_context(), open(args.path, encoding='utf-8-sig', newline='') as f:
+        result = import_spots(f, args.source, file_format, args.id_field, args.batch_size, args.method)
+
+    print(f"Imported {result.rows_written} of {result.rows_read} rows from {args.path} "
+          f"({result.method}) in {result.seconds:.2f}s, {result.rows_per_second:.0f} rows/s")
+    if result.rows_rejected:
+        print(f"Rejected {result.rows_rejected} rows:")
+        for row_number, message in result.errors:
+            print(f"  row {row_number}: {message}")
+    if result.version is not None:
+        print(f"Spot data version is now {result.version}")
+    if result.geocode_queued:
+        # The queue lives in this process, so wait for it; python geocoding.py picks up anything left
+        print(f"Geocoding {result.geocode_queued} spot(s) that have an address but no coordinates")
+        geocode_queue.wait_until_idle()
+        print("Geocoding finished")
@@ -0,0 +1,57 @@
+"""
+Timing of application startup, broken down by phase
+"""
+import os
+import time
+from contextlib import contextmanager
+
+
+# Import this module first so the time spent importing the app's dependencies can be reported
+IMPORTED_AT = time.perf_counter()
+
+class StartupReport:
+    """
+    Wall-clock time spent in each named startup phase
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = []  # (phase name, seconds)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def record(self, name, seconds):
+        """
+        Add a phase that was timed elsewhere, before this report started
+        """
+        self.phases.insert(0, (name, seconds))
+        self.started -= seconds
+
+    @property
+    def total(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'pid': os.getpid(),
+            'phases_ms': {name: round(seconds * 1000, 2) for name, seconds in self.phases},
+            'total_ms': round(self.total * 1000, 2)
+        }
+
+    def report(self):
+        """
+        Print one line per phase, slowest phases are easy to spot in the deploy log
+        """
+        self.finished = time.perf_counter()
+        print(f"Startup [{self.name}] pid {os.getpid()}: {self.total * 1000:.1f}ms total")
+        for name, seconds in self.phases:
+            print(f"  {name:<24} {seconds * 1000:>9.1f}ms")
@@ -56,8 +56,117 @@ map.on('load', () => {
         },
         labelLayerId
     );
+
+    // Parking spots as vector tiles, so only the visible tiles are downloaded
+    map.addSource('parking-spots', {
+        type: 'vector',
+        tiles: [`${window.location.origin}/api/tiles/{z}/{x}/{y}`],
+        minzoom: 10,
+        maxzoom: 16
+    });
+
+    map.addLayer({
+        'id': 'parking-spots',
+        'source': 'parking-spots',
+        'source-layer': 'spots',
+        'type': 'circle',
+        'minzoom': SPOT_CLUSTER_MAX_ZOOM,
+        'paint': {
+            'circle-radius': ['interpolate', ['linear'], ['zoom'], 10, 2, 16, 7],
+            'circle-color': ['case', ['get', 'is_verified'], '#7A0019', '#64748b'],
+            'circle-stroke-width': 1,
+            'circle-stroke-color': '#ffffff'
+        }
+    });
+
+    map.on('click', 'parking-spots', (e) => {
+        const feature = e.features && e.features[0];
+        if (!feature) return;
+        const [longitude, latitude] = feature.geometry.coordinates;
+        handleSpotSelection({ ...feature.properties, latitude, longitude });
+    });
+
+    map.on('mouseenter', 'parking-spots', () => {
+        map.getCanvas().style.cursor = 'pointer';
+    });
+
+    map.on('mouseleave', 'parking-spots', () => {
+        map.getCanvas().style.cursor = '';
+    });
+
+    // Zoomed out, draw server-side clusters instead of every spot
+    map.addSource('parking-clusters', {
+        type: 'geojson',
+        data: { type: 'FeatureCollection', features: [] }
+    });
+
+    map.addLayer({
+        'id': 'parking-clusters',
+        'source': 'parking-clusters',
+        'type': 'circle',
+        'maxzoom': SPOT_CLUSTER_MAX_ZOOM,
+        'paint': {
+            'circle-radius': ['interpolate', ['linear'], ['get', 'point_count'], 1, 8, 100, 22],
+            'circle-color': '#7A0019',
+            'circle-opacity': 0.85,
+            'circle-stroke-width': 2,
+            'circle-stroke-color': '#ffffff'
+        }
+    });
+
+    map.addLayer({
+        'id': 'parking-cluster-counts',
+        'source': 'parking-clusters',
+        'type': 'symbol',
+        'maxzoom': SPOT_CLUSTER_MAX_ZOOM,
+        'layout': {
+            'text-field': ['to-string', ['get', 'point_count']],
+            'text-size': 12
+        },
+        'paint': {
+            'text-color': '#ffffff'
+        }
+    });
+
+    map.on('click', 'parking-clusters', (e) => {
+        const feature = e.features && e.features[0];
+        if (!feature) return;
+        map.easeTo({ center: feature.geometry.coordinates, zoom: map.getZoom() + 2 });
+    });
+
+    map.on('moveend', loadSpotClusters);
+    loadSpotClusters();
 });
 
+// ============= SPOT CLUSTERS =============
+const SPOT_CLUSTER_MAX_ZOOM = 14;
+
+async function loadSpotClusters() {
+    const zoom = map.getZoom();
+    if (zoom >= SPOT_CLUSTER_MAX_ZOOM) return;
+
+    const bounds = map.getBounds();
+    const bbox = [
+        Math.max(bounds.getWest(), -180), Math.max(bounds.getSouth(), -90),
+        Math.min(bounds.getEast(), 180), Math.min(bounds.getNorth(), 90)
+    ].join(',');
+
+    try {
+        const response = await fetch(`/api/parking-spots/clusters?bbox=${bbox}&zoom=${Math.floor(zoom)}&fields=spot_id,latitude,longitude,cost`);
+        const data = await response.json();
+        if (data.status !== 'success') return;
+
+        const features = data.data.map(item => ({
+            type: 'Feature',
+            geometry: { type: 'Point', coordinates: [item.longitude, item.latitude] },
+            properties: { point_count: item.point_count || 1 }
+        }));
+        map.getSource('parking-clusters').setData({ type: 'FeatureCollection', features });
+    } catch (error) {
+        console.error('Cluster load error:', error);
+    }
+}
+
 //================= LOCATE ME FUNCTION =================
 /* Sends the user back to the UMN-TC campus */
 const locateMeBtn = document.getElementById('locate_me_button');
@@ -681,6 +790,106 @@ async function displaySuggestions(selectedSpot, userLat, userLon) {
     }
 }
 
+// ============= LIVE OCCUPANCY =============
+// spot_id -> {occupancy, reports, updated_at}, kept current by the server's event stream
+const spotOccupancy = new Map();
+
+function occupancyText(spotId) {
+    const estimate = spotOccupancy.get(String(spotId));
+    return estimate ? `${Math.round(estimate.occupancy * 100)}% full` : 'No reports';
+}
+
+function applyOccupancy(spots) {
+    Object.entries(spots).forEach(([spotId, estimate]) => {
+        if (estimate) {
+            spotOccupancy.set(spotId, estimate);
+        } else {
+            spotOccupancy.delete(spotId);
+        }
+        // Update any card already showing this spot
+        document.querySelectorAll(`.occupancy-value[data-spot-id="${spotId}"]`).forEach(el => {
+            el.textContent = occupancyText(spotId);
+        });
+    });
+}
+
+// Last published version seen, so polls only get the estimates when they changed
+let occupancyVersion = null;
+let occupancySource = null;
+let occupancyPollTimer = null;
+
+function replaceOccupancy(data) {
+    occupancyVersion = data.version;
+    spotOccupancy.forEach((_, spotId) => {
+        if (!(spotId in data.spots)) data.spots[spotId] = null;
+    });
+    applyOccupancy(data.spots);
+}
+
+function pollOccupancy(interval = 15) {
+    const since = occupancyVersion === null ? '' : `?since=${occupancyVersion}`;
+    fetch(`/api/occupancy${since}`)
+        .then(response => response.ok ? response.json() : null)
+        .then(data => {
+            if (data && data.full) replaceOccupancy(data);
+            if (data) interval = data.poll_interval;
+        })
+        .catch(() => {})
+        .finally(() => {
+            if (document.visibilityState === 'visible' && !occupancySource) {
+                occupancyPollTimer = setTimeout(() => pollOccupancy(interval), interval * 1000);
+            }
+        });
+}
+
+function connectOccupancyStream() {
+    if (occupancySource || occupancyPollTimer) return;
+    if (!window.EventSource) {
+        pollOccupancy();
+        return;
+    }
+    // EventSource reconnects by itself when the server ends the stream; it
+    // gives up when the worker has no stream slot free (503), then we poll
+    const source = new EventSource('/api/stream/occupancy');
+    occupancySource = source;
+    source.addEventListener('snapshot', (event) => {
+        replaceOccupancy(JSON.parse(event.data));
+    });
+    source.addEventListener('occupancy', (event) => {
+        const data = JSON.parse(event.data);
+        occupancyVersion = data.version;
+        applyOccupancy(data.spots);
+    });
+    source.addEventListener('error', () => {
+        if (source.readyState === EventSource.CLOSED && occupancySource === source) {
+            occupancySource = null;
+            pollOccupancy();
+        }
+    });
+}
+
+function disconnectOccupancy() {
+    if (occupancySource) {
+        occupancySource.close();
+        occupancySource = null;
+    }
+    clearTimeout(occupancyPollTimer);
+    occupancyPollTimer = null;
+}
+
+// Only hold a stream (a server thread) while the map is on screen
+document.addEventListener('visibilitychange', () => {
+    if (document.visibilityState === 'visible') {
+        connectOccupancyStream();
+    } else {
+        disconnectOccupancy();
+    }
+});
+
+if (document.visibilityState === 'visible') {
+    connectOccupancyStream();
+}
+
 // ============= CREATE SPOT CARD WITH DIRECTIONS CHECK =============
 function createSpotCard(spot, rank, fromFilter = false) {
     const card = document.createElement('div');
@@ -718,6 +927,10 @@ function createSpotCard(spot, rank, fromFilter = false) {
                 <span class="detail-label">Cost</span>
                 <span class="detail-value">${costText}</span>
             </div>
+            <div class="spot-detail-item">
+                <span class="detail-label">Occupancy</span>
+                <span class="detail-value occupancy-value" data-spot-id="${spot.spot_id}">${occupancyText(spot.spot_id)}</span>
+            </div>
         </div>
         <div class="spot-actions">
             <button class="go-to-spot-btn" data-spot-id="${spot.spot_id}" ${buttonDisabled} style="${buttonStyle}">
@@ -767,6 +980,7 @@ let userLocationMarker = null;
 let watchPositionId = null;
 let currentTravelMode = 'driving';
 let destinationCoords = null;
+let destinationSpotId = null;
 let currentRouteSummary = null;
 
 // ============= SHOW DIRECTIONS MODAL =============
@@ -781,6 +995,7 @@ function showDirectionsModal(spot) {
 
     destinationName.textContent = spot.spot_name || 'Destination';
     destinationCoords = [Number(spot.longitude), Number(spot.latitude)];
+    destinationSpotId = spot.spot_id;
 
     modal.classList.add('open');
     calculateRoute(currentTravelMode);
@@ -795,15 +1010,18 @@ async function calculateRoute(mode) {
         }
 
         navigator.geolocation.getCurrentPosition(async (position) => {
-            const userCoords = [position.coords.longitude, position.coords.latitude];
-            const profile = mode === 'walking' ? 'foot' : 'car';
-            const url = `https://router.project-osrm.org/route/v1/${profile}/${userCoords.join(',')};${destinationCoords.join(',')}?overview=full&geometries=geojson`;
+            // Routed by the server, which caches routes for nearby starting points
+            const params = new URLSearchParams({
+                from: `${position.coords.latitude},${position.coords.longitude}`,
+                to: destinationSpotId,
+                mode
+            });
 
-            const response = await fetch(url);
+            const response = await fetch(`/api/route?${params}`);
             const data = await response.json();
 
-            if (data.code === 'Ok' && data.routes.length > 0) {
-                const route = data.routes[0];
+            if (data.status === 'success') {
+                const route = data.data;
                 const distanceMiles = route.distance / 1609.34; // meters to miles
                 let duration = route.duration / 60; // seconds to minutes
                 
@@ -1076,6 +1294,7 @@ function endNavigation(arrived) {
     
     // Clear destination coords
     destinationCoords = null;
+    destinationSpotId = null;
 
     if (arrived) {
         console.log('You have arrived at your destination!');
@@ -1107,6 +1326,7 @@ if (closeDirectionsBtn) {
         
         // Clear destination coords
         destinationCoords = null;
+        destinationSpotId = null;
     });
 }
 
@@ -0,0 +1,208 @@
+"""
+Locust load test mirroring the traffic static/app.js sends
+Page loads check /api/current-user, then users mostly search as they type,
+with some filtering and recommendation requests. Logged-in users get a
+session cookie signed with the app's SECRET_KEY, so Google is never contacted.
+
+Run the app against a local database with discovery prefetch off, e.g.:
+    DATABASE_URL=sqlite:////tmp/parkandgo_load.db GOOGLE_DISCOVERY_PREFETCH=false TRUSTED_PROXY_HOPS=1 \\
+        gunicorn app:app -w 4 -b 127.0.0.1:5000
+then, with the same DATABASE_URL and SECRET_KEY:
+    locust -f tests/locustfile.py --host http://127.0.0.1:5000 --headless -u 1000 -r 50 -t 3m
+
+Each simulated user sends its own X-Forwarded-For address, so with
+TRUSTED_PROXY_HOPS=1 the per-client rate limits see separate clients; 429s
+and 503s from admission control are counted as failures.
+
+A JSON summary is written to LOCUST_RESULTS (default tests/results/locust-<time>.json)
+"""
+import json
+import os
+import random
+import sys
+from datetime import datetime
+from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
+from locust import HttpUser, between, events, task
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('GOOGLE_DISCOVERY_PREFETCH', 'false')
+
+from config import Config
+
+
+# How many load test accounts to create, and the share of simulated users logged in as one
+LOAD_TEST_USERS = int(os.environ.get('LOCUST_USERS', 50))
+LOGGED_IN_SHARE = float(os.environ.get('LOCUST_LOGGED_IN_SHARE', 0.5))
+RESULTS_PATH = os.environ.get('LOCUST_RESULTS') or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'results',
+    f"locust-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.json"
+)
+
+SEARCH_TERMS = [
+    'ramp', 'oak street', 'garage', 'church', 'coffman', 'walter library',
+    'west bank', '19th ave', 'meters', 'carlson', 'washington', 'rmap', 'wlater'
+]
+FILTER_CAMPUSES = ['', 'East Bank', 'West Bank']
+FILTER_TYPES = ['', 'Street Parking', 'Parking Garage', 'Surface Lot', 'Permit']
+MAJORS = ['Computer Science', 'Computer Engineering', 'Business', 'Psychology', 'History']
+GRADE_LEVELS = ['Freshman', 'Sophomore', 'Junior', 'Senior', 'Graduate']
+HOUSING_TYPES = ['On-Campus', 'Off-Campus', 'Commuter']
+
+# Around the East and West Bank campuses
+CAMPUS_LAT = (44.968, 44.980)
+CAMPUS_LON = (-93.245, -93.225)
+
+user_ids = []
+
+
+# ============= LOGIN STUB =============
+def session_cookie(user_id):
+    """
+    A Flask session cookie that Flask-Login accepts as user_id
+    _fresh is False so session protection never rewrites the cookie
+    """
+    signer = Flask(__name__)
+    signer.secret_key = Config.SECRET_KEY
+    serializer = SecureCookieSessionInterface().get_signing_serializer(signer)
+    return serializer.dumps({'_user_id': str(user_id), '_fresh': False})
+
+
+@events.test_start.add_listener
+def create_load_test_users(environment, **kwargs):
+    """
+    Make sure the load test accounts exist and have complete profiles
+    """
+    from app import app
+    from models import db, User
+    from user_cache import user_cache
+
+    user_ids.clear()
+    with app.app_context():
+        for i in range(LOAD_TEST_USERS):
+            email = f'loadtest{i}@example.com'
+            user = User.query.filter_by(email=email).first()
+            if user is None:
+                user = User(
+                    google_id=f'loadtest-{i}',
+                    email=email,
+                    first_name='Load',
+                    last_name=f'Test {i}',
+                    major=MAJORS[i % len(MAJORS)],
+                    grade_level=GRADE_LEVELS[i % len(GRADE_LEVELS)],
+                    housing_type=HOUSING_TYPES[i % len(HOUSING_TYPES)],
+                )
+                db.session.add(user)
+                db.session.commit()
+                user_cache.invalidate(user.user_id)
+            user_ids.append(user.user_id)
+    print(f"Load test users ready: {len(user_ids)}")
+
+
+# ============= SCENARIO =============
+class ParkAndGoUser(HttpUser):
+    """
+    One browser tab of the map page
+    """
+    wait_time = between(1, 5)
+
+    def on_start(self):
+        self.spot_ids = []
+        self.client.headers['X-Forwarded-For'] = f'10.{random.randint(0, 255)}.{random.randint(0, 255)}.{random.randint(1, 254)}'
+        if user_ids and random.random() < LOGGED_IN_SHARE:
+            self.client.cookies.set('session', session_cookie(random.choice(user_ids)))
+        # Every page load checks who is logged in
+        self.client.get('/api/current-user')
+
+    @task(8)
+    def search_as_you_type(self):
+        """
+        Typing a term with a 300ms debounce: pauses send the prefix typed so far
+        """
+        term = random.choice(SEARCH_TERMS)
+        for length in range(2, len(term)):
+            if random.random() < 0.25:
+                self._search(term[:length])
+        self._search(term)
+
+    @task(2)
+    def filter_spots(self):
+        params = {}
+        campus = random.choice(FILTER_CAMPUSES)
+        parking_type = random.choice(FILTER_TYPES)
+        if campus:
+            params['campus'] = campus
+        if parking_type:
+            params['type'] = parking_type
+        if random.random() < 0.5:
+            params['max_cost'] = random.choice([1, 2, 3, 4])
+        self.client.get('/api/parking-spots/filter', params=params, name='/api/parking-spots/filter')
+
+    @task(2)
+    def recommendations(self):
+        if not self.spot_ids:
+            self._search(random.choice(SEARCH_TERMS))
+        if not self.spot_ids:
+            return
+        with self.client.post('/api/recommendations', json={
+            'selected_spot_id': random.choice(self.spot_ids),
+            'user_lat': random.uniform(*CAMPUS_LAT),
+            'user_lon': random.uniform(*CAMPUS_LON)
+        }, catch_response=True) as response:
+            # Anonymous users are expected to be turned away
+            if response.status_code == 401:
+                response.success()
+
+    @task(1)
+    def current_user(self):
+        self.client.get('/api/current-user')
+
+    def _search(self, query):
+        response = self.client.get('/api/search', params={'q': query}, name='/api/search')
+        if response.status_code == 200:
+            ids = [spot['spot_id'] for spot in response.json().get('data', [])]
+            if ids:
+                self.spot_ids = ids
+
+
+# ============= RESULTS =============
+@events.quitting.add_listener
+def write_results(environment, **kwargs):
+    """
+    Per-endpoint summary as JSON, for comparing runs over time
+    """
+    stats = environment.stats
+    endpoints = []
+    for entry in sorted(stats.entries.values(), key=lambda entry: (entry.name, entry.method)):
+        endpoints.append(summarize(entry))
+
+    results = {
+        'finished_at': datetime.utcnow().isoformat() + 'Z',
+        'host': environment.host,
+        'users': environment.runner.user_count if environment.runner else None,
+        'total': summarize(stats.total),
+        'endpoints': endpoints,
+        'errors': [
+            {'method': error.method, 'name': error.name, 'error': str(error.error), 'occurrences': error.occurrences}
+            for error in stats.errors.values()
+        ]
+    }
+    os.makedirs(os.path.dirname(RESULTS_PATH), exist_ok=True)
+    with open(RESULTS_PATH, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Wrote load test results to {RESULTS_PATH}")
+
+
+def summarize(entry):
+    return {
+        'method': entry.method,
+        'name': entry.name,
+        'requests': entry.num_requests,
+        'failures': entry.num_failures,
+        'rps': round(entry.total_rps, 2),
+        'avg_ms': round(entry.avg_response_time, 1),
+        'p50_ms': entry.get_response_time_percentile(0.5),
+        'p95_ms': entry.get_response_time_percentile(0.95),
+        'p99_ms': entry.get_response_time_percentile(0.99),
+        'max_ms': entry.max_response_time,
+    }
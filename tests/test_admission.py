@@ -0,0 +1,92 @@
+"""
+Admission control on a bare app: rate limit keys and shedding on queue wait
+"""
+import time
+import pytest
+from flask import Blueprint, Flask, jsonify
+from flask_login import LoginManager
+from admission import AdmissionControl, QUEUED_AT_HEADER
+
+
+@pytest.fixture
+def limited_app():
+    """
+    A search endpoint allowing 1 request per client (burst 1), or 3 per IP
+    without a session cookie, and a publicly cacheable one
+    """
+    flask_app = Flask(__name__)
+    flask_app.config.update(
+        SECRET_KEY='test',
+        ADMISSION_ENABLED=True,
+        ADMISSION_MAX_IN_FLIGHT=4,
+        ADMISSION_MAX_QUEUE_WAIT=0.5,
+        ADMISSION_RETRY_AFTER=1,
+        ADMISSION_MAX_CLIENTS=100,
+        ADMISSION_RATE_LIMITS={'default': (0.001, 100), 'search': (0.001, 1)},
+        ADMISSION_IP_RATE_MULTIPLIER=3
+    )
+    LoginManager(flask_app).user_loader(lambda user_id: None)
+    bp = Blueprint('main', __name__)
+
+    @bp.route('/api/search')
+    def search_parking_spots():
+        return jsonify({'status': 'success'})
+
+    @bp.route('/api/tiles')
+    def get_parking_spot_tile():
+        response = jsonify({'status': 'success'})
+        response.headers['Cache-Control'] = 'public, max-age=60'
+        return response
+
+    flask_app.register_blueprint(bp)
+    admission = AdmissionControl()
+    admission.init_app(flask_app)
+    return flask_app
+
+
+def test_anonymous_visitors_get_their_own_bucket(limited_app):
+    first = limited_app.test_client()
+    second = limited_app.test_client()
+
+    # Both start in the IP bucket and are given an id on the way out
+    assert first.get('/api/search').status_code == 200
+    assert second.get('/api/search').status_code == 200
+
+    # From then on each has its own allowance of 1, not the shared address's
+    assert first.get('/api/search').status_code == 200
+    assert first.get('/api/search').status_code == 429
+    assert second.get('/api/search').status_code == 200
+    assert second.get('/api/search').status_code == 429
+
+
+def test_cookieless_clients_share_a_larger_ip_bucket(limited_app):
+    cookieless = limited_app.test_client(use_cookies=False)
+
+    statuses = [cookieless.get('/api/search').status_code for _ in range(4)]
+    assert statuses == [200, 200, 200, 429]
+
+
+def test_cacheable_responses_set_no_cookie(limited_app):
+    client = limited_app.test_client()
+
+    response = client.get('/api/tiles')
+    assert response.status_code == 200
+    assert 'Set-Cookie' not in response.headers
+    assert 'Set-Cookie' in client.get('/api/search').headers
+
+
+@pytest.mark.parametrize('waited, endpoint, status', [
+    (0.1, '/api/search', 200),
+    # Anonymous and expensive: shed after half of ADMISSION_MAX_QUEUE_WAIT
+    (0.3, '/api/search', 503),
+    # Anonymous and cheap: three quarters
+    (0.3, '/api/tiles', 200),
+    (0.4, '/api/tiles', 503),
+])
+def test_requests_that_queued_too_long_are_shed(limited_app, waited, endpoint, status):
+    client = limited_app.test_client()
+
+    response = client.get(endpoint, headers={QUEUED_AT_HEADER: f'{time.time() - waited:.6f}'})
+    assert response.status_code == status
+    if status == 503:
+        assert response.headers['Retry-After'] == '1'
@@ -0,0 +1,213 @@
+"""
+Micro-benchmarks for the hot paths behind the spot endpoints, run with pytest-benchmark
+Skipped when the plugin isn't installed. To compare runs over time:
+
+    python -m pytest tests/test_benchmarks.py --benchmark-autosave
+    python -m pytest tests/test_benchmarks.py --benchmark-compare
+
+BENCHMARK_SPOTS sets the number of synthetic spots (default 5000); pass
+--benchmark-disable to run each benchmark once as a plain test.
+"""
+import os
+import random
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+from models import db, ParkingSpot, User, MajorCampusMapping
+
+
+SPOT_COUNT = int(os.environ.get('BENCHMARK_SPOTS', 5000))
+SEARCH_QUERIES = ['ramp', 'oak st', 'coff', 'walter library', 'wlater', 'garage east', 'west bank lot']
+USER_LAT, USER_LON = 44.975, -93.234
+
+
+# ============= FIXTURES =============
+def synthetic_spots(count, seed=7):
+    """
+    Transient ParkingSpot rows spread over the Twin Cities campus
+    """
+    rng = random.Random(seed)
+    words = ['Oak', 'Church', 'Union', 'River', 'Stadium', 'Coffman', 'Walter', 'Fulton', 'Delaware', 'Beacon']
+    kinds = [('Ramp', 'Parking Garage'), ('Lot', 'Surface Lot'), ('Meters', 'Street Parking')]
+    spots = []
+    for spot_id in range(1, count + 1):
+        kind, parking_type = rng.choice(kinds)
+        spots.append(ParkingSpot(
+            spot_id=spot_id,
+            spot_name=f'{rng.choice(words)} Street {kind} {spot_id}',
+            campus_location=rng.choice(['East Bank', 'West Bank']),
+            parking_type=parking_type,
+            cost=round(rng.uniform(0, 5), 2),
+            walk_time=f'{rng.randint(1, 20)} min',
+            near_buildings=f'{rng.choice(words)} Hall, {rng.choice(words)} Library',
+            address=f'{rng.randint(1, 4000)} {rng.choice(words)} Street, Minneapolis, MN',
+            latitude=44.97 + rng.uniform(-0.03, 0.03),
+            longitude=-93.23 + rng.uniform(-0.04, 0.04),
+            is_verified=rng.random() < 0.5
+        ))
+    return spots
+
+
+@pytest.fixture(scope='module')
+def workload(app):
+    """
+    Synthetic spots, their snapshot and walking matrix, and a user whose
+    major maps to buildings the spots are near
+    """
+    from types import SimpleNamespace
+    from spot_cache import SpotSnapshot, SpotRecord
+    from buildings import build_walking_matrix
+
+    spots = synthetic_spots(SPOT_COUNT)
+    snapshot = SpotSnapshot(1, [SpotRecord.from_model(row) for row in spots])
+    user = User(
+        user_id=1,
+        email='bench@example.com',
+        first_name='Bench',
+        last_name='Mark',
+        major='Computer Science',
+        grade_level='Senior',
+        housing_type='Commuter',
+        preferred_parking_types='Parking Garage,Surface Lot'
+    )
+
+    # The walking matrix reads the major mappings, everything after this runs without the database
+    with app.app_context():
+        mapping = MajorCampusMapping(
+            major_name='Computer Science', major_category='STEM', primary_campus='East Bank',
+            common_buildings='Walter Library, Coffman Hall'
+        )
+        db.session.add(mapping)
+        db.session.commit()
+        walking_matrix = snapshot.derived('walking_matrix', build_walking_matrix)
+        db.session.delete(mapping)
+        db.session.commit()
+
+    return SimpleNamespace(spots=spots, spot=spots[0], snapshot=snapshot, user=user, walking_matrix=walking_matrix)
+
+
+# ============= SCORING =============
+def test_calculate_distance(benchmark, workload):
+    from app import calculate_distance
+
+    spot = workload.spot
+    benchmark(calculate_distance, USER_LAT, USER_LON, spot.latitude, spot.longitude)
+
+
+def test_calculate_spot_score(benchmark, workload):
+    from app import calculate_spot_score
+
+    benchmark(calculate_spot_score, workload.spot, workload.user, USER_LAT, USER_LON, 2, workload.walking_matrix)
+
+
+def test_score_all_reference(benchmark, workload):
+    from app import calculate_spot_score
+
+    def score_all():
+        return sorted(workload.spots, key=lambda row: calculate_spot_score(
+            row, workload.user, USER_LAT, USER_LON, 2, workload.walking_matrix
+        ), reverse=True)[:3]
+    assert len(benchmark(score_all)) == 3
+
+
+def test_score_all_engine(benchmark, workload):
+    from scoring import build_scoring_engine
+
+    engine = build_scoring_engine(workload.snapshot)
+    assert len(benchmark(engine.top_k, workload.user, USER_LAT, USER_LON, 2, k=3)) == 3
+
+
+@pytest.fixture(scope='module')
+def recommendation_queries():
+    # Many origins: one top_k call each, against one matrix pass for all of them
+    rng = random.Random(11)
+    return [
+        (USER_LAT + rng.uniform(-0.03, 0.03), USER_LON + rng.uniform(-0.03, 0.03), rng.randint(1, SPOT_COUNT), False)
+        for _ in range(50)
+    ]
+
+
+def test_recommendations_single(benchmark, workload, recommendation_queries):
+    from scoring import build_scoring_engine
+
+    engine = build_scoring_engine(workload.snapshot)
+    benchmark(lambda: [
+        engine.top_k(workload.user, lat, lon, selected, k=3) for lat, lon, selected, _ in recommendation_queries
+    ])
+
+
+def test_recommendations_batch(benchmark, workload, recommendation_queries):
+    from scoring import build_scoring_engine
+
+    engine = build_scoring_engine(workload.snapshot)
+    results = benchmark(engine.top_k_many, workload.user, recommendation_queries, k=3)
+    assert len(results) == len(recommendation_queries)
+
+
+def test_walking_matrix_update(benchmark, workload):
+    from spot_cache import SpotRecord
+
+    record = SpotRecord.from_model(workload.spot)._replace(spot_id=SPOT_COUNT + 1)
+    benchmark(workload.walking_matrix.with_record, record)
+
+
+# ============= SERIALIZATION =============
+def test_parking_spot_to_dict(benchmark, workload):
+    benchmark(workload.spot.to_dict)
+
+
+def test_parking_spot_to_dict_all(benchmark, workload):
+    benchmark(lambda: [row.to_dict() for row in workload.spots])
+
+
+def test_spot_list_to_dict_json(benchmark, app, workload):
+    # The spot list body as it was built per request: to_dict() and Flask's encoder
+    records = workload.snapshot.records
+    benchmark(lambda: app.json.dumps({
+        'status': 'success', 'count': len(records), 'data': [record.to_dict() for record in records]
+    }).encode('utf-8'))
+
+
+def test_spot_list_fragments_cold(benchmark, workload):
+    from serialization import SpotFragments
+
+    benchmark(lambda: SpotFragments().many(workload.snapshot.records))
+
+
+@pytest.mark.parametrize('fields', [None, ('spot_id', 'cost', 'latitude', 'longitude')], ids=['all', 'map'])
+def test_spot_list_fragments(benchmark, workload, fields):
+    from serialization import spot_list_body
+
+    benchmark(spot_list_body, workload.snapshot, workload.snapshot.records, fields)
+
+
+# ============= SEARCH =============
+def test_search_index_build(benchmark, workload):
+    from search_index import build_search_index
+
+    benchmark(build_search_index, workload.snapshot)
+
+
+def test_search_uncached(benchmark, workload):
+    from search_index import build_search_index
+
+    search_index = build_search_index(workload.snapshot)
+
+    def search_uncached():
+        search_index._results.clear()
+        for query in SEARCH_QUERIES:
+            search_index.search(query)
+    benchmark(search_uncached)
+
+
+def test_search_cached(benchmark, workload):
+    from search_index import build_search_index
+
+    search_index = build_search_index(workload.snapshot)
+    benchmark(lambda: [search_index.search(query) for query in SEARCH_QUERIES])
+
+
+def test_search_endpoint(benchmark, client):
+    response = benchmark(client.get, '/api/search?q=ramp')
+    assert response.status_code == 200
@@ -0,0 +1,212 @@
+"""
+GeocodeQueue against a stand-in geocoder, and the shared rate limiter
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+import pytest
+from models import db, ParkingSpot, GeocodeCache
+from geocoding import GeocodeQueue, GeocodingError, NominatimGeocoder, SharedRateLimiter, normalize_address
+
+
+class StubGeocoder:
+    """
+    Answers from a dict of address -> list of outcomes, one per call (the
+    last one repeats); an outcome is a result dict, None or an exception
+    """
+
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def geocode(self, address):
+        with self._lock:
+            self.calls.append(address)
+            answers = self.outcomes[address]
+            outcome = answers.pop(0) if len(answers) > 1 else answers[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def spots(app):
+    """
+    Adds spots with an address and no coordinates: spots('1 Main St', ...) -> [spot_id, ...]
+    """
+    created = []
+
+    def add(*addresses):
+        with app.app_context():
+            rows = [ParkingSpot(spot_name=f'Geocode test {address}', address=address) for address in addresses]
+            db.session.add_all(rows)
+            db.session.commit()
+            created.extend(row.spot_id for row in rows)
+            return [row.spot_id for row in rows]
+
+    yield add
+    with app.app_context():
+        ParkingSpot.query.filter(ParkingSpot.spot_id.in_(created)).delete(synchronize_session=False)
+        GeocodeCache.query.delete()
+        db.session.commit()
+
+
+def make_queue(app, outcomes, max_attempts=3):
+    geocoder = StubGeocoder(outcomes)
+    queue = GeocodeQueue()
+    queue.init_app(app, geocoder=geocoder)
+    queue.limiter = SharedRateLimiter('geocoder-test', 1000)
+    queue.max_attempts = max_attempts
+    queue.backoff = 0.01
+    return queue, geocoder
+
+
+def coordinates(app, spot_id):
+    with app.app_context():
+        spot = db.session.get(ParkingSpot, spot_id)
+        return spot.latitude, spot.longitude
+
+
+def test_cached_address_skips_the_geocoder(app, spots):
+    spot_id, = spots('1 Cached Ave')
+    with app.app_context():
+        db.session.add(GeocodeCache(
+            address_key=normalize_address('1 Cached Ave'), address='1 Cached Ave',
+            latitude=44.9, longitude=-93.2, found=True
+        ))
+        db.session.commit()
+    queue, geocoder = make_queue(app, {})
+
+    queue.submit(spot_id, '1 Cached Ave')
+    assert queue.wait_until_idle(timeout=10)
+    assert geocoder.calls == []
+    assert coordinates(app, spot_id) == (44.9, -93.2)
+    assert queue.cache_hits == 1
+
+
+def test_submissions_for_one_address_are_merged(app, spots):
+    first, second = spots('2 Shared St', '2 shared   st')
+    queue, geocoder = make_queue(app, {'2 Shared St': [{'lat': 44.95, 'lon': -93.25}]})
+
+    # Held so the worker can't take the first before the second arrives
+    with queue._condition:
+        queue.submit(first, '2 Shared St')
+        queue.submit(second, '2 shared   st')
+        assert len(queue.pending) == 1
+    assert queue.wait_until_idle(timeout=10)
+
+    assert geocoder.calls == ['2 Shared St']
+    assert coordinates(app, first) == coordinates(app, second) == (44.95, -93.25)
+    with app.app_context():
+        assert db.session.get(GeocodeCache, normalize_address('2 Shared St')).found
+
+
+def test_failures_are_retried_with_backoff(app, spots):
+    spot_id, = spots('3 Flaky Rd')
+    queue, geocoder = make_queue(app, {'3 Flaky Rd': [
+        GeocodingError('503'), GeocodingError('timeout'), {'lat': 44.9, 'lon': -93.1}
+    ]}, max_attempts=5)
+
+    started = time.monotonic()
+    queue.submit(spot_id, '3 Flaky Rd')
+    assert queue.wait_until_idle(timeout=10)
+
+    assert len(geocoder.calls) == 3
+    # Backoff of 0.01 ** attempts can't be measured, only that it didn't hang
+    assert time.monotonic() - started < 5
+    assert coordinates(app, spot_id) == (44.9, -93.1)
+
+
+def test_gives_up_after_max_attempts(app, spots):
+    spot_id, = spots('4 Broken Way')
+    queue, geocoder = make_queue(app, {'4 Broken Way': [GeocodingError('503')]}, max_attempts=3)
+
+    queue.submit(spot_id, '4 Broken Way')
+    assert queue.wait_until_idle(timeout=10)
+
+    assert len(geocoder.calls) == 3
+    assert not queue.pending
+    assert coordinates(app, spot_id) == (None, None)
+
+
+def test_failed_batch_counts_one_attempt_per_item(app, spots):
+    flaky, broken = spots('5 Flaky Rd', '6 Crash Ct')
+    queue, geocoder = make_queue(app, {
+        '5 Flaky Rd': [GeocodingError('503'), {'lat': 44.9, 'lon': -93.1}],
+        # Not a GeocodingError, so it fails the whole batch
+        '6 Crash Ct': [RuntimeError('boom'), {'lat': 44.8, 'lon': -93.0}]
+    }, max_attempts=2)
+
+    with queue._condition:
+        queue.submit(flaky, '5 Flaky Rd')
+        queue.submit(broken, '6 Crash Ct')
+    assert queue.wait_until_idle(timeout=10)
+
+    # The first batch failing cost '5 Flaky Rd' one attempt, not two, so it got its second try
+    assert geocoder.calls.count('5 Flaky Rd') == 2
+    assert coordinates(app, flaky) == (44.9, -93.1)
+    assert coordinates(app, broken) == (44.8, -93.0)
+
+
+def test_rate_limit_is_shared_between_limiters(app_context):
+    # Two limiters with the same name stand in for two worker processes
+    first = SharedRateLimiter('geocoder-shared-test', 20)
+    second = SharedRateLimiter('geocoder-shared-test', 20)
+
+    slots = sorted(limiter.reserve() for limiter in (first, second, first, second, first))
+    gaps = [later - earlier for earlier, later in zip(slots, slots[1:])]
+    assert min(gaps) == pytest.approx(0.05, abs=1e-6)
+
+
+# ============= NOMINATIM RESPONSES =============
+class StubNominatim(BaseHTTPRequestHandler):
+    """
+    Answers 200 with each of bodies in turn (the last one repeats)
+    """
+    bodies = []
+
+    def do_GET(self):
+        body = StubNominatim.bodies.pop(0) if len(StubNominatim.bodies) > 1 else StubNominatim.bodies[0]
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def nominatim_url(stub_server):
+    return stub_server(StubNominatim)
+
+
+@pytest.mark.parametrize('body', [
+    b'<html><body>Service temporarily unavailable</body></html>',
+    b'[{"lat": "44.97", "lon": "-93.2',
+    b'[{"lat": "44.97"}]',
+    b'[{"lat": null, "lon": "-93.23"}]',
+    b'{"error": "Unable to geocode"}',
+], ids=['html', 'truncated', 'missing_key', 'null', 'object'])
+def test_malformed_responses_are_retryable(nominatim_url, body):
+    StubNominatim.bodies = [body]
+    geocoder = NominatimGeocoder(nominatim_url, 'parkandgo-tests', timeout=2)
+
+    with pytest.raises(GeocodingError):
+        geocoder.geocode('7 Garbled Ln')
+
+
+def test_queue_retries_after_a_malformed_response(app, spots, nominatim_url):
+    spot_id, = spots('8 Garbled Ln')
+    StubNominatim.bodies = [b'<html>502 Bad Gateway</html>', b'[{"lat": "44.91", "lon": "-93.11"}]']
+    queue = GeocodeQueue()
+    queue.init_app(app, geocoder=NominatimGeocoder(nominatim_url, 'parkandgo-tests', timeout=2))
+    queue.limiter = SharedRateLimiter('geocoder-test', 1000)
+    queue.backoff = 0.01
+
+    queue.submit(spot_id, '8 Garbled Ln')
+    assert queue.wait_until_idle(timeout=10)
+    assert coordinates(app, spot_id) == (44.91, -93.11)
+    assert StubNominatim.bodies == [b'[{"lat": "44.91", "lon": "-93.11"}]']
@@ -0,0 +1,44 @@
+"""
+Replaying every migration on an empty database
+"""
+import pytest
+from sqlalchemy import create_engine, inspect
+import migrations
+from migrations import upgrade, current_version, MIGRATIONS
+from models import db
+
+
+@pytest.fixture
+def empty_engine(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path}/migrations.db')
+    yield engine
+    engine.dispose()
+
+
+def columns(engine, table):
+    return {column['name'] for column in inspect(engine).get_columns(table)}
+
+
+def test_baseline_is_the_schema_before_migrations(empty_engine, monkeypatch):
+    monkeypatch.setattr(migrations, 'MIGRATIONS', MIGRATIONS[:1])
+    upgrade(empty_engine)
+
+    tables = set(inspect(empty_engine).get_table_names())
+    assert {'users', 'parking_spots', 'major_campus_mapping', 'spot_data_version'} <= tables
+    # Added by later migrations, not by the baseline
+    assert not tables & {'geocode_cache', 'spot_occupancy', 'rate_limits'}
+    assert not columns(empty_engine, 'parking_spots') & {'source', 'source_id'}
+
+
+def test_replay_builds_the_models_schema(empty_engine):
+    applied = upgrade(empty_engine)
+    assert [version for version, _ in applied] == [version for version, _, _ in MIGRATIONS]
+    assert current_version(empty_engine) == MIGRATIONS[-1][0]
+
+    for table in db.metadata.sorted_tables:
+        assert columns(empty_engine, table.name) == set(table.columns.keys()), table.name
+        indexes = {index['name'] for index in inspect(empty_engine).get_indexes(table.name)}
+        assert {index.name for index in table.indexes} <= indexes, table.name
+
+    # Nothing left to apply
+    assert upgrade(empty_engine) == []
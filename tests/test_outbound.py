@@ -0,0 +1,129 @@
+"""
+OutboundClient against a local stub HTTP server: deadlines, circuit
+breakers and the limits on concurrent calls
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+import pytest
+from outbound import OutboundPool, CircuitOpenError, DeadlineExceeded, HostBusyError
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers ?status= (default 200) after ?delay= seconds (default 0)
+    """
+    requests = []
+
+    def do_GET(self):
+        params = parse_qs(urlsplit(self.path).query)
+        StubHandler.requests.append(self.path)
+        time.sleep(float(params.get('delay', ['0'])[0]))
+        body = b'{"ok": true}'
+        self.send_response(int(params.get('status', ['200'])[0]))
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def server(stub_server):
+    return stub_server(StubHandler)
+
+
+@pytest.fixture
+def pool():
+    StubHandler.requests = []
+    pool = OutboundPool()
+    pool.failure_threshold = 2
+    pool.reset_timeout = 0.2
+    return pool
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out waiting'
+        time.sleep(0.01)
+
+
+def test_deadline_bounds_a_slow_response(server, pool):
+    # The socket timeout alone would wait up to 5s for this
+    client = pool.client('stub', timeout=5, deadline=0.3)
+
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        client.get(server + '?delay=1')
+    assert time.monotonic() - started < 0.8
+    assert client.get(server).status_code == 200
+
+
+def test_breaker_opens_probes_and_closes(server, pool):
+    client = pool.client('stub', timeout=2)
+
+    # 5xx responses are returned to the caller but count as failures
+    assert client.get(server + '?status=503').status_code == 503
+    assert client.get(server + '?status=503').status_code == 503
+    assert client.breaker.is_open
+
+    # Open: rejected without reaching the server
+    sent = len(StubHandler.requests)
+    with pytest.raises(CircuitOpenError):
+        client.get(server)
+    assert len(StubHandler.requests) == sent
+
+    # Half-open after reset_timeout: one probe goes through; a failed probe keeps it open
+    time.sleep(0.25)
+    assert client.get(server + '?status=500').status_code == 500
+    with pytest.raises(CircuitOpenError):
+        client.get(server)
+
+    # A successful probe closes it again
+    time.sleep(0.25)
+    assert client.get(server).status_code == 200
+    assert not client.breaker.is_open
+    assert client.get(server).status_code == 200
+
+
+def test_host_limit_rejects_calls_past_it(server, pool):
+    pool.host_limit = 1
+    client = pool.client('stub', timeout=2, deadline=0.3)
+
+    slow = threading.Thread(target=client.get, args=(server + '?delay=1',), kwargs={'deadline': 2})
+    slow.start()
+    wait_for(lambda: client.in_flight == 1)
+
+    started = time.monotonic()
+    with pytest.raises(HostBusyError):
+        client.get(server)
+    assert time.monotonic() - started < 0.8
+    slow.join()
+
+    # The slot comes back once the slow call ends
+    assert client.get(server).status_code == 200
+    assert client.in_flight == 0
+
+
+def test_saturated_worker_pool_fails_calls_at_their_deadline(server, pool):
+    pool.max_workers = 1
+    client = pool.client('stub', timeout=2, deadline=0.3)
+
+    slow = threading.Thread(target=client.get, args=(server + '?delay=1',), kwargs={'deadline': 2})
+    slow.start()
+    wait_for(lambda: len(StubHandler.requests) == 1)
+
+    # Queued behind the slow call on the only pool thread
+    started = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        client.get(server)
+    assert time.monotonic() - started < 0.8
+    slow.join()
+
+    # The abandoned call never ran, and its slot was released when it was cancelled
+    assert len(StubHandler.requests) == 1
+    wait_for(lambda: client.in_flight == 0)
@@ -0,0 +1,249 @@
+"""
+Query plans of the SQL the app sends on its hot paths
+Each test runs the real code path, captures the statements it sends and
+EXPLAINs them against seeded tables, so a dropped index or a query change
+that stops using one fails here instead of in production.
+"""
+import json
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event, insert, text
+from models import db, ParkingSpot, SpotOccupancy, GeocodeCache
+from geocoding import normalize_address
+from spot_cache import spot_cache, bump_spot_data_version
+
+
+SPOT_ROWS = 20000
+OCCUPANCY_ROWS = 5000
+GEOCODE_ROWS = 5000
+
+
+@pytest.fixture(scope='module')
+def seeded(app):
+    """
+    Tables large enough that the planner prefers an index whenever one applies
+    """
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    with app.app_context():
+        connection = db.session.connection()
+        connection.execute(insert(ParkingSpot.__table__), [
+            {
+                'spot_name': f'Spot {i}',
+                'campus_location': f'Campus {i % 20}',
+                'parking_type': f'Parking Type {i % 10}',
+                'cost': round(rng.uniform(0, 20), 2),
+                'address': f'{i} Oak Street, Minneapolis, MN',
+                'latitude': 44.97 + rng.uniform(-0.05, 0.05),
+                'longitude': -93.23 + rng.uniform(-0.05, 0.05),
+                'is_verified': rng.random() < 0.5
+            }
+            for i in range(SPOT_ROWS)
+        ])
+        spot_ids = [row[0] for row in connection.execute(text('SELECT spot_id FROM parking_spots'))]
+        connection.execute(insert(SpotOccupancy.__table__), [
+            {
+                'spot_id': spot_id,
+                'occupancy': rng.random(),
+                'weight': 1.0,
+                'updated_at': now - timedelta(hours=rng.uniform(0, 48)),
+                'written_at': now - timedelta(hours=rng.uniform(0, 48))
+            }
+            for spot_id in spot_ids[:OCCUPANCY_ROWS]
+        ])
+        connection.execute(insert(GeocodeCache.__table__), [
+            {
+                'address_key': normalize_address(f'{i} Oak Street, Minneapolis, MN'),
+                'address': f'{i} Oak Street, Minneapolis, MN',
+                'latitude': 44.97,
+                'longitude': -93.23,
+                'found': True,
+                'updated_at': now
+            }
+            for i in range(GEOCODE_ROWS)
+        ])
+        connection.execute(text('ANALYZE'))
+        # Like any other write to parking_spots, so no snapshot outlives these rows
+        bump_spot_data_version()
+        db.session.commit()
+        spot_cache.invalidate()
+    yield
+    with app.app_context():
+        for table in ('spot_occupancy', 'geocode_cache', 'parking_spots'):
+            db.session.execute(text(f'DELETE FROM {table}'))
+        bump_spot_data_version()
+        db.session.commit()
+        spot_cache.invalidate()
+
+
+@contextmanager
+def captured_sql(engine):
+    """
+    Collects (statement, parameters) for every statement sent while active
+    """
+    statements = []
+
+    def record(connection, cursor, statement, parameters, context, executemany):
+        if not executemany:
+            statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def selects_from(statements, table):
+    return [
+        (statement, parameters) for statement, parameters in statements
+        if statement.lstrip().upper().startswith('SELECT') and f'FROM {table}' in statement
+    ]
+
+
+def explain(statement, parameters):
+    """
+    Plan lines for a captured statement: SQLite's EXPLAIN QUERY PLAN details,
+    or "<node type> on <table> [using <index>]" on PostgreSQL
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {statement}', parameters).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        lines = []
+        stack = [plan[0]['Plan']]
+        while stack:
+            node = stack.pop()
+            line = node['Node Type']
+            if node.get('Relation Name'):
+                line += f" on {node['Relation Name']}"
+            if node.get('Index Name'):
+                line += f" using {node['Index Name']}"
+            lines.append(line)
+            stack.extend(node.get('Plans', []))
+        return lines
+    return [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters)]
+
+
+def full_scans(plan, table):
+    """
+    Plan lines that read the whole of table
+    """
+    return [
+        line for line in plan
+        if line == f'Seq Scan on {table}' or (line.startswith(f'SCAN {table}') and 'INDEX' not in line)
+    ]
+
+
+def uses_index(plan, index):
+    return any(index in line for line in plan)
+
+
+def reads_in_primary_key_order(plan, table):
+    """
+    The table is walked along its primary key with no sort: on SQLite a plain
+    scan of the rowid table (an INTEGER PRIMARY KEY is the rowid), on
+    PostgreSQL an index scan of <table>_pkey
+    """
+    if any('TEMP B-TREE' in line or line.startswith('Sort') for line in plan):
+        return False
+    return any(
+        line == f'SCAN {table}' or line.startswith(f'Index Scan on {table} using {table}_pkey')
+        or line.startswith(f'Index Only Scan on {table} using {table}_pkey')
+        for line in plan
+    )
+
+
+# ============= SPOT SNAPSHOT =============
+def test_snapshot_load_is_one_query(app_context, seeded):
+    with captured_sql(db.engine) as statements:
+        snapshot = spot_cache.refresh()
+    assert len(snapshot) >= SPOT_ROWS
+
+    # Every spot in one statement, read in primary key order without a sort
+    spot_queries = selects_from(statements, 'parking_spots')
+    assert len(spot_queries) == 1
+    plan = explain(*spot_queries[0])
+    assert reads_in_primary_key_order(plan, 'parking_spots'), plan
+
+
+def test_staleness_check_reads_only_the_version_row(app_context, seeded):
+    snapshot = spot_cache.get()
+    snapshot.checked_at = time.monotonic() - spot_cache.max_staleness - 1
+    with captured_sql(db.engine) as statements:
+        assert spot_cache.get() is snapshot
+
+    assert not selects_from(statements, 'parking_spots')
+    version_queries = selects_from(statements, 'spot_data_version')
+    assert len(version_queries) == 1
+    plan = explain(*version_queries[0])
+    assert not full_scans(plan, 'spot_data_version'), plan
+
+
+# ============= OCCUPANCY =============
+@pytest.mark.parametrize('pulled_until, index', [
+    (None, 'ix_spot_occupancy_updated_at'),
+    (datetime.utcnow() - timedelta(minutes=5), 'ix_spot_occupancy_written_at'),
+])
+def test_occupancy_pull_uses_an_index(app, app_context, seeded, pulled_until, index):
+    from occupancy import OccupancyTracker
+
+    tracker = OccupancyTracker()
+    tracker.init_app(app)
+    tracker.pulled_until = pulled_until
+    with captured_sql(db.engine) as statements:
+        tracker.flush()
+
+    pulls = selects_from(statements, 'spot_occupancy')
+    assert len(pulls) == 1
+    plan = explain(*pulls[0])
+    assert not full_scans(plan, 'spot_occupancy'), plan
+    assert uses_index(plan, index), plan
+
+
+# ============= PARKING SPOT INDEXES =============
+# Every index on parking_spots and the test that shows a query using it;
+# reads are served from the snapshot, so any other index is write overhead
+PARKING_SPOT_INDEXES = {
+    'ix_parking_spots_source_key': 'tests/test_spot_import.py (ON CONFLICT target)',
+    'ix_parking_spots_ungeocoded': 'test_spots_waiting_on_geocoding_use_partial_index',
+}
+
+
+def test_parking_spots_has_no_unused_indexes(app_context):
+    from sqlalchemy import inspect
+
+    indexes = {index['name'] for index in inspect(db.engine).get_indexes('parking_spots')}
+    assert indexes == set(PARKING_SPOT_INDEXES)
+
+
+def test_spots_waiting_on_geocoding_use_partial_index(app_context, seeded):
+    from geocoding import geocode_queue
+
+    with captured_sql(db.engine) as statements:
+        assert geocode_queue.submit_missing() == 0
+
+    lookups = selects_from(statements, 'parking_spots')
+    assert len(lookups) == 1
+    plan = explain(*lookups[0])
+    assert not full_scans(plan, 'parking_spots'), plan
+    assert uses_index(plan, 'ix_parking_spots_ungeocoded'), plan
+
+
+# ============= GEOCODING =============
+def test_geocode_cache_lookup_uses_primary_key(app_context, seeded):
+    from geocoding import geocode_queue
+
+    keys = [normalize_address(f'{i} Oak Street, Minneapolis, MN') for i in (1, 2, 3)]
+    with captured_sql(db.engine) as statements:
+        cached = geocode_queue._cached(keys)
+    assert set(cached) == set(keys)
+
+    lookups = selects_from(statements, 'geocode_cache')
+    assert len(lookups) == 1
+    plan = explain(*lookups[0])
+    assert not full_scans(plan, 'geocode_cache'), plan
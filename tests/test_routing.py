@@ -0,0 +1,225 @@
+"""
+Route caching and OSRM failures, against a local stand-in OSRM server
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from math import cos, radians
+import pytest
+from models import db, ParkingSpot
+from routing import OSRMClient, RouteCache, RoutingError, route_service, snap_origin, METERS_PER_DEGREE
+
+
+class StubOSRM(BaseHTTPRequestHandler):
+    """
+    Answers /route/v1/{profile}/{lon,lat;lon,lat} the way OSRM does, or fails as told by behavior:
+    'ok', 'no_route', 'error' (503) or 'slow' (1s before answering)
+    """
+    behavior = 'ok'
+    requests = []
+
+    def do_GET(self):
+        StubOSRM.requests.append(self.path)
+        behavior = StubOSRM.behavior
+        if behavior == 'slow':
+            time.sleep(1)
+        if behavior == 'error':
+            status, body = 503, {'message': 'overloaded'}
+        elif behavior == 'no_route':
+            status, body = 400, {'code': 'NoRoute', 'message': 'Impossible route between points'}
+        else:
+            start, end = self.path.split('?')[0].rsplit('/', 1)[1].split(';')
+            status, body = 200, {'code': 'Ok', 'routes': [{
+                'distance': 1234.5,
+                'duration': 321.0,
+                'geometry': {
+                    'type': 'LineString',
+                    'coordinates': [[float(v) for v in start.split(',')], [float(v) for v in end.split(',')]]
+                }
+            }]}
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def osrm_url(stub_server):
+    return stub_server(StubOSRM)
+
+
+@pytest.fixture
+def osrm(osrm_url):
+    StubOSRM.behavior = 'ok'
+    StubOSRM.requests = []
+    return OSRMClient(osrm_url, timeout=2, deadline=0.3)
+
+
+def meters_between(a, b):
+    lat_m = (a[0] - b[0]) * METERS_PER_DEGREE
+    lon_m = (a[1] - b[1]) * METERS_PER_DEGREE * cos(radians(a[0]))
+    return (lat_m ** 2 + lon_m ** 2) ** 0.5
+
+
+# ============= SNAPPING =============
+def test_nearby_origins_share_a_cell():
+    origin = (44.97310, -93.23510)
+    snapped = snap_origin(*origin, 100)
+    # Every point in a cell snaps to its center, at most half a diagonal away
+    assert meters_between(origin, snapped) <= 100 * 2 ** 0.5 / 2 + 1
+    for lat_offset, lon_offset in ((0.0001, 0), (0, 0.0001), (-0.0001, -0.0001)):
+        point = (origin[0] + lat_offset, origin[1] + lon_offset)
+        if meters_between(point, snapped) < 30:
+            assert snap_origin(*point, 100) == snapped
+    # A block away is another cell
+    assert snap_origin(origin[0] + 0.002, origin[1], 100) != snapped
+    # Snapping a center again keeps it
+    assert snap_origin(*snapped, 100) == snapped
+
+
+def test_cells_stay_grid_sized_away_from_the_equator():
+    # Longitude degrees shrink toward the poles; neighbouring cell centers should still be ~100 m apart
+    for lat in (0.5, 44.97, 60.5):
+        center = snap_origin(lat, 10.0, 100)
+        east = snap_origin(center[0], center[1] + 100 / (METERS_PER_DEGREE * cos(radians(center[0]))), 100)
+        north = snap_origin(center[0] + 100 / METERS_PER_DEGREE, center[1], 100)
+        assert meters_between(center, east) == pytest.approx(100, abs=1)
+        assert north[0] - center[0] == pytest.approx(100 / METERS_PER_DEGREE, abs=1e-5)
+
+
+# ============= SINGLE FLIGHT =============
+def run_concurrently(count, target):
+    results = [None] * count
+    errors = [None] * count
+
+    def run(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            errors[index] = e
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_misses_share_one_call():
+    cache = RouteCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.2)
+        return {'distance': 1.0}
+
+    results, errors = run_concurrently(8, lambda: cache.get_or_compute('key', (44.9, -93.2), compute))
+    assert errors == [None] * 8
+    assert len(calls) == 1
+    assert all(route == {'distance': 1.0} for route, _ in results)
+    assert [was_cached for _, was_cached in results].count(False) == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_waiters_retry_when_the_shared_call_fails():
+    cache = RouteCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        if len(calls) == 1:
+            raise RoutingError('OSRM returned 503')
+        return {'distance': 2.0}
+
+    results, errors = run_concurrently(6, lambda: cache.get_or_compute('key', (44.9, -93.2), compute))
+    # Only the caller whose call failed sees the error, one retry serves the rest
+    assert sum(isinstance(error, RoutingError) for error in errors) == 1
+    assert len(calls) == 2
+    assert sum(result is not None and result[0] == {'distance': 2.0} for result in results) == 5
+
+
+def test_moved_destination_is_routed_again():
+    cache = RouteCache()
+    assert cache.get_or_compute('key', (44.9, -93.2), lambda: 'old') == ('old', False)
+    assert cache.get_or_compute('key', (44.9, -93.2), lambda: 'unused') == ('old', True)
+    assert cache.get_or_compute('key', (45.0, -93.2), lambda: 'new') == ('new', False)
+
+
+# ============= OSRM FAILURES =============
+def test_osrm_client_against_stand_in(osrm):
+    route = osrm.route('car', (44.97, -93.23), (44.98, -93.24))
+    assert route['distance'] == 1234.5
+    # OSRM takes lon,lat
+    assert route['geometry']['coordinates'][0] == [-93.23, 44.97]
+
+    StubOSRM.behavior = 'no_route'
+    assert osrm.route('car', (44.97, -93.23), (44.98, -93.24)) is None
+
+
+@pytest.mark.parametrize('behavior', ['error', 'slow'])
+def test_osrm_failures_raise_routing_error(osrm, behavior):
+    StubOSRM.behavior = behavior
+    started = time.monotonic()
+    with pytest.raises(RoutingError):
+        osrm.route('foot', (44.97, -93.23), (44.98, -93.24))
+    # A slow server is cut off at the client's deadline
+    assert time.monotonic() - started < 0.8
+
+
+@pytest.fixture
+def routed_spot(app, osrm):
+    """
+    A spot with coordinates, and route_service pointed at the stand-in with an empty cache
+    """
+    from spot_cache import spot_cache
+
+    client, cache = route_service.client, route_service.cache
+    route_service.client = osrm
+    route_service.cache = RouteCache()
+    with app.app_context():
+        spot = ParkingSpot(spot_name='Route test lot', latitude=44.975, longitude=-93.235, cost=1.0)
+        db.session.add(spot)
+        db.session.commit()
+        spot_id = spot.spot_id
+        spot_cache.refresh()
+    yield spot_id
+    route_service.client, route_service.cache = client, cache
+    with app.app_context():
+        db.session.delete(db.session.get(ParkingSpot, spot_id))
+        db.session.commit()
+        spot_cache.refresh()
+
+
+def test_route_endpoint_answers_502_until_osrm_recovers(client, routed_spot):
+    url = f'/api/route?from=44.9731,-93.2351&to={routed_spot}&mode=walking'
+
+    for behavior in ('error', 'slow'):
+        StubOSRM.behavior = behavior
+        started = time.monotonic()
+        response = client.get(url)
+        assert response.status_code == 502
+        assert response.json['status'] == 'error'
+        assert time.monotonic() - started < 0.8
+
+    # Failures aren't cached: the next request asks again and gets the route
+    StubOSRM.behavior = 'ok'
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.json['data']['cached'] is False
+
+    # Once cached, an OSRM outage doesn't matter for this cell and spot
+    StubOSRM.behavior = 'error'
+    sent = len(StubOSRM.requests)
+    response = client.get('/api/route?from=44.97312,-93.23508&to=%d&mode=walking' % routed_spot)
+    assert response.status_code == 200
+    assert response.json['data']['cached'] is True
+    assert len(StubOSRM.requests) == sent
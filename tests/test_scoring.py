@@ -0,0 +1,209 @@
+"""
+SpotScoringEngine against calculate_spot_score, the scalar reference it mirrors
+"""
+import random
+import pytest
+from models import db, ParkingSpot, User, MajorCampusMapping
+from occupancy import OccupancySnapshot
+
+
+SPOT_COUNT = 3000
+MAJOR = 'Computer Science'
+# Few distinct costs so ties are common, None included
+COSTS = [None, 0, 1.5, 2.5, 5]
+TYPES = [None, 'Parking Garage', 'Surface Lot', 'Street Parking']
+BUILDINGS = [None, 'Walter Library', 'Keller Hall', 'Coffman Union', 'Carlson School of Management', 'Fulton Hall']
+
+
+# ============= FIXTURES =============
+def synthetic_records(count, seed=3):
+    """
+    SpotRecords with repeated costs, missing coordinates and exact duplicates
+    """
+    from spot_cache import SpotRecord
+
+    rng = random.Random(seed)
+    records = []
+    for spot_id in range(1, count + 1):
+        if records and rng.random() < 0.05:
+            # Same spot listed twice, every score term ties
+            records.append(rng.choice(records)._replace(spot_id=spot_id))
+            continue
+        located = rng.random() >= 0.1
+        building = rng.choice(BUILDINGS)
+        records.append(SpotRecord.from_model(ParkingSpot(
+            spot_id=spot_id,
+            spot_name=f'Spot {spot_id}',
+            campus_location=rng.choice(['East Bank', 'West Bank']),
+            parking_type=rng.choice(TYPES),
+            cost=rng.choice(COSTS),
+            near_buildings=building,
+            latitude=44.97 + rng.uniform(-0.03, 0.03) if located else None,
+            longitude=-93.23 + rng.uniform(-0.04, 0.04) if located else None,
+            is_verified=rng.random() < 0.5
+        )))
+    return records
+
+
+@pytest.fixture(scope='module')
+def scoring(app):
+    """
+    Synthetic records, their walking matrix and an engine over all of them
+    """
+    from types import SimpleNamespace
+    from spot_cache import SpotSnapshot
+    from buildings import build_walking_matrix
+    from scoring import SpotScoringEngine
+
+    records = synthetic_records(SPOT_COUNT)
+    with app.app_context():
+        mapping = MajorCampusMapping(
+            major_name=MAJOR, major_category='STEM', primary_campus='East Bank',
+            common_buildings='Keller Hall, Walter Library'
+        )
+        db.session.add(mapping)
+        db.session.commit()
+        walking_matrix = build_walking_matrix(SpotSnapshot(1, records))
+        db.session.delete(mapping)
+        db.session.commit()
+
+    rng = random.Random(5)
+    occupancy = OccupancySnapshot(1, {
+        record.spot_id: (rng.choice([0.0, 0.25, 0.5, 1.0]), 1.0, 0)
+        for record in records if rng.random() < 0.3
+    })
+    return SimpleNamespace(
+        records=records,
+        walking_matrix=walking_matrix,
+        engine=SpotScoringEngine(records, walking_matrix),
+        occupancy=occupancy
+    )
+
+
+USERS = {
+    'complete': dict(major=MAJOR, grade_level='Senior', housing_type='Commuter',
+                     preferred_parking_types='Parking Garage,Surface Lot'),
+    # No housing type, so preferences don't count
+    'incomplete': dict(major=MAJOR, grade_level='Senior', preferred_parking_types='Parking Garage'),
+    'no_major': dict(grade_level='Junior', housing_type='On-Campus', preferred_parking_types='Street Parking'),
+}
+
+
+def make_user(profile):
+    return User(user_id=1, email='score@example.com', first_name='Score', last_name='Test', **USERS[profile])
+
+
+def reference_top_k(scoring, user, lat, lon, selected, occupancy, k):
+    from app import calculate_spot_score
+
+    return sorted(scoring.records, key=lambda record: calculate_spot_score(
+        record, user, lat, lon, selected, scoring.walking_matrix, occupancy
+    ), reverse=True)[:k]
+
+
+# ============= TESTS =============
+@pytest.mark.parametrize('profile', list(USERS))
+@pytest.mark.parametrize('with_occupancy', [False, True], ids=['no_occupancy', 'occupancy'])
+@pytest.mark.parametrize('origin', [(44.975, -93.234), (44.99, -93.26), (None, None)], ids=['campus', 'edge', 'no_origin'])
+def test_top_k_matches_reference(scoring, profile, with_occupancy, origin):
+    user = make_user(profile)
+    occupancy = scoring.occupancy if with_occupancy else OccupancySnapshot(0, {})
+    lat, lon = origin
+
+    best = reference_top_k(scoring, user, lat, lon, None, occupancy, 1)[0]
+    # No selection, then the spot that would otherwise come first
+    for selected in (None, best.spot_id):
+        expected = reference_top_k(scoring, user, lat, lon, selected, occupancy, 10)
+        actual = scoring.engine.top_k(user, lat, lon, selected, k=10, occupancy=occupancy)
+        assert [record.spot_id for record in actual] == [record.spot_id for record in expected]
+
+
+def batch_queries(scoring):
+    """
+    (user_lat, user_lon, selected_spot_id, nearby_only) covering ties: origins
+    on top of spots (some listed twice), no origin, and far from campus
+    """
+    rng = random.Random(9)
+    located = [record for record in scoring.records if record.latitude is not None]
+    queries = []
+    for _ in range(40):
+        spot = rng.choice(located)
+        queries.append((spot.latitude, spot.longitude, rng.choice([None, spot.spot_id]), rng.random() < 0.5))
+    for _ in range(20):
+        queries.append((44.97 + rng.uniform(-0.04, 0.04), -93.23 + rng.uniform(-0.05, 0.05),
+                        rng.choice([None, rng.choice(located).spot_id]), rng.random() < 0.5))
+    queries += [(None, None, None, False), (None, None, located[0].spot_id, True), (45.05, -93.23, None, True)]
+    return queries
+
+
+@pytest.mark.parametrize('k', [1, 3, 10])
+def test_batch_shortlists_match_single(scoring, k):
+    from spot_cache import SpotSnapshot
+    from spatial import build_spatial_index
+    from scoring import MAX_DISTANCE
+
+    engine = scoring.engine
+    user = make_user('complete')
+    spatial_index = build_spatial_index(SpotSnapshot(1, scoring.records))
+    queries = batch_queries(scoring)
+
+    def candidates(lat, lon, nearby_only):
+        if not nearby_only or lat is None:
+            return None
+        return engine.candidate_positions(record for _, record in spatial_index.within(lat, lon, MAX_DISTANCE))
+
+    batch = engine.shortlists(
+        user, [query[:3] for query in queries], k=k,
+        candidates=[candidates(lat, lon, nearby_only) for lat, lon, _, nearby_only in queries],
+        chunk_size=7
+    )
+    assert len(batch) == len(queries)
+    for (lat, lon, selected, nearby_only), shortlist in zip(queries, batch):
+        single = engine.shortlist(user, lat, lon, selected, k=k, candidates=candidates(lat, lon, nearby_only))
+        assert shortlist.positions.tolist() == single.positions.tolist()
+        # Bitwise, so cached shortlists rank the same whichever endpoint stored them
+        assert shortlist.scores.tolist() == single.scores.tolist()
+        assert shortlist.floor == single.floor
+        assert engine.rank(shortlist, k, scoring.occupancy) == engine.rank(single, k, scoring.occupancy)
+
+
+@pytest.mark.parametrize('k', [1, 3, 10])
+@pytest.mark.parametrize('full', [1, 3, 80], ids=lambda full: f'{full}x_k_full')
+def test_rank_applies_occupancy_like_top_k(scoring, k, full):
+    engine = scoring.engine
+    user = make_user('complete')
+    for version, (lat, lon, selected, _) in enumerate(batch_queries(scoring)[::4], start=100):
+        shortlist = engine.shortlist(user, lat, lon, selected, k=k)
+        # The spots that rank first now are reported full
+        leaders = engine.top_k(user, lat, lon, selected, k=full * k)
+        occupancy = OccupancySnapshot(version, {record.spot_id: (1.0, 1.0, 0) for record in leaders})
+
+        expected = engine.top_k(user, lat, lon, selected, k=k, occupancy=occupancy)
+        ranked = engine.rank(shortlist, k, occupancy)
+        if ranked is None:
+            # Only when the answer reaches down to spots the shortlist left out
+            scores = engine.score(user, lat, lon, selected, occupancy=occupancy)
+            assert scores[engine.positions[expected[-1].spot_id]] <= shortlist.floor
+        else:
+            assert [record.spot_id for record in ranked] == [record.spot_id for record in expected]
+
+
+def test_unplaced_building_is_reported_once(app, scoring, caplog):
+    from spot_cache import SpotSnapshot
+    from buildings import build_walking_matrix
+
+    with app.app_context():
+        mapping = MajorCampusMapping(major_name='Astronomy', common_buildings='Tate Lab, Nowhere Observatory')
+        db.session.add(mapping)
+        db.session.commit()
+        try:
+            for version in (1, 2):
+                walking_matrix = build_walking_matrix(SpotSnapshot(version, scoring.records))
+        finally:
+            db.session.delete(mapping)
+            db.session.commit()
+
+    assert 'Nowhere Observatory' not in walking_matrix.building_names
+    assert [record.getMessage() for record in caplog.records if 'Nowhere Observatory' in record.getMessage()] == [
+        "No coordinates for building 'Nowhere Observatory', leaving it out of the walking matrix"
+    ]
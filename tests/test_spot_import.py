@@ -0,0 +1,111 @@
+"""
+Bulk spot import with each write method
+COPY only runs on PostgreSQL with psycopg2, so its tests are skipped unless
+TEST_DATABASE_URL points at one.
+"""
+import io
+import pytest
+from models import db, ParkingSpot
+from spot_import import import_spots, SpotImportError
+
+
+SOURCE = 'import-test'
+
+CSV_HEADER = 'id,name,lat,lon,rate,address,near_buildings,walk_time,verified\n'
+
+# Values COPY's CSV format could mistake for NULLs, quotes or row breaks
+TRICKY_CSV = CSV_HEADER + (
+    '1,"Oak St, north side",44.97,-93.23,1.5,"12 ""Old"" Oak St",,5 min,yes\n'
+    '2,\\N,44.98,-93.24,,,"Walter Library\nCoffman Union",,no\n'
+    '3,Café Lot,44.99,-93.25,0,,"",,\n'
+    '4,"",44.96,-93.22,2,,,,true\n'
+)
+
+
+def copy_supported():
+    return db.engine.dialect.name == 'postgresql' and db.engine.dialect.driver == 'psycopg2'
+
+
+@pytest.fixture(params=['executemany', 'copy'])
+def method(request, app_context):
+    if request.param == 'copy' and not copy_supported():
+        pytest.skip('COPY needs PostgreSQL with psycopg2, set TEST_DATABASE_URL')
+    yield request.param
+    ParkingSpot.query.filter_by(source=SOURCE).delete()
+    db.session.commit()
+
+
+def imported():
+    rows = ParkingSpot.query.filter_by(source=SOURCE).order_by(ParkingSpot.source_id).all()
+    return {
+        row.source_id: (row.spot_name, row.latitude, row.longitude, row.cost, row.address,
+                        row.near_buildings, row.walk_time, row.is_verified)
+        for row in rows
+    }
+
+
+def test_values_round_trip(method):
+    result = import_spots(io.StringIO(TRICKY_CSV), SOURCE, batch_size=3, method=method)
+    assert result.rows_written == 4 and result.rows_rejected == 0
+
+    assert imported() == {
+        '1': ('Oak St, north side', 44.97, -93.23, 1.5, '12 "Old" Oak St', None, '5 min', True),
+        '2': ('\\N', 44.98, -93.24, None, None, 'Walter Library\nCoffman Union', None, False),
+        '3': ('Café Lot', 44.99, -93.25, 0.0, None, None, None, False),
+        # No name falls back to the source and id
+        '4': (f'{SOURCE} 4', 44.96, -93.22, 2.0, None, None, None, True),
+    }
+
+
+def test_reimport_updates_in_place(method):
+    import_spots(io.StringIO(TRICKY_CSV), SOURCE, method=method)
+    ids = {row.source_id: row.spot_id for row in ParkingSpot.query.filter_by(source=SOURCE)}
+
+    update = CSV_HEADER + '1,Oak St Ramp,44.97,-93.23,3.25,,,,yes\n' + '1,Oak St Ramp (later row),44.97,-93.23,4,,,,yes\n'
+    result = import_spots(io.StringIO(update), SOURCE, method=method)
+
+    # A key repeated in one file is written once, last row wins
+    assert result.rows_written == 1
+    spot = ParkingSpot.query.filter_by(source=SOURCE, source_id='1').one()
+    assert (spot.spot_id, spot.spot_name, spot.cost) == (ids['1'], 'Oak St Ramp (later row)', 4.0)
+    assert ParkingSpot.query.filter_by(source=SOURCE).count() == 4
+
+
+def test_invalid_rows_are_reported(method):
+    bad = CSV_HEADER + (
+        '1,Good,44.97,-93.23,1,,,,yes\n'
+        ',No id,44.97,-93.23,1,,,,yes\n'
+        '3,Half coordinates,44.97,,1,,,,yes\n'
+        '4,Negative,44.97,-93.23,-1,,,,yes\n'
+        '5,Not a bool,44.97,-93.23,1,,,,maybe\n'
+    )
+    result = import_spots(io.StringIO(bad), SOURCE, method=method)
+
+    assert (result.rows_read, result.rows_written, result.rows_rejected) == (5, 1, 4)
+    assert [row for row, _ in result.errors] == [2, 3, 4, 5]
+    assert list(imported()) == ['1']
+
+
+def test_address_only_rows_are_queued_for_geocoding(method, monkeypatch):
+    import spot_import
+
+    submitted = []
+    monkeypatch.setattr(spot_import.geocode_queue, 'submit', lambda spot_id, address: submitted.append((spot_id, address)))
+    rows = CSV_HEADER + (
+        '1,Located,44.97,-93.23,1,1 Oak St,,,yes\n'
+        '2,Address only,,,1,2 Oak St,,,yes\n'
+        '3,Also address only,,,2,"3 Oak St, Minneapolis",,,no\n'
+    )
+    result = import_spots(io.StringIO(rows), SOURCE, method=method)
+
+    ids = {row.source_id: row.spot_id for row in ParkingSpot.query.filter_by(source=SOURCE)}
+    assert result.geocode_queued == 2 and result.to_dict()['geocode_queued'] == 2
+    assert submitted == [(ids['2'], '2 Oak St'), (ids['3'], '3 Oak St, Minneapolis')]
+
+
+def test_copy_is_refused_without_psycopg2(app_context):
+    if copy_supported():
+        pytest.skip('this database supports COPY')
+    with pytest.raises(SpotImportError):
+        import_spots(io.StringIO(TRICKY_CSV), SOURCE, method='copy')
+    assert ParkingSpot.query.filter_by(source=SOURCE).count() == 0
@@ -0,0 +1,219 @@
+"""
+Mapbox Vector Tiles of parking spots for the map
+Spots are bucketed into z/x/y tiles once per snapshot and each tile is encoded
+on first request, then kept until a new spot lands in it.
+"""
+import hashlib
+import struct
+import threading
+from math import log, tan, cos, pi, radians
+from http_cache import encode
+
+
+LAYER_NAME = 'spots'
+TILE_EXTENT = 4096
+
+# Zooms tiles are generated for; MapLibre overzooms the last one past MAX_TILE_ZOOM
+MIN_TILE_ZOOM = 10
+MAX_TILE_ZOOM = 16
+
+# Web Mercator can't show the poles, clamp before projecting
+MAX_LATITUDE = 85.05112878
+
+# Spot attributes carried in each feature, enough to draw and select a spot
+TILE_PROPERTIES = (
+    'spot_id',
+    'spot_name',
+    'campus_location',
+    'parking_type',
+    'cost',
+    'walk_time',
+    'is_verified',
+)
+
+
+# ============= PROJECTION =============
+def tile_position(lat, lon, zoom):
+    """
+    Fractional Web Mercator tile coordinates of a point at a zoom level
+    """
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    scale = 1 << zoom
+    x = (lon + 180.0) / 360.0 * scale
+    y = (1.0 - log(tan(radians(lat)) + 1.0 / cos(radians(lat))) / pi) / 2.0 * scale
+    # lon=180 would land one tile past the edge
+    return min(x, scale - 1e-9), min(max(y, 0.0), scale - 1e-9)
+
+
+def tile_keys(record, min_zoom, max_zoom):
+    """
+    (z, x, y) of the tile holding a spot at every zoom level
+    """
+    keys = []
+    for zoom in range(min_zoom, max_zoom + 1):
+        x, y = tile_position(record.latitude, record.longitude, zoom)
+        keys.append((zoom, int(x), int(y)))
+    return keys
+
+
+# ============= PROTOBUF ENCODING =============
+# Just enough of the protobuf wire format for point features, see
+# https://github.com/mapbox/vector-tile-spec/tree/master/2.1
+def varint(value):
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 63)
+
+
+def field_varint(number, value):
+    return varint(number << 3) + varint(value)
+
+
+def field_bytes(number, data):
+    return varint((number << 3) | 2) + varint(len(data)) + data
+
+
+def field_double(number, value):
+    return varint((number << 3) | 1) + struct.pack('<d', value)
+
+
+def encode_value(value):
+    """
+    A vector tile Value message
+    """
+    if isinstance(value, bool):
+        return field_varint(7, int(value))
+    if isinstance(value, int):
+        return field_varint(6, zigzag(value))
+    if isinstance(value, float):
+        return field_double(3, value)
+    return field_bytes(1, str(value).encode('utf-8'))
+
+
+def encode_tile(zoom, x, y, records):
+    """
+    One layer of point features for the spots in tile z/x/y, as MVT bytes
+    """
+    keys = {}
+    values = {}
+    features = []
+    for record in records:
+        tags = []
+        for name in TILE_PROPERTIES:
+            value = getattr(record, name)
+            if value is None:
+                continue
+            tags.append(keys.setdefault(name, len(keys)))
+            tags.append(values.setdefault((type(value), value), len(values)))
+
+        px, py = tile_position(record.latitude, record.longitude, zoom)
+        px = int(round((px - x) * TILE_EXTENT))
+        py = int(round((py - y) * TILE_EXTENT))
+        # MoveTo, one point, then the zigzagged position in tile units
+        geometry = varint(9) + varint(zigzag(px)) + varint(zigzag(py))
+
+        features.append(field_bytes(2, b''.join([
+            field_varint(1, record.spot_id),
+            field_bytes(2, b''.join(varint(tag) for tag in tags)),
+            field_varint(3, 1),  # POINT
+            field_bytes(4, geometry),
+        ])))
+
+    layer = b''.join([
+        field_varint(15, 2),
+        field_bytes(1, LAYER_NAME.encode('utf-8')),
+        *features,
+        *(field_bytes(3, name.encode('utf-8')) for name in keys),
+        *(field_bytes(4, encode_value(value)) for _, value in values),
+        field_varint(5, TILE_EXTENT),
+    ])
+    return field_bytes(3, layer)
+
+
+# ============= TILE INDEX =============
+class EncodedTile:
+    """
+    Encoded bytes of one tile, with a content-based ETag
+    Compressed variants are added on first request for them
+    """
+
+    def __init__(self, body):
+        self.etag = hashlib.sha1(body).hexdigest()[:20]
+        self.bodies = {'identity': body}
+
+    def body(self, encoding):
+        data = self.bodies.get(encoding)
+        if data is None:
+            data = self.bodies[encoding] = encode(self.bodies['identity'], encoding)
+        return data
+
+    def __len__(self):
+        return len(self.bodies['identity'])
+
+
+class TileIndex:
+    """
+    Spots bucketed by tile for every zoom between min_zoom and max_zoom
+
+    with_record copies the bucket map and drops only the encoded tiles the new
+    spot falls in, so every other tile keeps its bytes and ETag across versions.
+    """
+
+    def __init__(self, records=(), min_zoom=MIN_TILE_ZOOM, max_zoom=MAX_TILE_ZOOM):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.buckets = {}
+        self._encoded = {}
+        self._lock = threading.Lock()
+        for record in records:
+            for key in tile_keys(record, min_zoom, max_zoom):
+                self.buckets.setdefault(key, []).append(record)
+        self.buckets = {key: tuple(records) for key, records in self.buckets.items()}
+
+    def with_record(self, record):
+        """
+        Return a copy of the index with one more spot
+        """
+        if not record.has_coordinates():
+            return self
+        index = TileIndex(min_zoom=self.min_zoom, max_zoom=self.max_zoom)
+        index.buckets = dict(self.buckets)
+        with self._lock:
+            index._encoded = dict(self._encoded)
+        for key in tile_keys(record, self.min_zoom, self.max_zoom):
+            index.buckets[key] = index.buckets.get(key, ()) + (record,)
+            index._encoded.pop(key, None)
+        return index
+
+    def tile(self, zoom, x, y):
+        """
+        The EncodedTile for z/x/y, or None if no spots fall in it
+        """
+        key = (zoom, x, y)
+        records = self.buckets.get(key)
+        if not records:
+            return None
+        with self._lock:
+            tile = self._encoded.get(key)
+        if tile is None:
+            tile = EncodedTile(encode_tile(zoom, x, y, records))
+            with self._lock:
+                tile = self._encoded.setdefault(key, tile)
+        return tile
+
+    def __len__(self):
+        return len(self.buckets)
+
+
+def build_tile_index(snapshot):
+    """
+    Build the tile index for a spot snapshot, over spots that have coordinates
+    """
+    return TileIndex(snapshot.located_records())
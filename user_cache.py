@@ -0,0 +1,105 @@
+"""
+Bounded, TTL-evicting cache in front of the Flask-Login user loader
+"""
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy.orm import make_transient_to_detached
+from models import db, User
+
+
+class UserCache:
+    """
+    Keeps detached copies of recently loaded users
+
+    A hit merges the cached copy into the current session without a query, so
+    the request gets its own attached User and changes to it still commit
+    normally. Entries expire after ttl seconds, which also bounds how long
+    another worker can serve a profile that changed elsewhere; changes made in
+    this worker call invalidate() and are visible immediately.
+    """
+
+    def __init__(self, maxsize=1024, ttl=30.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # user_id -> (expires_at, detached User)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.maxsize = app.config.get('USER_CACHE_SIZE', self.maxsize)
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+
+    def load(self, user_id):
+        """
+        Get a user attached to the current session, from cache if possible
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                cached = entry[1]
+            else:
+                if entry is not None:
+                    del self._entries[user_id]
+                    self.evictions += 1
+                self.misses += 1
+                cached = None
+
+        if cached is not None:
+            return db.session.merge(cached, load=False)
+
+        user = db.session.get(User, user_id)
+        if user is not None:
+            self._store(user_id, detached_copy(user), now)
+        return user
+
+    def invalidate(self, user_id):
+        """
+        Forget a user, call after committing changes to them
+        """
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Hit/miss counters for monitoring
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+    def _store(self, user_id, user, now):
+        with self._lock:
+            self._entries[user_id] = (now + self.ttl, user)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+def detached_copy(user):
+    """
+    A clean, detached User with the same column values, safe to share between requests
+    """
+    copy = User(**{column.key: getattr(user, column.key) for column in User.__table__.columns})
+    make_transient_to_detached(copy)
+    return copy
+
+
+user_cache = UserCache()